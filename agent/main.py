@@ -12,6 +12,13 @@ import subprocess
 import base64
 import io
 import time
+import codecs
+import signal
+import struct
+import hashlib
+import concurrent.futures
+import sqlite3
+import random
 from datetime import datetime
 import logging
 
@@ -39,9 +46,34 @@ except ImportError:
 DEFAULT_SERVER_URL = "ws://localhost:8000/ws/agent/"
 SERVER_URL = DEFAULT_SERVER_URL
 AGENT_VERSION = "1.1.0"
+MAX_CONCURRENT_COMMANDS = int(os.environ.get("RMM_MAX_COMMANDS", "4"))
+COMMAND_TIMEOUT = float(os.environ.get("RMM_COMMAND_TIMEOUT", "30"))
+OUTPUT_CHUNK_SIZE = 4096
+HEARTBEAT_INTERVAL = 5
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = float(os.environ.get("RMM_RECONNECT_MAX_DELAY", "300"))
+SPOOL_PATH = os.environ.get("RMM_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool.db"))
+SPOOL_MAX_ROWS = int(os.environ.get("RMM_SPOOL_MAX_ROWS", "50000"))
+SPOOL_BATCH_SIZE = 500
+# Messages worth keeping while disconnected; everything else is live-only
+SPOOLED_MESSAGE_TYPES = ('command_output', 'command_response')
+STREAM_TILE_SIZE = 64
+STREAM_JPEG_QUALITY = 60
+STREAM_MAX_FPS = 15
+
+# Binary screen frame layout, shared with devices/screen.py on the server
+FRAME_MAGIC = b'SF'
+FRAME_VERSION = 1
+FRAME_FLAG_KEYFRAME = 0x01
+FRAME_HEADER = struct.Struct('!2sBBIHHH')
+FRAME_TILE = struct.Struct('!HHHHI')
 
 # Global websocket reference for GUI actions
 metrics_websocket = None
+command_runner = None
+screen_streamer = None
+spool = None
+reconnect_backoff = None
 
 def get_mac_address():
     mac_num = uuid.getnode()
@@ -66,33 +98,160 @@ def get_system_info():
         "agent_version": AGENT_VERSION
     }
 
+class Spool:
+    """
+    Bounded on-disk queue (SQLite) of samples and results produced while the
+    server is unreachable. Rows are deleted once the server acknowledges the
+    batch that carried them; beyond `max_rows` the oldest rows are dropped.
+    """
+    def __init__(self, path=SPOOL_PATH, max_rows=SPOOL_MAX_ROWS):
+        self.max_rows = max_rows
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def append(self, kind, payload):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO spool (kind, payload) VALUES (?, ?)", (kind, json.dumps(payload))
+            )
+            self.conn.execute("DELETE FROM spool WHERE id <= ?", (cursor.lastrowid - self.max_rows,))
+
+    def read(self, after_id=0, limit=SPOOL_BATCH_SIZE):
+        rows = self.conn.execute(
+            "SELECT id, kind, payload FROM spool WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        return [(row_id, kind, json.loads(payload)) for row_id, kind, payload in rows]
+
+    def acknowledge(self, upto_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM spool WHERE id <= ?", (upto_id,))
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time in
+    [0, min(cap, base * 2**n)]. A `retry_after` hint from the server sets the
+    minimum for the next retry, with jitter added on top.
+    """
+    def __init__(self, base=RECONNECT_BASE_DELAY, cap=RECONNECT_MAX_DELAY):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+        self.retry_after = None
+
+    def next_delay(self):
+        ceiling = min(self.cap, self.base * 2 ** self.attempt)
+        self.attempt += 1
+        if self.retry_after is not None:
+            hint, self.retry_after = self.retry_after, None
+            return hint + random.uniform(0, min(self.cap, max(hint, ceiling)))
+        return random.uniform(0, ceiling)
+
+    def hint(self, seconds):
+        self.retry_after = max(0.0, float(seconds))
+
+    def reset(self):
+        self.attempt = 0
+        self.retry_after = None
+
+def get_backoff():
+    global reconnect_backoff
+    if reconnect_backoff is None:
+        reconnect_backoff = Backoff()
+    return reconnect_backoff
+
+def get_spool():
+    global spool
+    if spool is None:
+        spool = Spool()
+    return spool
+
+def collect_sample():
+    cpu = psutil.cpu_percent()
+    ram = psutil.virtual_memory().percent
+    try:
+        disk = psutil.disk_usage('/').percent
+    except:
+        disk = 0
+    return {
+        "cpu_usage": cpu,
+        "ram_usage": ram,
+        "disk_usage": disk
+    }
+
+def spool_sample(sample):
+    # Compact row: [unix time, cpu, ram, disk]
+    get_spool().append('heartbeat', [time.time(), sample['cpu_usage'], sample['ram_usage'], sample['disk_usage']])
+
 async def heartbeat_task(websocket):
     while True:
+        sample = None
         try:
-            cpu = psutil.cpu_percent()
-            ram = psutil.virtual_memory().percent
-            try:
-                disk = psutil.disk_usage('/').percent
-            except:
-                disk = 0
-            
+            sample = collect_sample()
             payload = {
                 "type": "heartbeat",
-                "data": {
-                    "cpu_usage": cpu,
-                    "ram_usage": ram,
-                    "disk_usage": disk
-                }
+                "data": sample
             }
             await websocket.send(json.dumps(payload))
-            await asyncio.sleep(5)
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
         except websockets.exceptions.ConnectionClosed:
             logging.warning("Heartbeat: Connection closed")
+            if sample:
+                spool_sample(sample)
             break
         except Exception as e:
             logging.error(f"Heartbeat error: {e}")
             break
 
+async def spool_while_disconnected(delay):
+    """
+    Sleep before reconnecting, recording metric samples to the spool meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + delay
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(HEARTBEAT_INTERVAL, remaining))
+        try:
+            spool_sample(collect_sample())
+        except Exception as e:
+            logging.error(f"Spool error: {e}")
+
+async def replay_spool(websocket):
+    """
+    Send everything spooled during an outage as compact `batch` messages, back
+    to back. Rows are removed when the matching `batch_ack` arrives, or a
+    `batch_reject` (the server will never accept that batch, so it is dropped).
+    """
+    store = get_spool()
+    after_id = 0
+    sent = 0
+    while True:
+        rows = store.read(after_id)
+        if not rows:
+            break
+        heartbeats = [payload for _, kind, payload in rows if kind == 'heartbeat']
+        messages = [payload for _, kind, payload in rows if kind == 'message']
+        after_id = rows[-1][0]
+        await websocket.send(json.dumps({
+            "type": "batch",
+            "data": {"batch_id": after_id, "heartbeats": heartbeats, "messages": messages}
+        }))
+        sent += len(rows)
+    if sent:
+        logging.info(f"Replayed {sent} spooled records")
+    return sent
+
 async def receive_task(websocket):
     global metrics_websocket
     metrics_websocket = websocket
@@ -106,11 +265,34 @@ async def receive_task(websocket):
                 # Handle direct commands or wrapped commands
                 if msg_type == 'command':
                     cmd = data.get('command') or content.get('command')
-                    await handle_command(websocket, cmd)
+                    command_id = data.get('command_id') or content.get('command_id')
+                    # Runs in the background so heartbeats keep flowing
+                    get_command_runner().submit(websocket, cmd, command_id)
+                elif msg_type == 'cancel_command':
+                    get_command_runner().cancel(data.get('command_id'), kill=data.get('kill', False))
                 elif msg_type == 'get_screenshot':
                     await handle_screenshot(websocket)
+                elif msg_type == 'start_stream':
+                    get_screen_streamer().start(websocket, fps=data.get('fps'))
+                elif msg_type == 'stop_stream':
+                    get_screen_streamer().stop()
+                elif msg_type == 'request_keyframe':
+                    get_screen_streamer().request_keyframe()
+                elif msg_type == 'batch_ack':
+                    get_spool().acknowledge(data.get('batch_id', 0))
+                    if data.get('rejected'):
+                        logging.warning(f"Server skipped {data['rejected']} malformed spooled records")
+                elif msg_type == 'batch_reject':
+                    logging.warning(f"Server rejected spooled batch {data.get('batch_id')}; dropping it")
+                    get_spool().acknowledge(data.get('batch_id', 0))
                 elif msg_type == 'handshake_ack':
+                    get_backoff().reset()
                     logging.info(f"Registered with ID: {data.get('device_id')}")
+                    # Catch up on anything recorded while disconnected
+                    await replay_spool(websocket)
+                elif msg_type == 'handshake_defer':
+                    get_backoff().hint(data.get('retry_after', 0))
+                    logging.warning(f"Server busy, retry after {data.get('retry_after')}s")
             except json.JSONDecodeError as e:
                 logging.error(f"JSON decode error: {e}")
             except Exception as e:
@@ -118,36 +300,149 @@ async def receive_task(websocket):
     except websockets.exceptions.ConnectionClosed:
         logging.warning("Receive: Connection closed")
 
-async def handle_command(websocket, cmd):
-    if not cmd:
-        return
-    
-    logging.info(f"Executing command: {cmd}")
+async def send_message(websocket, payload):
     try:
-        # Run command
-        proc = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
-        output = proc.stdout + proc.stderr
-        
-        response = {
+        await websocket.send(json.dumps(payload))
+        return True
+    except websockets.exceptions.ConnectionClosed:
+        if payload.get('type') in SPOOLED_MESSAGE_TYPES:
+            get_spool().append('message', payload)
+        else:
+            logging.warning(f"Dropped {payload.get('type')} message: connection closed")
+        return False
+
+class CommandRunner:
+    """
+    Runs shell commands as asyncio subprocesses, at most `max_concurrent` at a time.
+    Output is streamed back as `command_output` chunks numbered by `seq`, followed
+    by one `command_response` carrying the exit code.
+    """
+    def __init__(self, max_concurrent=MAX_CONCURRENT_COMMANDS, timeout=COMMAND_TIMEOUT):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.timeout = timeout
+        self.tasks = {}      # command_id -> asyncio.Task
+        self.processes = {}  # command_id -> running Process
+        self.cancelled = set()
+
+    def submit(self, websocket, cmd, command_id=None):
+        if not cmd:
+            return None
+        command_id = command_id or uuid.uuid4().hex
+        task = asyncio.create_task(self.run(websocket, cmd, command_id))
+        self.tasks[command_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(command_id, None))
+        return command_id
+
+    def cancel(self, command_id, kill=False):
+        if command_id in self.processes:
+            self.cancelled.add(command_id)
+            _signal_process(self.processes[command_id], kill)
+            return True
+        task = self.tasks.get(command_id)
+        if task:
+            # Still waiting for a free slot
+            self.cancelled.add(command_id)
+            task.cancel()
+            return True
+        return False
+
+    async def run(self, websocket, cmd, command_id):
+        status = 'completed'
+        exit_code = -1
+        seq = 0
+
+        async def pump(stream, name):
+            nonlocal seq
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                chunk = await stream.read(OUTPUT_CHUNK_SIZE)
+                text = decoder.decode(chunk, final=not chunk)
+                if text:
+                    current, seq = seq, seq + 1
+                    await send_message(websocket, {
+                        "type": "command_output",
+                        "data": {"command_id": command_id, "seq": current, "stream": name, "output": text}
+                    })
+                if not chunk:
+                    return
+
+        try:
+            async with self.semaphore:
+                logging.info(f"Executing command {command_id}: {cmd}")
+                proc = await asyncio.create_subprocess_shell(
+                    cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=(os.name != 'nt'),
+                )
+                self.processes[command_id] = proc
+                try:
+                    await asyncio.wait_for(
+                        asyncio.gather(pump(proc.stdout, 'stdout'), pump(proc.stderr, 'stderr'), proc.wait()),
+                        timeout=self.timeout,
+                    )
+                except asyncio.TimeoutError:
+                    status = 'timeout'
+                    _signal_process(proc, kill=True)
+                    await proc.wait()
+                except asyncio.CancelledError:
+                    _signal_process(proc, kill=True)
+                    raise
+                finally:
+                    self.processes.pop(command_id, None)
+                exit_code = proc.returncode
+                if command_id in self.cancelled:
+                    status = 'cancelled'
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        except Exception as e:
+            status = 'error'
+            await send_message(websocket, {
+                "type": "command_output",
+                "data": {"command_id": command_id, "seq": seq, "stream": "stderr", "output": str(e)}
+            })
+            seq += 1
+        finally:
+            self.cancelled.discard(command_id)
+
+        await send_message(websocket, {
             "type": "command_response",
             "data": {
+                "command_id": command_id,
                 "command": cmd,
-                "output": output,
-                "exit_code": proc.returncode,
+                "status": status,
+                "exit_code": exit_code,
+                "chunks": seq,
                 "timestamp": datetime.now().isoformat()
             }
-        }
-        await websocket.send(json.dumps(response))
-    except subprocess.TimeoutExpired:
-        await websocket.send(json.dumps({
-            "type": "command_response",
-            "data": {"command": cmd, "output": "Timeout expired", "exit_code": -1}
-        }))
-    except Exception as e:
-        await websocket.send(json.dumps({
-            "type": "command_response",
-            "data": {"command": cmd, "output": str(e), "exit_code": -1}
-        }))
+        })
+        return exit_code
+
+def _signal_process(proc, kill=False):
+    try:
+        if os.name != 'nt':
+            # The shell runs in its own session; signal the whole group
+            os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+        elif kill:
+            proc.kill()
+        else:
+            proc.terminate()
+    except ProcessLookupError:
+        pass
+
+def get_command_runner():
+    global command_runner
+    if command_runner is None:
+        command_runner = CommandRunner(MAX_CONCURRENT_COMMANDS, COMMAND_TIMEOUT)
+    return command_runner
+
+async def handle_command(websocket, cmd, command_id=None):
+    """
+    Run one command to completion (output is streamed while it runs).
+    """
+    if not cmd:
+        return None
+    return await get_command_runner().run(websocket, cmd, command_id or uuid.uuid4().hex)
 
 async def handle_screenshot(websocket):
     if not SCREENSHOT_AVAILABLE:
@@ -186,6 +481,119 @@ async def handle_screenshot(websocket):
             "error": str(e)
         }))
 
+def diff_tiles(raw, width, height, previous, tile_size=STREAM_TILE_SIZE):
+    """
+    Compares a BGRA frame against the tile hashes of the previous frame.
+    Returns (changed tile rects, new hashes). A band of rows that hashes the
+    same as before is skipped without looking at its tiles.
+    """
+    stride = width * 4
+    hashes = {}
+    changed = []
+    for y in range(0, height, tile_size):
+        h = min(tile_size, height - y)
+        band = raw[y * stride:(y + h) * stride]
+        band_key = ('band', y)
+        band_hash = hashlib.blake2b(band, digest_size=8).digest()
+        hashes[band_key] = band_hash
+        if previous.get(band_key) == band_hash:
+            for x in range(0, width, tile_size):
+                hashes[(x, y)] = previous.get((x, y))
+            continue
+        for x in range(0, width, tile_size):
+            w = min(tile_size, width - x)
+            rows = b''.join(band[r * stride + x * 4:r * stride + (x + w) * 4] for r in range(h))
+            tile_hash = hashlib.blake2b(rows, digest_size=8).digest()
+            hashes[(x, y)] = tile_hash
+            if previous.get((x, y)) != tile_hash:
+                changed.append((x, y, w, h))
+    return changed, hashes
+
+def encode_frame(tiles, width, height, seq, keyframe=False):
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_FLAG_KEYFRAME if keyframe else 0,
+                               seq & 0xFFFFFFFF, width, height, len(tiles))]
+    for x, y, w, h, jpeg in tiles:
+        parts.append(FRAME_TILE.pack(x, y, w, h, len(jpeg)))
+        parts.append(jpeg)
+    return b''.join(parts)
+
+class ScreenStreamer:
+    """
+    Streams the primary monitor as binary frames that only carry changed tiles.
+    Capture and JPEG encoding run on a dedicated thread (mss handles are not
+    shareable across threads on every platform).
+    """
+    def __init__(self, tile_size=STREAM_TILE_SIZE, quality=STREAM_JPEG_QUALITY):
+        self.tile_size = tile_size
+        self.quality = quality
+        self.fps = 5
+        self.seq = 0
+        self.hashes = {}
+        self.keyframe_requested = True
+        self.task = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen")
+        self._sct = None
+
+    def start(self, websocket, fps=None):
+        if fps:
+            self.fps = max(1, min(float(fps), STREAM_MAX_FPS))
+        self.request_keyframe()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(websocket))
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def capture_frame(self):
+        if self._sct is None:
+            self._sct = mss.mss()
+        sct_img = self._sct.grab(self._sct.monitors[1])
+        width, height = sct_img.size
+        raw = sct_img.bgra
+
+        keyframe = self.keyframe_requested
+        self.keyframe_requested = False
+        changed, self.hashes = diff_tiles(raw, width, height, {} if keyframe else self.hashes, self.tile_size)
+        if not changed:
+            return None
+
+        img = Image.frombytes("RGB", sct_img.size, raw, "raw", "BGRX")
+        tiles = []
+        for x, y, w, h in changed:
+            buffer = io.BytesIO()
+            img.crop((x, y, x + w, y + h)).save(buffer, format="JPEG", quality=self.quality)
+            tiles.append((x, y, w, h, buffer.getvalue()))
+        self.seq += 1
+        return encode_frame(tiles, width, height, self.seq, keyframe)
+
+    async def run(self, websocket):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                frame = await loop.run_in_executor(self._executor, self.capture_frame)
+                if frame:
+                    await websocket.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                return
+            except Exception as e:
+                logging.error(f"Screen stream error: {e}")
+                self.request_keyframe()
+            await asyncio.sleep(max(0, 1 / self.fps - (loop.time() - started)))
+
+def get_screen_streamer():
+    global screen_streamer
+    if not SCREENSHOT_AVAILABLE:
+        raise RuntimeError("Screenshot library not available")
+    if screen_streamer is None:
+        screen_streamer = ScreenStreamer()
+    return screen_streamer
+
 async def agent_loop():
     while True:
         try:
@@ -211,13 +619,18 @@ async def agent_loop():
                 
                 for task in pending:
                     task.cancel()
+                if screen_streamer:
+                    screen_streamer.stop()
+            logging.warning("Disconnected.")
                     
         except ConnectionRefusedError:
-            logging.warning("Connection refused. Retrying in 5s...")
-            await asyncio.sleep(5)
+            logging.warning("Connection refused.")
         except Exception as e:
-            logging.error(f"Connection failed: {e}. Retrying in 5s...")
-            await asyncio.sleep(5)
+            logging.error(f"Connection failed: {e}.")
+
+        delay = get_backoff().next_delay()
+        logging.info(f"Reconnecting in {delay:.1f}s...")
+        await spool_while_disconnected(delay)
 
 def run_async_loop():
     asyncio.run(agent_loop())
@@ -287,8 +700,15 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Omni-RMM Agent")
     parser.add_argument("--server", type=str, help="WebSocket URL")
+    parser.add_argument("--max-commands", type=int, help="Maximum concurrently running commands")
+    parser.add_argument("--command-timeout", type=float, help="Seconds before a command is killed")
     args = parser.parse_args()
     
+    if args.max_commands:
+        MAX_CONCURRENT_COMMANDS = args.max_commands
+    if args.command_timeout:
+        COMMAND_TIMEOUT = args.command_timeout
+
     if args.server:
         SERVER_URL = args.server
     elif os.environ.get("RMM_SERVER_URL"):
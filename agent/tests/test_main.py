@@ -5,11 +5,13 @@ import json
 import logging
 import sys
 import os
+import tempfile
 
 # Mock missing dependencies
 sys.modules['websockets'] = MagicMock()
 sys.modules['websockets.exceptions'] = MagicMock()
 sys.modules['websockets.exceptions'].ConnectionClosed = Exception # Mock exception class
+sys.modules['websockets'].exceptions = sys.modules['websockets.exceptions']
 sys.modules['pystray'] = MagicMock()
 sys.modules['PIL'] = MagicMock()
 sys.modules['PIL.Image'] = MagicMock()
@@ -57,5 +59,218 @@ class TestAgentLogging(unittest.IsolatedAsyncioTestCase):
         # Verify that an error was logged
         self.assertTrue(any("JSON" in log for log in cm.output))
 
+class RecordingWebsocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    def of_type(self, msg_type):
+        return [m['data'] for m in self.sent if m['type'] == msg_type]
+
+
+class TestCommandRunner(unittest.IsolatedAsyncioTestCase):
+    async def test_streams_output_and_exit_code(self):
+        ws = RecordingWebsocket()
+        runner = main.CommandRunner(max_concurrent=2, timeout=10)
+
+        exit_code = await runner.run(ws, "echo hello; echo oops 1>&2; exit 3", "cmd-1")
+
+        self.assertEqual(exit_code, 3)
+        chunks = ws.of_type('command_output')
+        self.assertEqual([c['seq'] for c in chunks], list(range(len(chunks))))
+        stdout = ''.join(c['output'] for c in chunks if c['stream'] == 'stdout')
+        stderr = ''.join(c['output'] for c in chunks if c['stream'] == 'stderr')
+        self.assertEqual(stdout.strip(), 'hello')
+        self.assertEqual(stderr.strip(), 'oops')
+
+        response = ws.of_type('command_response')[-1]
+        self.assertEqual(response['command_id'], 'cmd-1')
+        self.assertEqual(response['exit_code'], 3)
+        self.assertEqual(response['status'], 'completed')
+        self.assertEqual(response['chunks'], len(chunks))
+
+    async def test_commands_run_concurrently(self):
+        ws = RecordingWebsocket()
+        runner = main.CommandRunner(max_concurrent=3, timeout=10)
+
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(runner.run(ws, "sleep 0.5", f"cmd-{i}") for i in range(3)))
+        elapsed = asyncio.get_running_loop().time() - started
+
+        self.assertLess(elapsed, 1.4)
+        self.assertEqual(len(ws.of_type('command_response')), 3)
+
+    async def test_timeout_kills_command(self):
+        ws = RecordingWebsocket()
+        runner = main.CommandRunner(max_concurrent=1, timeout=0.3)
+
+        await runner.run(ws, "sleep 10", "slow")
+
+        self.assertEqual(ws.of_type('command_response')[-1]['status'], 'timeout')
+
+    async def test_cancel_running_and_queued_commands(self):
+        ws = RecordingWebsocket()
+        runner = main.CommandRunner(max_concurrent=1, timeout=10)
+
+        runner.submit(ws, "sleep 10", "running")
+        runner.submit(ws, "sleep 10", "queued")
+        await asyncio.sleep(0.3)
+
+        self.assertTrue(runner.cancel("queued"))
+        self.assertTrue(runner.cancel("running", kill=True))
+        await asyncio.gather(*runner.tasks.values(), return_exceptions=True)
+        await asyncio.sleep(0)
+
+        statuses = {r['command_id']: r['status'] for r in ws.of_type('command_response')}
+        self.assertEqual(statuses, {'running': 'cancelled', 'queued': 'cancelled'})
+        self.assertFalse(runner.cancel("unknown"))
+
+    async def test_receive_task_does_not_block_on_commands(self):
+        messages = [
+            json.dumps({'type': 'command', 'command': 'sleep 5', 'command_id': 'bg'}),
+            json.dumps({'type': 'cancel_command', 'command_id': 'bg'}),
+        ]
+
+        class ScriptedWebsocket(RecordingWebsocket):
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                if not messages:
+                    raise StopAsyncIteration
+                await asyncio.sleep(0.2)
+                return messages.pop(0)
+
+        ws = ScriptedWebsocket()
+        main.command_runner = main.CommandRunner(max_concurrent=1, timeout=10)
+        try:
+            await asyncio.wait_for(main.receive_task(ws), timeout=2)
+            await asyncio.gather(*main.command_runner.tasks.values(), return_exceptions=True)
+        finally:
+            main.command_runner = None
+
+        self.assertEqual(ws.of_type('command_response')[-1]['status'], 'cancelled')
+
+class TestScreenTiles(unittest.TestCase):
+    width, height = 130, 70
+
+    def frame(self, fill=0, patch=None):
+        raw = bytearray([fill]) * (self.width * self.height * 4)
+        if patch:
+            x, y = patch
+            offset = (y * self.width + x) * 4
+            raw[offset:offset + 4] = b'\xff\xff\xff\xff'
+        return bytes(raw)
+
+    def test_first_frame_sends_every_tile(self):
+        changed, _ = main.diff_tiles(self.frame(), self.width, self.height, {}, tile_size=64)
+        self.assertEqual(len(changed), 3 * 2)
+        self.assertIn((128, 64, 2, 6), changed)
+
+    def test_unchanged_frame_sends_nothing(self):
+        _, hashes = main.diff_tiles(self.frame(), self.width, self.height, {}, tile_size=64)
+        changed, _ = main.diff_tiles(self.frame(), self.width, self.height, hashes, tile_size=64)
+        self.assertEqual(changed, [])
+
+    def test_only_changed_tile_is_sent(self):
+        _, hashes = main.diff_tiles(self.frame(), self.width, self.height, {}, tile_size=64)
+        changed, hashes = main.diff_tiles(self.frame(patch=(70, 10)), self.width, self.height, hashes, tile_size=64)
+        self.assertEqual(changed, [(64, 0, 64, 64)])
+        changed, _ = main.diff_tiles(self.frame(patch=(70, 10)), self.width, self.height, hashes, tile_size=64)
+        self.assertEqual(changed, [])
+
+    def test_encode_frame_layout(self):
+        frame = main.encode_frame([(64, 0, 64, 64, b'jpeg')], 130, 70, seq=7, keyframe=True)
+        magic, version, flags, seq, width, height, count = main.FRAME_HEADER.unpack_from(frame)
+        self.assertEqual((magic, version, flags, seq, width, height, count), (b'SF', 1, 1, 7, 130, 70, 1))
+        self.assertEqual(main.FRAME_TILE.unpack_from(frame, main.FRAME_HEADER.size), (64, 0, 64, 64, 4))
+        self.assertTrue(frame.endswith(b'jpeg'))
+
+class TestSpool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        main.spool = main.Spool(os.path.join(self.tmp.name, 'spool.db'), max_rows=3)
+
+    def tearDown(self):
+        main.spool.conn.close()
+        main.spool = None
+        self.tmp.cleanup()
+
+    async def test_spool_is_bounded(self):
+        for i in range(5):
+            main.spool.append('heartbeat', [i, 1, 2, 3])
+        self.assertEqual(len(main.spool), 3)
+        self.assertEqual([payload[0] for _, _, payload in main.spool.read()], [2, 3, 4])
+
+    async def test_failed_results_are_spooled(self):
+        class ClosedWebsocket:
+            async def send(self, message):
+                raise main.websockets.exceptions.ConnectionClosed()
+
+        ws = ClosedWebsocket()
+        await main.send_message(ws, {'type': 'command_response', 'data': {'command_id': 'x'}})
+        await main.send_message(ws, {'type': 'screenshot', 'data': {}})
+        rows = main.spool.read()
+        self.assertEqual([(kind, payload['type']) for _, kind, payload in rows], [('message', 'command_response')])
+
+    async def test_replay_sends_batches_until_acknowledged(self):
+        main.spool.append('heartbeat', [1700000000.5, 10, 20, 30])
+        main.spool.append('message', {'type': 'command_response', 'data': {'command_id': 'x'}})
+        ws = RecordingWebsocket()
+
+        self.assertEqual(await main.replay_spool(ws), 2)
+
+        batch = ws.of_type('batch')[0]
+        self.assertEqual(batch['heartbeats'], [[1700000000.5, 10, 20, 30]])
+        self.assertEqual(batch['messages'][0]['data']['command_id'], 'x')
+        # Nothing is dropped until the server confirms the batch
+        self.assertEqual(len(main.spool), 2)
+        main.spool.acknowledge(batch['batch_id'])
+        self.assertEqual(len(main.spool), 0)
+
+    async def test_rejected_batch_is_dropped(self):
+        main.spool.append('heartbeat', [1700000000.5, 10, 20, 30])
+        main.spool.append('heartbeat', ['garbage'])
+        batch_id = main.spool.read()[-1][0]
+
+        class ServerReplies:
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                if replies:
+                    return json.dumps(replies.pop(0))
+                raise StopAsyncIteration
+
+        replies = [{'type': 'batch_reject', 'batch_id': batch_id}]
+        await main.receive_task(ServerReplies())
+        self.assertEqual(len(main.spool), 0)
+
+class TestBackoff(unittest.TestCase):
+    def test_full_jitter_within_exponential_ceiling(self):
+        backoff = main.Backoff(base=1, cap=8)
+        for ceiling in (1, 2, 4, 8, 8):
+            delay = backoff.next_delay()
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, ceiling)
+
+    def test_retry_after_hint_is_a_floor(self):
+        backoff = main.Backoff(base=1, cap=300)
+        backoff.hint(30)
+        delay = backoff.next_delay()
+        self.assertGreaterEqual(delay, 30)
+        self.assertLessEqual(delay, 60)
+        # The hint only applies once
+        self.assertLessEqual(backoff.next_delay(), 4)
+
+    def test_reset_after_successful_handshake(self):
+        backoff = main.Backoff(base=1, cap=300)
+        for _ in range(6):
+            backoff.next_delay()
+        backoff.reset()
+        self.assertLessEqual(backoff.next_delay(), 1)
+
 if __name__ == '__main__':
     unittest.main()
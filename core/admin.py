@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import Notification, User
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -8,3 +8,10 @@ class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
         ('Additional Info', {'fields': ('role', 'phone', 'company_name')}),
     )
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'subject', 'digest', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status', 'digest')
+    search_fields = ('recipient', 'subject')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
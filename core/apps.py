@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = "core"
+
+    def ready(self):
+        # Registers the notification dispatcher with the background workers
+        from . import notifications  # noqa: F401
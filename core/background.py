@@ -0,0 +1,135 @@
+"""
+Process-wide background workers.
+
+Workers accumulate work in memory and flush it periodically from an asyncio
+task running on the ASGI event loop. Flushes run in the database thread via
+database_sync_to_async, and every registered worker gets a final synchronous
+flush when the process exits.
+
+WorkersMiddleware (wrapped around the ASGI application in omni_rmm/asgi.py)
+starts the workers at server startup on servers that send ASGI lifespan
+events, and otherwise (Daphne) with the first HTTP or WebSocket connection.
+Processes that serve nothing through ASGI, such as WSGI servers, run no
+workers; their jobs have management commands to run from cron.
+"""
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+_workers = []
+
+
+class PeriodicWorker:
+    """
+    Base class for write-behind / periodic jobs.
+    Subclasses implement run_once(), which is called from a sync context.
+    """
+    name = 'worker'
+    interval = 1.0
+
+    def __init__(self, interval=None):
+        if interval is not None:
+            self.interval = interval
+        self._task = None
+
+    def run_once(self):
+        raise NotImplementedError
+
+    async def arun_once(self):
+        return await database_sync_to_async(self.run_once)()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Start the periodic task on the running event loop. Safe to call repeatedly.
+        """
+        loop = asyncio.get_running_loop()
+        if self.running and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run(), name=f"worker:{self.name}")
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.arun_once()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.arun_once()
+            except Exception:
+                logger.exception("Background worker %s failed", self.name)
+
+    def shutdown(self):
+        """
+        Final synchronous flush, called at process exit.
+        """
+        self.run_once()
+
+
+def register(worker):
+    _workers.append(worker)
+    return worker
+
+
+def start_all():
+    for worker in _workers:
+        worker.start()
+
+
+async def stop_all():
+    for worker in _workers:
+        try:
+            await worker.stop()
+        except Exception:
+            logger.exception("Stopping %s failed", worker.name)
+
+
+class WorkersMiddleware:
+    """
+    ASGI middleware that runs the registered workers on the server's event loop.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        start_all()
+        await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_all()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await stop_all()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def shutdown_all():
+    for worker in _workers:
+        try:
+            worker.shutdown()
+        except Exception:
+            logger.exception("Shutdown flush failed for %s", worker.name)
+
+
+atexit.register(shutdown_all)
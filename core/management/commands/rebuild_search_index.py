@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search indexes from their source tables."
+
+    def handle(self, *args, **options):
+        for index in search.registered():
+            count = index.rebuild()
+            self.stdout.write(f"{index.table}: indexed {count} rows")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.notifications import NotificationDispatcher
+
+
+class Command(BaseCommand):
+    help = "Sends the emails that are due in the notification outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Notifications claimed per pass")
+
+    def handle(self, *args, **options):
+        dispatcher = NotificationDispatcher(batch_size=options['batch_size'])
+        while dispatcher.run_once():
+            pass
+        self.stdout.write(f"Sent {dispatcher.sent} emails, {dispatcher.failed} failed")
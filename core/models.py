@@ -13,3 +13,35 @@ class User(AbstractUser):
 
     def __str__(self):
         return f"{self.username} ({self.role})"
+
+
+class Notification(models.Model):
+    """
+    Outbox for outgoing email. Rows are written in the sender's transaction and
+    delivered by the background dispatcher (see core/notifications.py).
+    Pending rows sharing a recipient and digest key are sent as one email.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    digest = models.CharField(max_length=100, blank=True, help_text="Pending notifications with the same digest are combined per recipient")
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    send_after = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='notification_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient}: {self.subject} ({self.status})"
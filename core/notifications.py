@@ -0,0 +1,201 @@
+"""
+Email outbox.
+
+notify() only inserts Notification rows, inside the caller's transaction, so
+saving a ticket or flushing alerts never waits on SMTP and a rolled-back
+change sends nothing. The dispatcher picks up due rows in batches and sends
+them over a single SMTP connection per pass. Rows queued with a digest key
+are held for the digest window and then sent as one email per recipient
+(200 offline alerts become one message). Failed sends are retried with
+exponential backoff up to NOTIFY_MAX_ATTEMPTS. No database transaction is
+held while talking to the mail server, and in the background worker SMTP
+runs in its own thread rather than the database thread every consumer
+shares, with EMAIL_TIMEOUT bounding each connection.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import background
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+CLAIM_LEASE = 300
+# Seconds, when EMAIL_TIMEOUT is not set
+SMTP_TIMEOUT = 30
+
+
+def prepare(recipients, subject, body, digest=''):
+    """
+    Unsaved Notifications of one message to each address in `recipients`, for
+    callers that queue many messages with one bulk_create.
+    """
+    send_after = timezone.now()
+    if digest:
+        send_after += timedelta(seconds=getattr(settings, 'NOTIFY_DIGEST_WINDOW', 60))
+    return [
+        Notification(recipient=address, subject=subject[:255], body=body, digest=digest, send_after=send_after)
+        for address in sorted({address for address in recipients if address})
+    ]
+
+
+def notify(recipients, subject, body, digest=''):
+    """
+    Queues an email to each address in `recipients`. With a `digest` key the
+    message waits for the digest window and goes out combined with the other
+    pending messages for the same recipient and key.
+    """
+    return Notification.objects.bulk_create(prepare(recipients, subject, body, digest))
+
+
+def backoff(attempts):
+    """
+    Seconds to wait before retry number `attempts`.
+    """
+    base = getattr(settings, 'NOTIFY_RETRY_BASE', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'NOTIFY_RETRY_MAX', 3600))
+
+
+def compose(group):
+    """
+    Builds (subject, body) for a group of notifications to one recipient.
+    """
+    if len(group) == 1:
+        return group[0].subject, group[0].body
+    subject = f"{group[0].digest}: {len(group)} notifications"
+    body = '\n\n'.join(f"{notification.subject}\n{'-' * len(notification.subject)}\n{notification.body}"
+                       for notification in group)
+    return subject, body
+
+
+class NotificationDispatcher(background.PeriodicWorker):
+    name = 'notifications'
+
+    def __init__(self, interval=None, batch_size=None):
+        super().__init__(interval if interval is not None else getattr(settings, 'NOTIFY_DISPATCH_INTERVAL', 5))
+        self.batch_size = batch_size or getattr(settings, 'NOTIFY_BATCH_SIZE', 500)
+
+        # Counters
+        self.sent = 0
+        self.failed = 0
+
+    def claim(self, now):
+        """
+        Due notifications grouped per email, plus the pending siblings that
+        joined a digest after it was opened.
+        """
+        pending = Notification.objects.filter(status='pending')
+        if connection.features.has_select_for_update_skip_locked:
+            # Several dispatchers can share the outbox
+            pending = pending.select_for_update(skip_locked=True)
+        due = list(pending.filter(send_after__lte=now).order_by('send_after', 'id')[:self.batch_size])
+
+        digests = {(n.recipient, n.digest) for n in due if n.digest}
+        if digests:
+            seen = {n.id for n in due}
+            siblings = pending.filter(
+                recipient__in={recipient for recipient, _ in digests},
+                digest__in={digest for _, digest in digests},
+            ).exclude(id__in=seen).order_by('id')
+            due.extend(n for n in siblings if (n.recipient, n.digest) in digests)
+
+        groups = defaultdict(list)
+        for notification in due:
+            groups[(notification.recipient, notification.digest or notification.id)].append(notification)
+        return list(groups.values())
+
+    def deliver(self, groups):
+        """
+        Sends each group over one connection. Returns (sent, failed) groups.
+        """
+        sent, failed = [], []
+        mail = get_connection(fail_silently=False, timeout=getattr(settings, 'EMAIL_TIMEOUT', None) or SMTP_TIMEOUT)
+        try:
+            mail.open()
+        except Exception as exc:
+            logger.warning("Opening the mail connection failed: %s", exc)
+            return [], [(group, str(exc)) for group in groups]
+        try:
+            for group in groups:
+                subject, body = compose(group)
+                message = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [group[0].recipient], connection=mail)
+                try:
+                    message.send()
+                except Exception as exc:
+                    failed.append((group, str(exc)))
+                else:
+                    sent.append(group)
+        finally:
+            mail.close()
+        return sent, failed
+
+    def lease(self, now):
+        """
+        Claims due groups and leases their rows, so SMTP runs outside the
+        transaction; a crashed dispatcher's rows come due again when the
+        lease runs out.
+        """
+        with transaction.atomic():
+            groups = self.claim(now)
+            if groups:
+                Notification.objects.filter(id__in=[n.id for group in groups for n in group]) \
+                    .update(send_after=now + timedelta(seconds=CLAIM_LEASE))
+        return groups
+
+    def record(self, now, sent, failed):
+        """
+        Marks sent groups and schedules retries for failed ones. Returns the
+        number of emails sent.
+        """
+        with transaction.atomic():
+            Notification.objects.filter(id__in=[n.id for group in sent for n in group]) \
+                .update(status='sent', sent_at=now)
+            retried = []
+            max_attempts = getattr(settings, 'NOTIFY_MAX_ATTEMPTS', 8)
+            for group, error in failed:
+                for notification in group:
+                    notification.attempts += 1
+                    notification.last_error = error
+                    if notification.attempts >= max_attempts:
+                        notification.status = 'failed'
+                    notification.send_after = now + timedelta(seconds=backoff(notification.attempts))
+                    retried.append(notification)
+            Notification.objects.bulk_update(retried, ['attempts', 'last_error', 'status', 'send_after'])
+
+        self.sent += len(sent)
+        self.failed += len(failed)
+        if failed:
+            logger.warning("%d notification emails failed, will retry", len(failed))
+        return len(sent)
+
+    def run_once(self):
+        now = timezone.now()
+        groups = self.lease(now)
+        if not groups:
+            return 0
+        return self.record(now, *self.deliver(groups))
+
+    async def arun_once(self):
+        now = timezone.now()
+        groups = await database_sync_to_async(self.lease)(now)
+        if not groups:
+            return 0
+        # Not on the database thread: a slow mail server must not hold up
+        # the consumers' database calls
+        sent, failed = await sync_to_async(self.deliver, thread_sensitive=False)(groups)
+        return await database_sync_to_async(self.record)(now, sent, failed)
+
+    def shutdown(self):
+        # Undelivered rows stay in the outbox for the next start
+        pass
+
+
+dispatcher = background.register(NotificationDispatcher())
@@ -0,0 +1,195 @@
+"""
+Full-text search indexes.
+
+One API over two backends: an FTS5 virtual table on SQLite and a table with a
+weighted `tsvector` column and a GIN index on PostgreSQL. A SearchIndex has
+text `columns`, most important first, and optional unindexed `attributes`
+that searches can filter on inside the index query (so a filter never has to
+be applied after the ranking). The row id is the indexed object's primary key.
+
+Apps subclass SearchIndex, implement documents(), register the index, create
+its table in a migration (create_table/drop_table) and call refresh()/delete()
+from their signals, in the same transaction as the change being indexed.
+`python manage.py rebuild_search_index` rebuilds every registered index.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Case, IntegerField, When
+
+_indexes = []
+
+# ts_rank weights for the columns in order (PostgreSQL supports four)
+PG_WEIGHTS = ('A', 'B', 'C', 'D')
+
+
+def register(index):
+    _indexes.append(index)
+    return index
+
+
+def registered():
+    return list(_indexes)
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+class SearchIndex:
+    table = None
+    model = None
+    columns = ()
+    weights = ()  # FTS5 bm25 weight per column
+    attributes = ()
+    pg_config = 'english'
+
+    def documents(self, pks=None):
+        """
+        Yields (pk, {column: text}, {attribute: value}) for the objects with
+        primary keys `pks`, or for every object when `pks` is None.
+        """
+        raise NotImplementedError
+
+    # Schema
+
+    def _connection(self, using=None):
+        return connections[using or router.db_for_write(self.model)]
+
+    def create_table(self, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            columns = list(self.columns) + [f'{name} UNINDEXED' for name in self.attributes]
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5({', '.join(columns)}, tokenize='porter unicode61')"
+            )
+        elif vendor == 'postgresql':
+            attributes = ''.join(f', {name} integer' for name in self.attributes)
+            schema_editor.execute(f"CREATE TABLE {self.table} (object_id bigint PRIMARY KEY, document tsvector NOT NULL{attributes})")
+            schema_editor.execute(f"CREATE INDEX {self.table}_document_idx ON {self.table} USING GIN (document)")
+
+    def drop_table(self, schema_editor):
+        if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+            schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def available(self, using=None):
+        return self._connection(using).vendor in ('sqlite', 'postgresql')
+
+    # Writes
+
+    def update(self, docs, using=None):
+        """
+        Inserts or replaces documents, as yielded by documents().
+        """
+        connection = self._connection(using)
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return
+        rows = [(pk, [text or '' for text in map(values.get, self.columns)],
+                 [int(attributes.get(name) or 0) for name in self.attributes])
+                for pk, values, attributes in docs]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # FTS5 has no upsert on rowid
+                cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk, _, _ in rows])
+                names = ', '.join(['rowid', *self.columns, *self.attributes])
+                marks = ', '.join(['%s'] * (1 + len(self.columns) + len(self.attributes)))
+                cursor.executemany(f"INSERT INTO {self.table} ({names}) VALUES ({marks})",
+                                   [(pk, *texts, *attributes) for pk, texts, attributes in rows])
+            else:
+                document = ' || '.join(f"setweight(to_tsvector(%s, %s), '{weight}')"
+                                       for weight in PG_WEIGHTS[:len(self.columns)])
+                names = ''.join(f', {name}' for name in self.attributes)
+                marks = ', %s' * len(self.attributes)
+                updates = ''.join(f', {name} = EXCLUDED.{name}' for name in self.attributes)
+                cursor.executemany(
+                    f"INSERT INTO {self.table} (object_id, document{names}) VALUES (%s, {document}{marks}) "
+                    f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document{updates}",
+                    [(pk, *[arg for text in texts for arg in (self.pg_config, text)], *attributes)
+                     for pk, texts, attributes in rows],
+                )
+
+    def refresh(self, pks, using=None):
+        self.update(self.documents(list(pks)), using)
+
+    def delete(self, pks, using=None):
+        connection = self._connection(using)
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return
+        key = 'rowid' if connection.vendor == 'sqlite' else 'object_id'
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE {key} = %s", [(pk,) for pk in pks])
+
+    def rebuild(self, using=None, batch_size=1000):
+        connection = self._connection(using)
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return 0
+        count = 0
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table}")
+            batch = []
+            for doc in self.documents():
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    self.update(batch, using)
+                    count += len(batch)
+                    batch = []
+            self.update(batch, using)
+            count += len(batch)
+        return count
+
+    # Queries
+
+    def search(self, query, limit=None, using=None, **filters):
+        """
+        Returns [(pk, rank)], best match first. Every word must match; the
+        last one also matches as a prefix. Keyword arguments filter on the
+        index attributes.
+        """
+        words = terms(query)
+        connection = self._connection(using)
+        if not words or connection.vendor not in ('sqlite', 'postgresql'):
+            return []
+        limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+        conditions = ''.join(f" AND {name} = %s" for name in filters)
+        if connection.vendor == 'sqlite':
+            match = ' '.join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+            weights = ', '.join(str(weight) for weight in (self.weights or [1] * len(self.columns)))
+            sql = (f"SELECT rowid, -bm25({self.table}, {weights}) AS rank FROM {self.table} "
+                   f"WHERE {self.table} MATCH %s{conditions} ORDER BY rank DESC LIMIT %s")
+            params = [match.strip()]
+        else:
+            tsquery = ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+            sql = (f"SELECT object_id, ts_rank(document, query) AS rank FROM {self.table}, to_tsquery(%s, %s) query "
+                   f"WHERE document @@ query{conditions} ORDER BY rank DESC LIMIT %s")
+            params = [self.pg_config, tsquery]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [int(value) for value in filters.values()] + [limit])
+            return cursor.fetchall()
+
+    def filter(self, queryset, query, limit=None, **filters):
+        """
+        `queryset` narrowed to the matches, ordered by rank.
+        """
+        pks = [pk for pk, _ in self.search(query, limit, using=queryset.db, **filters)]
+        if not pks:
+            return queryset.none()
+        ranking = Case(*[When(pk=pk, then=position) for position, pk in enumerate(pks)], output_field=IntegerField())
+        return queryset.filter(pk__in=pks).order_by(ranking)
+
+
+class IndexedSearchAdminMixin:
+    """
+    Routes the admin's search box through `search_index` instead of
+    `search_fields` LIKE scans.
+    """
+    search_index = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or self.search_index is None or not self.search_index.available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        pks = [pk for pk, _ in self.search_index.search(search_term, using=queryset.db)]
+        return queryset.filter(pk__in=pks), False
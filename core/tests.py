@@ -1,6 +1,14 @@
-from django.test import TestCase
+import threading
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
-from core.models import User
+from django.core import mail
+from django.utils import timezone
+from core import background
+from core.models import Notification, User
+from core.notifications import NotificationDispatcher, notify
+from core.timers import TimerWheel
 
 class UserModelTest(TestCase):
     def setUp(self):
@@ -45,3 +53,151 @@ class UserModelTest(TestCase):
         user = get_user_model().objects.create_user(username='minimaluser', password='password')
         self.assertIsNone(user.phone)
         self.assertIsNone(user.company_name)
+
+
+class TimerWheelTest(TestCase):
+    def test_expiry_and_reschedule(self):
+        """Timers fire once when due; rescheduling replaces the old timer."""
+        wheel = TimerWheel(tick=1, slots=8)
+        wheel.schedule('a', 3)
+        wheel.schedule('b', 5)
+        wheel.schedule('b', 9)
+        self.assertEqual(wheel.advance(4), ['a'])
+        self.assertEqual(wheel.advance(8), [])
+        self.assertEqual(wheel.advance(9), ['b'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_timers_beyond_one_revolution(self):
+        """Deadlines further out than the wheel wait for their round."""
+        wheel = TimerWheel(tick=1, slots=8)
+        wheel.schedule('far', 20)
+        wheel.schedule('cancelled', 2)
+        wheel.cancel('cancelled')
+        self.assertEqual(wheel.advance(12), [])
+        self.assertIn('far', wheel)
+        self.assertEqual(wheel.advance(1000), ['far'])
+
+
+@override_settings(NOTIFY_DIGEST_WINDOW=0)
+class NotificationDispatcherTest(TestCase):
+    def setUp(self):
+        self.dispatcher = NotificationDispatcher()
+
+    def test_notify_only_queues(self):
+        """Queuing writes outbox rows; nothing is sent until the dispatcher runs."""
+        notify(['a@example.com', 'b@example.com', ''], 'Subject', 'Body')
+        self.assertEqual(Notification.objects.filter(status='pending').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(self.dispatcher.run_once(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(Notification.objects.filter(status='sent').count(), 2)
+        self.assertEqual(self.dispatcher.run_once(), 0)
+
+    def test_digest_coalesces_per_recipient(self):
+        """A burst with a digest key becomes one email per recipient."""
+        for i in range(200):
+            notify(['a@example.com', 'b@example.com'], f'Device {i} offline', 'No heartbeat', digest='Monitoring alerts')
+        notify(['a@example.com'], 'Ticket Closed', 'Done')
+
+        self.assertEqual(self.dispatcher.run_once(), 3)
+        digests = [message for message in mail.outbox if message.subject.startswith('Monitoring alerts')]
+        self.assertEqual(sorted(message.to[0] for message in digests), ['a@example.com', 'b@example.com'])
+        self.assertEqual(digests[0].subject, 'Monitoring alerts: 200 notifications')
+        self.assertIn('Device 199 offline', digests[0].body)
+        self.assertFalse(Notification.objects.filter(status='pending').exists())
+
+    def test_failed_send_is_retried_with_backoff(self):
+        notify(['a@example.com'], 'Subject', 'Body')
+        with mock.patch('core.notifications.EmailMessage.send', side_effect=OSError('SMTP down')):
+            self.assertEqual(self.dispatcher.run_once(), 0)
+        notification = Notification.objects.get()
+        self.assertEqual((notification.status, notification.attempts, notification.last_error), ('pending', 1, 'SMTP down'))
+        self.assertGreater(notification.send_after, timezone.now())
+        self.assertEqual(self.dispatcher.run_once(), 0)
+
+        Notification.objects.update(send_after=timezone.now())
+        self.assertEqual(self.dispatcher.run_once(), 1)
+        self.assertEqual(Notification.objects.get().status, 'sent')
+
+    def test_worker_sends_off_the_database_thread(self):
+        notify(['a@example.com'], 'Subject', 'Body')
+        threads = {}
+        deliver, lease = self.dispatcher.deliver, self.dispatcher.lease
+
+        def recording(name, method):
+            def wrapper(*args):
+                threads[name] = threading.get_ident()
+                return method(*args)
+            return wrapper
+
+        with mock.patch.object(self.dispatcher, 'deliver', recording('deliver', deliver)), \
+                mock.patch.object(self.dispatcher, 'lease', recording('lease', lease)):
+            self.assertEqual(async_to_sync(self.dispatcher.arun_once)(), 1)
+        self.assertNotEqual(threads['deliver'], threads['lease'])
+        self.assertEqual(Notification.objects.get().status, 'sent')
+
+    @override_settings(EMAIL_TIMEOUT=7)
+    def test_connection_has_a_timeout(self):
+        notify(['a@example.com'], 'Subject', 'Body')
+        with mock.patch('core.notifications.get_connection', wraps=mail.get_connection) as get_connection:
+            self.dispatcher.run_once()
+        self.assertEqual(get_connection.call_args.kwargs['timeout'], 7)
+
+    @override_settings(NOTIFY_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        notify(['a@example.com'], 'Subject', 'Body')
+        with mock.patch('core.notifications.EmailMessage.send', side_effect=OSError('SMTP down')):
+            for _ in range(2):
+                Notification.objects.update(send_after=timezone.now())
+                self.dispatcher.run_once()
+        self.assertEqual(Notification.objects.get().status, 'failed')
+
+
+class WorkersMiddlewareTest(TestCase):
+    class Worker(background.PeriodicWorker):
+        interval = 3600
+
+        def __init__(self):
+            super().__init__()
+            self.runs = 0
+
+        def run_once(self):
+            self.runs += 1
+
+    def setUp(self):
+        self.worker = self.Worker()
+        patcher = mock.patch.object(background, '_workers', [self.worker])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lifespan_starts_and_stops_workers(self):
+        async def scenario():
+            messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append((message['type'], self.worker.running))
+
+            await background.WorkersMiddleware(None)({'type': 'lifespan'}, receive, send)
+            return sent
+
+        sent = async_to_sync(scenario)()
+        self.assertEqual(sent, [('lifespan.startup.complete', True), ('lifespan.shutdown.complete', False)])
+        # Stopping flushes once more
+        self.assertEqual(self.worker.runs, 1)
+
+    def test_first_connection_starts_workers(self):
+        async def app(scope, receive, send):
+            self.assertTrue(self.worker.running)
+
+        async def scenario():
+            await background.WorkersMiddleware(app)({'type': 'http'}, None, None)
+            running = self.worker.running
+            await self.worker.stop()
+            return running
+
+        self.assertTrue(async_to_sync(scenario)())
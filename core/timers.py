@@ -0,0 +1,62 @@
+"""
+Hashed timer wheel.
+
+Holds one timer per key. Scheduling, rescheduling and cancelling are O(1);
+advancing the clock costs one slot visit per elapsed tick plus the timers
+that fall due. Timers further out than one revolution stay in their slot
+and are skipped until their deadline comes round.
+"""
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=512, now=0.0):
+        self.tick = float(tick)
+        self.size = slots
+        self._slots = [dict() for _ in range(slots)]  # key -> deadline tick
+        self._slot_of = {}  # key -> slot index
+        self._current = self._to_tick(now)
+
+    def _to_tick(self, when):
+        return int(when // self.tick)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def schedule(self, key, when):
+        """
+        Fires `key` at time `when`, replacing any timer it already had.
+        """
+        self.cancel(key)
+        deadline = max(self._to_tick(when), self._current + 1)
+        slot = deadline % self.size
+        self._slots[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now):
+        """
+        Moves the clock to `now` and returns the keys whose timers expired.
+        """
+        target = self._to_tick(now)
+        expired = []
+        if target - self._current > self.size:
+            # Visiting every slot once is enough however long the gap was
+            self._current = target - self.size
+        while self._current < target:
+            self._current += 1
+            slot = self._slots[self._current % self.size]
+            if not slot:
+                continue
+            due = [key for key, deadline in slot.items() if deadline <= self._current]
+            for key in due:
+                del slot[key]
+                del self._slot_of[key]
+            expired.extend(due)
+        return expired
@@ -0,0 +1,103 @@
+"""
+Field change tracking.
+
+Models that mix in TrackedFieldsMixin remember the values their
+`tracked_fields` had when loaded from the database, so code can ask
+`ticket.has_changed('status')` or `ticket.previous('status')` without
+re-reading the row. After every save of an existing row, `field_changed` is
+sent once per tracked field whose value changed:
+
+    @receiver(field_changed, sender=Ticket)
+    def on_change(sender, instance, field, old, new, **kwargs): ...
+
+Events from tracked_update() also carry `bulk=True`, since no post_save is
+sent for those rows.
+
+QuerySet.update() bypasses save(). Bulk changes that should emit the same
+events go through tracked_update(), which reads the affected rows first:
+
+    tracked_update(Ticket.objects.filter(status='resolved'), status='closed')
+"""
+from django.db import transaction
+from django.dispatch import Signal
+
+# Sent with sender, instance, field, old, new
+field_changed = Signal()
+
+
+class TrackedFieldsMixin:
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _attnames(self):
+        return {name: self._meta.get_field(name).attname for name in self.tracked_fields}
+
+    def _snapshot(self, fields=None):
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', {})
+        for name, attname in self._attnames().items():
+            if attname not in deferred and (fields is None or name in fields or attname in fields):
+                loaded[name] = getattr(self, attname)
+        self._loaded_values = loaded
+
+    def previous(self, field):
+        """
+        The value `field` had when loaded (or last saved); None for new instances.
+        """
+        return getattr(self, '_loaded_values', {}).get(field)
+
+    def has_changed(self, field):
+        loaded = getattr(self, '_loaded_values', {})
+        if field not in loaded:
+            return self._state.adding
+        return loaded[field] != getattr(self, self._meta.get_field(field).attname)
+
+    def changed_fields(self):
+        return {name: (self.previous(name), getattr(self, attname))
+                for name, attname in self._attnames().items() if self.has_changed(name)}
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(fields)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        changed = {} if adding else self.changed_fields()
+        if update_fields is not None:
+            changed = {name: values for name, values in changed.items()
+                       if name in update_fields or self._meta.get_field(name).attname in update_fields}
+        super().save(*args, **kwargs)
+        self._snapshot(update_fields)
+        for name, (old, new) in changed.items():
+            field_changed.send(sender=type(self), instance=self, field=name, old=old, new=new)
+
+
+def tracked_update(queryset, **values):
+    """
+    queryset.update(**values) that also sends field_changed for every row
+    whose tracked fields change. Costs one extra SELECT of the affected rows.
+    `values` must be plain values, not expressions. Returns the number of
+    rows updated.
+    """
+    model = queryset.model
+    tracked = [name for name in values if name in model.tracked_fields]
+    with transaction.atomic(using=queryset.db):
+        if not tracked:
+            return queryset.update(**values)
+        instances = list(queryset.select_for_update())
+        count = model._default_manager.filter(pk__in=[instance.pk for instance in instances]).update(**values)
+        # Sent inside the transaction, like the events of save() in an atomic block
+        for instance in instances:
+            for name, value in values.items():
+                setattr(instance, name, value)
+            changed = {name: change for name, change in instance.changed_fields().items() if name in tracked}
+            instance._snapshot()
+            for name, (old, new) in changed.items():
+                field_changed.send(sender=model, instance=instance, field=name, old=old, new=new, bulk=True)
+    return count
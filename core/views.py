@@ -2,20 +2,23 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Avg
-from django.db.models.functions import TruncHour
-from devices.models import Device, TelemetryData
-from tickets.models import Ticket
+from devices.models import Device
+from devices.presence import presence
+from devices import rollups
+from tickets import counts as ticket_counts
 
 # @login_required # Commented out for now to allow viewing without login setup
 def dashboard_view(request):
     device_count = Device.objects.count()
-    online_count = Device.objects.filter(is_online=True).count()
+    if presence.authoritative:
+        # Connections to this process from memory, the rest from the database
+        online_count = presence.online_count()
+    else:
+        online_count = Device.objects.filter(is_online=True).count()
     offline_count = device_count - online_count
-    ticket_count = Ticket.objects.exclude(status='closed').count()
+    ticket_count = ticket_counts.open_count()
     
-    recent_devices = Device.objects.order_by('-last_seen')[:10]
+    recent_devices = presence.apply(list(Device.objects.order_by('-last_seen')[:10]))
 
     context = {
         'device_count': device_count,
@@ -28,23 +31,14 @@ def dashboard_view(request):
 
 def dashboard_chart_data(request):
     """
-    Returns aggregated telemetry data for the last 24 hours.
-    Averages CPU and RAM usage per hour across all devices (or could be per device).
-    For a global dashboard, global average is fine.
+    Returns fleet-wide telemetry for the last 24 hours.
+    Hourly CPU and RAM averages across all devices, read from the rollup tables.
     """
-    now = timezone.now()
-    last_24h = now - timedelta(hours=24)
-    
-    # Aggregate by hour
-    data = TelemetryData.objects.filter(timestamp__gte=last_24h) \
-        .annotate(hour=TruncHour('timestamp')) \
-        .values('hour') \
-        .annotate(avg_cpu=Avg('cpu_usage'), avg_ram=Avg('ram_usage')) \
-        .order_by('hour')
-        
-    labels = [entry['hour'].strftime('%H:%M') for entry in data]
-    cpu_data = [round(entry['avg_cpu'], 2) for entry in data]
-    ram_data = [round(entry['avg_ram'], 2) for entry in data]
+    _, data = rollups.series(None, '24h')
+
+    labels = [timezone.localtime(entry.bucket).strftime('%H:%M') for entry in data]
+    cpu_data = [round(entry.cpu_avg, 2) for entry in data]
+    ram_data = [round(entry.ram_avg, 2) for entry in data]
     
     return JsonResponse({
         'labels': labels,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Device, Asset, MonitoringAlert, TelemetryData, NetworkInterface
+from .models import Device, Asset, AssetStatus, AlertRule, MonitoringAlert, TelemetryData, TelemetryRollup, NetworkInterface
 
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
@@ -13,11 +13,23 @@ class AssetAdmin(admin.ModelAdmin):
     list_filter = ('category', 'is_monitored')
     search_fields = ('name',)
 
+@admin.register(AssetStatus)
+class AssetStatusAdmin(admin.ModelAdmin):
+    list_display = ('asset', 'is_up', 'latency_ms', 'consecutive_failures', 'last_checked', 'last_change')
+    list_filter = ('is_up',)
+    readonly_fields = ('asset', 'is_up', 'latency_ms', 'consecutive_failures', 'last_checked', 'last_change', 'history')
+
 @admin.register(MonitoringAlert)
 class MonitoringAlertAdmin(admin.ModelAdmin):
     list_display = ('device', 'message', 'severity', 'created_at', 'resolved')
-    list_filter = ('severity', 'resolved')
-    readonly_fields = ('created_at',)
+    list_filter = ('severity', 'resolved', 'rule')
+    readonly_fields = ('created_at', 'dedupe_key')
+
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'metric', 'operator', 'threshold', 'duration', 'severity', 'device', 'client', 'is_active')
+    list_filter = ('metric', 'severity', 'is_active')
+    search_fields = ('name',)
 
 @admin.register(TelemetryData)
 class TelemetryDataAdmin(admin.ModelAdmin):
@@ -25,6 +37,12 @@ class TelemetryDataAdmin(admin.ModelAdmin):
     list_filter = ('device',)
     readonly_fields = ('timestamp', 'device', 'cpu_usage', 'ram_usage', 'disk_usage')
 
+@admin.register(TelemetryRollup)
+class TelemetryRollupAdmin(admin.ModelAdmin):
+    list_display = ('resolution', 'bucket', 'device', 'samples', 'cpu_avg', 'ram_avg', 'disk_avg')
+    list_filter = ('resolution',)
+    date_hierarchy = 'bucket'
+
 @admin.register(NetworkInterface)
 class NetworkInterfaceAdmin(admin.ModelAdmin):
     list_display = ('device', 'name', 'ip_address', 'mac_address', 'is_active')
@@ -0,0 +1,62 @@
+"""
+Handshake admission control.
+
+After a server restart the whole fleet reconnects at once and every handshake
+costs database work. A token bucket caps the handshake rate: agents within
+`max_wait` of a free token are held briefly, the rest are told when to retry.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.admitted = 0
+        self.delayed = 0
+        self.deferred = 0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait=0.0):
+        """
+        Returns (admitted, seconds). When admitted, the caller must wait
+        `seconds` before proceeding; otherwise `seconds` is when to retry.
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                self.deferred += 1
+                return False, wait
+            self.tokens -= 1
+            self.admitted += 1
+            if wait:
+                self.delayed += 1
+            return True, wait
+
+    def stats(self):
+        return {
+            'tokens': round(self.tokens, 2),
+            'admitted': self.admitted,
+            'delayed': self.delayed,
+            'deferred': self.deferred,
+        }
+
+
+handshake_admission = TokenBucket(
+    rate=getattr(settings, 'AGENT_HANDSHAKE_RATE', 50),
+    burst=getattr(settings, 'AGENT_HANDSHAKE_BURST', 100),
+)
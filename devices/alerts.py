@@ -0,0 +1,246 @@
+"""
+Threshold alerting.
+
+AlertRules are evaluated in memory against every heartbeat as it arrives.
+Each (rule, device) pair keeps O(1) state: since when the threshold has been
+crossed, and whether an alert is open. An alert opens once the threshold has
+been crossed for the rule's duration and resolves only when the value is back
+past the clear threshold (hysteresis), so a value hovering around the limit
+produces one incident rather than a stream of them.
+
+Alerts are not written from the heartbeat path: AlertWriter queues opens and
+resolves and writes them in batches. Every open alert carries a dedupe key,
+and the database allows one unresolved alert per key. Newly opened alerts of
+the ALERT_EMAIL_SEVERITIES are queued in the email outbox in the same
+transaction, as a digest per recipient.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import background
+from core.models import Notification, User
+from core.notifications import prepare
+from .models import AlertRule, MonitoringAlert
+
+logger = logging.getLogger(__name__)
+
+HYSTERESIS = 5.0
+
+EMAIL_DIGEST = 'Monitoring alerts'
+
+
+def rule_key(rule_id, device_id):
+    return f"rule:{rule_id}:device:{device_id}"
+
+
+class AlertWriter(background.PeriodicWorker):
+    """
+    Write-behind queue for MonitoringAlert opens and resolves.
+    """
+    name = 'alerts'
+
+    def __init__(self, interval=None):
+        super().__init__(interval if interval is not None else getattr(settings, 'ALERT_FLUSH_INTERVAL', 5))
+        self._lock = threading.Lock()
+        self._opened = {}  # dedupe_key -> unsaved MonitoringAlert
+        self._resolved = set()
+
+        # Counters
+        self.opened = 0
+        self.resolved = 0
+
+    def open(self, dedupe_key, **fields):
+        with self._lock:
+            self._opened[dedupe_key] = MonitoringAlert(dedupe_key=dedupe_key, **fields)
+
+    def resolve(self, dedupe_key):
+        with self._lock:
+            if self._opened.pop(dedupe_key, None) is None:
+                self._resolved.add(dedupe_key)
+
+    @property
+    def pending(self):
+        return len(self._opened) + len(self._resolved)
+
+    def run_once(self):
+        with self._lock:
+            opened, self._opened = list(self._opened.values()), {}
+            resolved, self._resolved = list(self._resolved), set()
+        if not opened and not resolved:
+            return 0
+
+        try:
+            with transaction.atomic():
+                # Resolves first: a key may be resolved and reopened in one window
+                if resolved:
+                    self.resolved += MonitoringAlert.objects.filter(
+                        dedupe_key__in=resolved, resolved=False
+                    ).update(resolved=True, resolved_at=timezone.now())
+                if opened:
+                    # An alert still open for the key (e.g. from before a restart) wins
+                    already_open = set(MonitoringAlert.objects.filter(
+                        dedupe_key__in=[alert.dedupe_key for alert in opened], resolved=False
+                    ).values_list('dedupe_key', flat=True))
+                    created = [alert for alert in opened if alert.dedupe_key not in already_open]
+                    MonitoringAlert.objects.bulk_create(opened, ignore_conflicts=True)
+                    self.opened += len(created)
+                    emailed = self.emailed(created)
+                    if emailed:
+                        self.queue_emails(emailed)
+        except Exception:
+            with self._lock:
+                for alert in opened:
+                    self._opened.setdefault(alert.dedupe_key, alert)
+                self._resolved.update(resolved)
+            raise
+        return len(opened) + len(resolved)
+
+
+    def emailed(self, created):
+        """
+        The newly created alerts to email: those of an emailed severity.
+        """
+        severities = getattr(settings, 'ALERT_EMAIL_SEVERITIES', ['critical'])
+        return [alert for alert in created if alert.severity in severities]
+
+    def queue_emails(self, alerts):
+        recipients = list(User.objects.filter(role__in=('admin', 'technician'), is_active=True)
+                          .exclude(email='').values_list('email', flat=True))
+        Notification.objects.bulk_create([
+            notification
+            for alert in alerts
+            for notification in prepare(recipients, f"[{alert.get_severity_display()}] {alert.message}",
+                                        f"{alert.message}\nOpened: {alert.created_at:%Y-%m-%d %H:%M:%S %Z}", EMAIL_DIGEST)
+        ])
+
+
+class RuleState:
+    __slots__ = ('since', 'firing')
+
+    def __init__(self, firing=False):
+        self.since = None
+        self.firing = firing
+
+
+class ThresholdEngine(background.PeriodicWorker):
+    """
+    Evaluates AlertRules against heartbeats. run_once() reloads the rules.
+    """
+    name = 'alert-rules'
+
+    def __init__(self, writer, interval=None, clock=time.monotonic):
+        super().__init__(interval if interval is not None else getattr(settings, 'ALERT_RULE_REFRESH', 60))
+        self.writer = writer
+        self.clock = clock
+        self.loaded = False
+        # Guards _state: load() runs on the database thread, observe() on the event loop
+        self._lock = threading.Lock()
+        self._global = []
+        self._by_client = defaultdict(list)
+        self._by_device = defaultdict(list)
+        self._state = {}  # (rule_id, device_id) -> RuleState
+
+    def load(self, rules, open_alerts=()):
+        """
+        Installs `rules`. `open_alerts` are (rule_id, device_id) pairs with an
+        unresolved alert, so incidents from before a restart can still resolve.
+        """
+        by_scope = ([], defaultdict(list), defaultdict(list))
+        for rule in rules:
+            if rule.device_id:
+                by_scope[2][str(rule.device_id)].append(rule)
+            elif rule.client_id:
+                by_scope[1][rule.client_id].append(rule)
+            else:
+                by_scope[0].append(rule)
+        self._global, self._by_client, self._by_device = by_scope
+
+        active = {rule.id for rule in rules}
+        with self._lock:
+            for rule_id, device_id in open_alerts:
+                self._state.setdefault((rule_id, str(device_id)), RuleState(firing=True))
+            # Forget state of rules that are gone
+            for key in [key for key in self._state if key[0] not in active]:
+                del self._state[key]
+        self.loaded = True
+
+    def run_once(self):
+        rules = list(AlertRule.objects.filter(is_active=True))
+        open_alerts = () if self.loaded else MonitoringAlert.objects.filter(
+            resolved=False, rule__isnull=False, device__isnull=False
+        ).values_list('rule_id', 'device_id')
+        self.load(rules, open_alerts)
+        return len(rules)
+
+    async def _run(self):
+        # Load the rules right away rather than after the first interval
+        try:
+            await self.arun_once()
+        except Exception:
+            logger.exception("Loading alert rules failed")
+        await super()._run()
+
+    def shutdown(self):
+        pass
+
+    def rules_for(self, device_id, client_id=None):
+        rules = self._global + self._by_device.get(device_id, [])
+        if client_id is not None:
+            rules = rules + self._by_client.get(client_id, [])
+        return rules
+
+    def observe(self, device_id, data, client_id=None):
+        """
+        Feeds one heartbeat to the rules that apply to the device.
+        """
+        device_id = str(device_id)
+        now = self.clock()
+        for rule in self.rules_for(device_id, client_id):
+            value = data.get(rule.metric)
+            if value is None:
+                continue
+            key = (rule.id, device_id)
+            state = self._state.get(key)
+            if state is None:
+                with self._lock:
+                    state = self._state.setdefault(key, RuleState())
+
+            if rule.operator == 'gt':
+                breached = value > rule.threshold
+                clear = rule.clear_threshold if rule.clear_threshold is not None else rule.threshold - HYSTERESIS
+                cleared = value <= clear
+            else:
+                breached = value < rule.threshold
+                clear = rule.clear_threshold if rule.clear_threshold is not None else rule.threshold + HYSTERESIS
+                cleared = value >= clear
+
+            if state.firing:
+                if cleared:
+                    state.firing = False
+                    state.since = None
+                    self.writer.resolve(rule_key(rule.id, device_id))
+            elif breached:
+                if state.since is None:
+                    state.since = now
+                if now - state.since >= rule.duration:
+                    state.firing = True
+                    self.writer.open(
+                        rule_key(rule.id, device_id),
+                        device_id=device_id,
+                        rule_id=rule.id,
+                        severity=rule.severity,
+                        message=f"{rule.name}: {rule.get_metric_display()} at {value}% "
+                                f"({rule.get_operator_display()} {rule.threshold}% for {rule.duration}s)",
+                    )
+            else:
+                state.since = None
+
+
+alert_writer = background.register(AlertWriter())
+threshold_engine = background.register(ThresholdEngine(alert_writer))
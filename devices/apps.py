@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DevicesConfig(AppConfig):
     name = "devices"
+
+    def ready(self):
+        # Registers the rollup compactor, retention and asset poller with the background workers
+        from . import poller, retention, rollups  # noqa: F401
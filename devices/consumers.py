@@ -1,26 +1,71 @@
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from datetime import datetime, timezone as dt_timezone
+import math
 from .models import Device, TelemetryData
+from .ingest import telemetry_buffer, update_snapshots
+from .presence import presence
+from .admission import handshake_admission
+from .alerts import threshold_engine
+from .offline import offline_detector
+from . import screen
+import asyncio
 import json
 import logging
+import time
 import traceback
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Batch messages with more records than this are rejected outright (the
+# agent sends at most 500 spooled records per batch)
+MAX_BATCH_RECORDS = 5000
+
+# Seconds a viewer may take to acknowledge a screen frame before the next one
+# is sent anyway (a lost ack, or a page from before acks existed)
+FRAME_ACK_TIMEOUT = 5.0
+
+def parse_spooled_heartbeat(record):
+    """
+    (timestamp, cpu, ram, disk) from a spooled [unix time, cpu, ram, disk]
+    row, or None when the row is malformed.
+    """
+    if not isinstance(record, (list, tuple)) or len(record) != 4:
+        return None
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+               for value in record):
+        return None
+    ts, cpu, ram, disk = record
+    try:
+        timestamp = datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return None
+    return timestamp, cpu, ram, disk
+
+
 class AgentConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.device_id = None
+        self.client_id = None
         await self.accept()
 
     async def disconnect(self, close_code):
         if self.device_id:
-            await self.update_device_status(online=False)
+            presence.disconnect(self.device_id)
             await self.channel_layer.group_discard(
                 f"device_{self.device_id}",
                 self.channel_name
             )
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None:
+            await self.handle_screen_frame(bytes_data)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
     async def receive_json(self, content):
         try:
             message_type = content.get('type')
@@ -30,6 +75,10 @@ class AgentConsumer(AsyncJsonWebsocketConsumer):
                 await self.handle_handshake(data)
             elif message_type == 'heartbeat':
                 await self.handle_heartbeat(data)
+            elif message_type == 'batch':
+                await self.handle_batch(data)
+            elif message_type == 'command_output':
+                await self.broadcast_to_browser('command_output', data)
             elif message_type == 'command_response':
                 await self.broadcast_to_browser('command_response', data)
             elif message_type == 'screenshot':
@@ -51,10 +100,44 @@ class AgentConsumer(AsyncJsonWebsocketConsumer):
                 }
             )
 
+    async def handle_screen_frame(self, frame):
+        """
+        Binary screen frames are relayed to viewers as raw bytes, never re-encoded.
+        """
+        if not self.device_id:
+            return
+        try:
+            screen.parse_header(frame)
+        except screen.FrameError as e:
+            logger.warning("Dropping screen frame from %s: %s", self.device_id, e)
+            return
+        await self.channel_layer.group_send(
+            f"device_{self.device_id}_browser",
+            {
+                "type": "browser.frame",
+                "frame": frame
+            }
+        )
+
     async def handle_handshake(self, data):
+        admitted, delay = handshake_admission.reserve(getattr(settings, 'AGENT_HANDSHAKE_MAX_WAIT', 5))
+        if not admitted:
+            # Over the handshake rate: tell the agent when to come back
+            await self.send_json({
+                'type': 'handshake_defer',
+                'retry_after': round(delay, 1)
+            })
+            await self.close(code=1013)
+            return
+        if delay:
+            await asyncio.sleep(delay)
+
         try:
             device = await self.get_or_create_device(data)
             self.device_id = str(device.id)
+            self.client_id = device.assigned_client_id
+            presence.connect(self.device_id)
+            offline_detector.heartbeat(self.device_id)
             
             # Agent listens on this group for commands from server
             await self.channel_layer.group_add(
@@ -67,6 +150,9 @@ class AgentConsumer(AsyncJsonWebsocketConsumer):
                 'status': 'success',
                 'device_id': self.device_id
             })
+            if screen.sessions.viewer_count(self.device_id):
+                # Viewers were already waiting (e.g. the agent reconnected)
+                await self.send_json(stream_start_message())
             print(f"Device connected: {self.device_id}")
         except Exception as e:
             print(f"Handshake error: {e}")
@@ -77,55 +163,100 @@ class AgentConsumer(AsyncJsonWebsocketConsumer):
         if not self.device_id:
             return
         try:
-            await self.save_telemetry(data)
-            await self.update_last_seen()
+            # Queued; written in batches by the telemetry buffer (devices.ingest)
+            await telemetry_buffer.add(self.device_id, data)
+            presence.touch(self.device_id)
+            threshold_engine.observe(self.device_id, data, self.client_id)
+            offline_detector.heartbeat(self.device_id)
             # Optional: Broadcast heartbeat to browser for live status?
             await self.broadcast_to_browser('heartbeat', data)
         except Exception as e:
             print(f"Heartbeat error: {e}")
 
+    async def handle_batch(self, data):
+        """
+        Records spooled by the agent while it was offline, replayed on reconnect.
+        Samples keep their original timestamps. Malformed records are skipped
+        and counted in the ack, so one bad row cannot keep a batch from ever
+        being acknowledged; a batch that cannot be processed at all gets a
+        batch_reject, which the agent drops.
+        """
+        if not self.device_id:
+            return
+        heartbeats = data.get('heartbeats') or []
+        messages = data.get('messages') or []
+        if not isinstance(heartbeats, list) or not isinstance(messages, list) \
+                or len(heartbeats) + len(messages) > MAX_BATCH_RECORDS:
+            logger.warning("Rejecting malformed or oversized batch from %s", self.device_id)
+            await self.send_json({
+                'type': 'batch_reject',
+                'batch_id': data.get('batch_id'),
+            })
+            return
+        samples = [sample for sample in map(parse_spooled_heartbeat, heartbeats) if sample is not None]
+        messages = [message for message in messages
+                    if isinstance(message, dict) and message.get('type') in ('command_output', 'command_response')]
+        rejected = len(heartbeats) + len(data.get('messages') or []) - len(samples) - len(messages)
+        if rejected:
+            logger.warning("Skipped %d malformed spooled records from %s", rejected, self.device_id)
+        await self.save_telemetry_batch(samples)
+        for message in messages:
+            await self.broadcast_to_browser(message['type'], message.get('data'))
+        await self.send_json({
+            'type': 'batch_ack',
+            'batch_id': data.get('batch_id'),
+            'rejected': rejected,
+        })
+
+    @database_sync_to_async
+    def save_telemetry_batch(self, samples):
+        rows = [
+            TelemetryData(
+                device_id=self.device_id,
+                timestamp=timestamp,
+                cpu_usage=cpu,
+                ram_usage=ram,
+                disk_usage=disk,
+            )
+            for timestamp, cpu, ram, disk in samples
+        ]
+        with transaction.atomic():
+            TelemetryData.objects.bulk_create(rows, batch_size=1000)
+            update_snapshots(rows)
+
     @database_sync_to_async
     def get_or_create_device(self, data):
+        """
+        Registers the agent's device. Liveness is tracked by devices.presence,
+        so an unchanged device costs a single SELECT here.
+        """
         mac = data.get('mac_address')
         if not mac:
             raise ValueError("MAC address required")
-            
-        defaults = {
+
+        fields = {
             'hostname': data.get('hostname'),
             'os_info': data.get('os_info'),
             'local_ip': data.get('local_ip'),
             'public_ip': data.get('public_ip'),
             'agent_version': data.get('agent_version'),
-            'last_seen': timezone.now(),
-            'is_online': True
         }
-        
-        device, created = Device.objects.update_or_create(
-            mac_address=mac,
-            defaults=defaults
-        )
-        return device
 
-    @database_sync_to_async
-    def update_device_status(self, online):
-        if self.device_id:
-            Device.objects.filter(id=self.device_id).update(is_online=online, last_seen=timezone.now())
+        device = Device.objects.filter(mac_address=mac).first()
+        if device is None:
+            try:
+                return Device.objects.create(mac_address=mac, **fields)
+            except IntegrityError:
+                # Registered concurrently by another connection
+                device = Device.objects.get(mac_address=mac)
 
-    @database_sync_to_async
-    def update_last_seen(self):
-        if self.device_id:
-             Device.objects.filter(id=self.device_id).update(last_seen=timezone.now(), is_online=True)
+        changed = [name for name, value in fields.items() if getattr(device, name) != value]
+        if changed:
+            for name in changed:
+                setattr(device, name, fields[name])
+            device.save(update_fields=changed + ['updated_at'])
+        return device
 
-    @database_sync_to_async
-    def save_telemetry(self, data):
-        if self.device_id:
-            TelemetryData.objects.create(
-                device_id=self.device_id,
-                cpu_usage=data.get('cpu_usage', 0),
-                ram_usage=data.get('ram_usage', 0),
-                disk_usage=data.get('disk_usage', 0)
-            )
-            
     async def device_command(self, event):
         """
         Handler for commands sent from server to agent
@@ -133,49 +264,116 @@ class AgentConsumer(AsyncJsonWebsocketConsumer):
         await self.send_json(event['content'])
 
 
+def stream_start_message():
+    return {
+        "type": "start_stream",
+        "fps": getattr(settings, 'SCREEN_STREAM_FPS', 5)
+    }
+
+
 class DeviceBrowserConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.device_id = self.scope['url_route']['kwargs']['device_id']
+        self.last_frame_seq = None
+        self.pending_frame = None
+        self.frame_sent_at = None  # monotonic time of the unacknowledged frame
         await self.channel_layer.group_add(
             f"device_{self.device_id}_browser",
             self.channel_name
         )
         await self.accept()
 
+        # One capture session per device, shared by every viewer
+        if screen.sessions.join(self.device_id, self.channel_name):
+            await self.send_to_agent(stream_start_message())
+        else:
+            await self.send_to_agent({"type": "request_keyframe"})
+
     async def disconnect(self, close_code):
+        if screen.sessions.leave(self.device_id, self.channel_name):
+            await self.send_to_agent({"type": "stop_stream"})
         await self.channel_layer.group_discard(
             f"device_{self.device_id}_browser",
             self.channel_name
         )
 
+    async def send_to_agent(self, content):
+        await self.channel_layer.group_send(
+            f"device_{self.device_id}",
+            {
+                "type": "device.command",
+                "content": content
+            }
+        )
+
     async def receive_json(self, content):
         # Handle commands from browser to agent (e.g., "get_screenshot")
         message_type = content.get('type')
         if message_type == 'command':
             # Forward command to Agent group
-            await self.channel_layer.group_send(
-                f"device_{self.device_id}",
-                {
-                    "type": "device.command",
-                    "content": {
-                        "type": "command",
-                        "command": content.get('command')
-                    }
-                }
-            )
+            command_id = content.get('command_id') or uuid.uuid4().hex
+            await self.send_to_agent({
+                "type": "command",
+                "command": content.get('command'),
+                "command_id": command_id
+            })
+            await self.send_json({
+                "type": "command_started",
+                "data": {"command_id": command_id, "command": content.get('command')}
+            })
+        elif message_type == 'cancel_command':
+            await self.send_to_agent({
+                "type": "cancel_command",
+                "command_id": content.get('command_id'),
+                "kill": bool(content.get('kill'))
+            })
         elif message_type == 'get_screenshot':
-            await self.channel_layer.group_send(
-                f"device_{self.device_id}",
-                {
-                    "type": "device.command",
-                    "content": {
-                        "type": "get_screenshot"
-                    }
-                }
-            )
+            await self.send_to_agent({"type": "get_screenshot"})
+        elif message_type == 'request_keyframe':
+            await self.send_to_agent({"type": "request_keyframe"})
+        elif message_type == 'frame_ack':
+            self.frame_sent_at = None
+            await self.send_pending_frame()
 
     async def browser_message(self, event):
         """
         Receive message from AgentConsumer and send to Browser
         """
         await self.send_json(event['message'])
+
+    async def browser_frame(self, event):
+        """
+        Relay a binary screen frame from the agent as-is. One frame is in
+        flight per viewer: the page acknowledges each frame once drawn, and
+        frames arriving before that are merged into one pending frame, so a
+        slow browser gets fewer, newer frames instead of a growing backlog.
+        (send() returns as soon as the data is handed to the transport, so
+        its latency says nothing about how fast the browser keeps up.)
+        """
+        frame = event['frame']
+        flags, seq, _, _, _ = screen.parse_header(frame)
+        keyframe = flags & screen.FLAG_KEYFRAME
+        if self.last_frame_seq is None and not keyframe:
+            # Joined mid-stream; the keyframe requested on connect is on its way
+            return
+        if not keyframe and seq != (self.last_frame_seq + 1) & 0xFFFFFFFF:
+            # A frame was lost on the channel layer; deltas no longer line up
+            self.last_frame_seq = None
+            await self.send_to_agent({"type": "request_keyframe"})
+            return
+        self.last_frame_seq = seq
+
+        if self.pending_frame is not None:
+            self.pending_frame = screen.merge_frames(self.pending_frame, frame)
+        else:
+            self.pending_frame = frame
+        await self.send_pending_frame()
+
+    async def send_pending_frame(self):
+        if self.pending_frame is None:
+            return
+        if self.frame_sent_at is not None and time.monotonic() - self.frame_sent_at < FRAME_ACK_TIMEOUT:
+            return
+        frame, self.pending_frame = self.pending_frame, None
+        self.frame_sent_at = time.monotonic()
+        await self.send(bytes_data=frame)
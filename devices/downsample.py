@@ -0,0 +1,50 @@
+"""
+Largest-Triangle-Three-Buckets downsampling.
+
+Reduces a series to `threshold` points while keeping its visual shape:
+the first and last points are kept, the rest is split into equal buckets
+and from each bucket the point forming the largest triangle with the point
+kept before it and the average of the next bucket is chosen. Unlike
+averaging, spikes survive.
+
+Buckets are chosen one after another (each choice depends on the previous
+one); the triangle areas within a bucket are computed with NumPy.
+"""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Returns the indices of the points to keep, in order.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1], dtype=np.int64)[:max(threshold, 0)]
+
+    # Bucket boundaries over the points between the first and the last
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Average of every bucket, used as the third vertex for the bucket before it
+    sums_x = np.add.reduceat(x[1:n - 1], starts - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], starts - 1)
+    counts = ends - starts
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket, (start, end) in enumerate(zip(starts, ends)):
+        px, py = x[previous], y[previous]
+        nx, ny = avg_x[bucket + 1], avg_y[bucket + 1]
+        # Twice the triangle area; the constant factor does not change the argmax
+        areas = np.abs((px - nx) * (y[start:end] - py) - (px - x[start:end]) * (ny - py))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
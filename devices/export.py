@@ -0,0 +1,238 @@
+"""
+Streaming telemetry export.
+
+Rows are read in keyset chunks (primary key order, CHUNK_SIZE rows per
+query) and encoded chunk by chunk, so memory stays flat whatever the size
+of the export. stream() is the synchronous version used by the
+`export_telemetry` command; astream() is an async iterator for the export
+view, because under ASGI Django buffers a synchronous iterator in full
+before sending the first byte. It fetches each chunk with sync_to_async and
+encodes it off the event loop, one chunk at a time as the client reads.
+
+Parquet needs the optional `pyarrow` package; each chunk becomes one row group.
+"""
+import csv
+import io
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+
+from .models import TelemetryData
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+CHUNK_SIZE = 10000
+
+COLUMNS = ['device_id', 'hostname', 'timestamp', 'cpu_usage', 'ram_usage', 'disk_usage']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def available_formats():
+    return [name for name in CONTENT_TYPES if name != 'parquet' or pa is not None]
+
+
+def export_queryset(device=None, client=None, start=None, end=None):
+    """
+    Telemetry rows for the filters, in insertion order (primary key, so no sort).
+    `client` is a user id or username (Device.assigned_client). Each row
+    starts with the primary key, which chunks() uses as the keyset cursor.
+    """
+    rows = TelemetryData.objects.all()
+    if device:
+        try:
+            rows = rows.filter(device_id=uuid.UUID(str(device)))
+        except ValueError:
+            raise ExportError(f"Invalid device id '{device}'")
+    if client:
+        if str(client).isdigit():
+            rows = rows.filter(device__assigned_client_id=client)
+        else:
+            rows = rows.filter(device__assigned_client__username=client)
+    if start:
+        rows = rows.filter(timestamp__gte=start)
+    if end:
+        rows = rows.filter(timestamp__lt=end)
+    return rows.order_by('pk').values_list(
+        'pk', 'device_id', 'device__hostname', 'timestamp', 'cpu_usage', 'ram_usage', 'disk_usage'
+    )
+
+
+def fetch_chunk(rows, after, chunk_size):
+    """
+    The next `chunk_size` rows after primary key `after` (None for the first
+    chunk), without their keys, and the key of the last one.
+    """
+    if after is not None:
+        rows = rows.filter(pk__gt=after)
+    batch = list(rows[:chunk_size])
+    return [row[1:] for row in batch], (batch[-1][0] if batch else None)
+
+
+def chunks(rows, chunk_size=None):
+    chunk_size = chunk_size or CHUNK_SIZE
+    after = None
+    while True:
+        chunk, after = fetch_chunk(rows, after, chunk_size)
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+
+class CsvEncoder:
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(COLUMNS)
+
+    def _take(self):
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def encode(self, chunk):
+        self.writer.writerows(
+            (device_id, hostname, timestamp.isoformat(), cpu, ram, disk)
+            for device_id, hostname, timestamp, cpu, ram, disk in chunk
+        )
+        return self._take()
+
+    def close(self):
+        # The header, when there were no rows at all
+        return self._take()
+
+
+class NdjsonEncoder:
+    def encode(self, chunk):
+        return ''.join(
+            json.dumps({
+                'device_id': str(device_id),
+                'hostname': hostname,
+                'timestamp': timestamp.isoformat(),
+                'cpu_usage': cpu,
+                'ram_usage': ram,
+                'disk_usage': disk,
+            }) + '\n'
+            for device_id, hostname, timestamp, cpu, ram, disk in chunk
+        ).encode()
+
+    def close(self):
+        return b''
+
+
+class _Sink(io.RawIOBase):
+    """
+    Write-only file that hands back whatever has been written since the last call.
+    """
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+class ParquetEncoder:
+    def __init__(self):
+        if pa is None:
+            raise ExportError("Parquet export requires pyarrow")
+        self.schema = pa.schema([
+            ('device_id', pa.string()),
+            ('hostname', pa.string()),
+            ('timestamp', pa.timestamp('us', tz='UTC')),
+            ('cpu_usage', pa.float64()),
+            ('ram_usage', pa.float64()),
+            ('disk_usage', pa.float64()),
+        ])
+        self.sink = _Sink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def encode(self, chunk):
+        device_ids, hostnames, timestamps, cpu, ram, disk = zip(*chunk)
+        self.writer.write_table(pa.table([
+            [str(device_id) for device_id in device_ids], hostnames, timestamps, cpu, ram, disk,
+        ], schema=self.schema))
+        return self.sink.take()
+
+    def close(self):
+        self.writer.close()
+        return self.sink.take()
+
+
+ENCODERS = {'csv': CsvEncoder, 'ndjson': NdjsonEncoder, 'parquet': ParquetEncoder}
+
+
+def encoder_for(fmt):
+    if fmt not in available_formats():
+        raise ExportError(f"Unsupported format '{fmt}'. Available: {', '.join(available_formats())}")
+    return ENCODERS[fmt]()
+
+
+def stream(fmt, rows, chunk_size=None):
+    """
+    Yields the encoded export as bytes.
+    """
+    encoder = encoder_for(fmt)
+
+    def generate():
+        for chunk in chunks(rows, chunk_size):
+            yield encoder.encode(chunk)
+        tail = encoder.close()
+        if tail:
+            yield tail
+
+    return generate()
+
+
+def astream(fmt, rows, chunk_size=None):
+    """
+    Async iterator over the encoded export, for StreamingHttpResponse under
+    ASGI. A chunk is only fetched when the previous one has been sent.
+    """
+    encoder = encoder_for(fmt)
+    chunk_size = chunk_size or CHUNK_SIZE
+    fetch = sync_to_async(fetch_chunk)
+    # Encoding is CPU work that needs no database, so it stays off both the
+    # event loop and the shared database thread
+    encode = sync_to_async(encoder.encode, thread_sensitive=False)
+
+    async def generate():
+        after = None
+        while True:
+            chunk, after = await fetch(rows, after, chunk_size)
+            if chunk:
+                yield await encode(chunk)
+            if len(chunk) < chunk_size:
+                break
+        tail = await sync_to_async(encoder.close, thread_sensitive=False)()
+        if tail:
+            yield tail
+
+    return generate()
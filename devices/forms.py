@@ -4,8 +4,15 @@ from .models import Asset
 class AssetForm(forms.ModelForm):
     class Meta:
         model = Asset
-        fields = ['name', 'category', 'ip_address', 'is_monitored', 'assigned_user', 'purchase_date', 'warranty_expiry', 'notes']
+        fields = ['name', 'category', 'ip_address', 'is_monitored', 'probe_ports', 'probe_icmp', 'poll_interval', 'assigned_user', 'purchase_date', 'warranty_expiry', 'notes']
         widgets = {
             'purchase_date': forms.DateInput(attrs={'type': 'date'}),
             'warranty_expiry': forms.DateInput(attrs={'type': 'date'}),
         }
+
+    def clean_probe_ports(self):
+        ports = self.cleaned_data['probe_ports'].replace(' ', '')
+        for port in filter(None, ports.split(',')):
+            if not port.isdigit() or not 0 < int(port) < 65536:
+                raise forms.ValidationError(f"'{port}' is not a valid TCP port.")
+        return ports
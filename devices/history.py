@@ -0,0 +1,130 @@
+"""
+Time-range telemetry history for one device.
+
+The source table is picked from the requested span: raw samples when the
+range is short enough, otherwise the finest rollup resolution that keeps the
+input to roughly OVERSAMPLE times the requested points and is still within
+its retention. At most HISTORY_MAX_ROWS rows are read from a table; a range
+with more than that (e.g. agents reporting faster than the heartbeat) falls
+through to the next coarser rollup, so memory is bounded whatever the
+range. Each metric is then reduced to at most `points` samples with LTTB,
+which keeps the response small enough to return in one piece.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .downsample import lttb
+from .models import TelemetryData, TelemetryRollup
+from .retention import retention_policy
+
+OVERSAMPLE = 20
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+CHUNK_SIZE = 5000
+
+METRICS = ('cpu', 'ram', 'disk')
+
+# (table, seconds per sample); raw samples arrive once per heartbeat
+SOURCES = (
+    ('raw', None),
+    ('1m', 60),
+    ('1h', 3600),
+    ('1d', 86400),
+)
+
+
+def parse_time(value):
+    """
+    Parses an ISO 8601 time or epoch seconds. Returns None for an empty value.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except ValueError:
+        pass
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError("Expected an ISO 8601 time or epoch seconds.")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def heartbeat_interval():
+    return getattr(settings, 'AGENT_HEARTBEAT_INTERVAL', 5)
+
+
+def choose_source(start, end, points, now=None):
+    now = now or timezone.now()
+    span = (end - start).total_seconds()
+    policy = retention_policy()
+    for table, step in SOURCES:
+        step = step or heartbeat_interval()
+        days = policy.get(table)
+        if days and start < now - timedelta(days=days):
+            continue
+        if span / step <= points * OVERSAMPLE:
+            return table
+    return SOURCES[-1][0]
+
+
+def max_rows():
+    return getattr(settings, 'HISTORY_MAX_ROWS', 200000)
+
+
+def load(device, table, start, end, limit=None):
+    """
+    Returns (timestamps in epoch ms, {metric: values}) as NumPy arrays.
+    Rows are read with a server-side cursor straight into the arrays. With
+    `limit`, returns None when the range holds more than `limit` rows.
+    """
+    if table == 'raw':
+        rows = TelemetryData.objects.filter(device=device, timestamp__gte=start, timestamp__lt=end) \
+            .order_by('timestamp').values_list('timestamp', 'cpu_usage', 'ram_usage', 'disk_usage')
+    else:
+        rows = TelemetryRollup.objects.filter(resolution=table, device=device, bucket__gte=start, bucket__lt=end) \
+            .order_by('bucket').values_list('bucket', 'cpu_avg', 'ram_avg', 'disk_avg')
+    if limit is not None:
+        rows = rows[:limit + 1]
+
+    data = np.fromiter(
+        ((ts.timestamp() * 1000, cpu, ram, disk) for ts, cpu, ram, disk in rows.iterator(chunk_size=CHUNK_SIZE)),
+        dtype=np.dtype([('ts', np.float64), ('cpu', np.float64), ('ram', np.float64), ('disk', np.float64)]),
+    )
+    if limit is not None and len(data) > limit:
+        return None
+    return data['ts'], {metric: data[metric] for metric in METRICS}
+
+
+def series(device, start, end, points):
+    """
+    The history as a JSON-ready dict: each metric is a list of
+    [epoch ms, value] pairs, at most `points` long.
+    """
+    tables = [table for table, _ in SOURCES]
+    candidates = tables[tables.index(choose_source(start, end, points)):]
+    for table in candidates:
+        # The coarsest table is read in full: one row per device per day
+        loaded = load(device, table, start, end, None if table == tables[-1] else max_rows())
+        if loaded is not None:
+            break
+    timestamps, values = loaded
+    metrics = {}
+    for metric in METRICS:
+        keep = lttb(timestamps, values[metric], points)
+        metrics[metric] = [[int(ts), value] for ts, value in
+                           zip(timestamps[keep].astype(np.int64).tolist(), np.round(values[metric][keep], 2).tolist())]
+    return {
+        'device': str(device.id),
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'resolution': table,
+        'samples': len(timestamps),
+        'metrics': metrics,
+    }
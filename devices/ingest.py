@@ -0,0 +1,172 @@
+"""
+Write-behind telemetry ingestion.
+
+Heartbeats are queued in memory and written in batches with one bulk_create
+per flush instead of one INSERT per heartbeat. The same flush upserts each
+device's latest sample into DeviceMetricsSnapshot, so the snapshot costs one
+statement per flush rather than a write per heartbeat. Liveness
+(last_seen/is_online) is tracked separately by devices.presence.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import background
+from .models import DeviceMetricsSnapshot, TelemetryData
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def update_snapshots(rows):
+    """
+    Upserts the newest of `rows` per device into DeviceMetricsSnapshot,
+    skipping devices whose snapshot is already newer (e.g. replayed spools).
+    """
+    latest = {}
+    for row in rows:
+        if row.device_id not in latest or row.timestamp > latest[row.device_id].timestamp:
+            latest[row.device_id] = row
+    if not latest:
+        return 0
+    current = dict(
+        DeviceMetricsSnapshot.objects.filter(device_id__in=latest).values_list('device_id', 'timestamp')
+    )
+    snapshots = [
+        DeviceMetricsSnapshot(
+            device_id=device_id,
+            timestamp=row.timestamp,
+            cpu_usage=row.cpu_usage,
+            ram_usage=row.ram_usage,
+            disk_usage=row.disk_usage,
+        )
+        for device_id, row in latest.items()
+        if device_id not in current or row.timestamp > current[device_id]
+    ]
+    DeviceMetricsSnapshot.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['device'],
+        update_fields=['timestamp', 'cpu_usage', 'ram_usage', 'disk_usage'],
+    )
+    return len(snapshots)
+
+
+class TelemetryBuffer(background.PeriodicWorker):
+    """
+    Flushes every `interval` seconds or as soon as `max_rows` samples are queued.
+    At most `max_pending` samples are kept if the database falls behind; the
+    oldest are dropped beyond that.
+    """
+    name = 'telemetry'
+
+    def __init__(self, interval=None, max_rows=None, max_pending=None):
+        if interval is None:
+            interval = getattr(settings, 'TELEMETRY_FLUSH_INTERVAL_MS', 1000) / 1000
+        super().__init__(interval)
+        self.max_rows = max_rows or getattr(settings, 'TELEMETRY_FLUSH_MAX_ROWS', 500)
+        self.max_pending = max_pending or getattr(settings, 'TELEMETRY_BUFFER_MAX_PENDING', 50000)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        # Receive-to-commit latency of recently flushed samples (ms)
+        self.latencies = deque(maxlen=10000)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def append(self, device_id, data, timestamp=None):
+        """
+        Queue one sample. Returns True when the buffer is due for a flush.
+        """
+        row = TelemetryData(
+            device_id=device_id,
+            timestamp=timestamp or timezone.now(),
+            cpu_usage=data.get('cpu_usage', 0),
+            ram_usage=data.get('ram_usage', 0),
+            disk_usage=data.get('disk_usage', 0),
+        )
+        row._enqueued = time.monotonic()
+        with self._lock:
+            self._pending.append(row)
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self.rows_dropped += 1
+            return len(self._pending) >= self.max_rows
+
+    async def add(self, device_id, data, timestamp=None):
+        if self.append(device_id, data, timestamp):
+            await self.arun_once()
+
+    def drain(self):
+        with self._lock:
+            rows = list(self._pending)
+            self._pending.clear()
+        return rows
+
+    def requeue(self, rows):
+        with self._lock:
+            self._pending.extendleft(reversed(rows))
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self.rows_dropped += 1
+
+    def run_once(self):
+        rows = self.drain()
+        if not rows:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                TelemetryData.objects.bulk_create(rows, batch_size=self.max_rows)
+                update_snapshots(rows)
+        except Exception:
+            self.requeue(rows)
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        committed = time.monotonic()
+        self.latencies.extend((committed - row._enqueued) * 1000 for row in rows)
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        logger.debug("Flushed %d telemetry rows in %.1fms", len(rows), elapsed_ms)
+        return len(rows)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'rows_dropped': self.rows_dropped,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            'ingest_p50_ms': round(percentile(self.latencies, 50) or 0.0, 2),
+            'ingest_p99_ms': round(percentile(self.latencies, 99) or 0.0, 2),
+        }
+
+
+telemetry_buffer = background.register(TelemetryBuffer())
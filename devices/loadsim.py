@@ -0,0 +1,401 @@
+"""
+Fleet load simulator.
+
+Simulates many agents from one asyncio process. Each simulated agent speaks
+the agent/main.py protocol: handshake (honouring handshake_defer), periodic
+heartbeats, command replies and screen stream frames. The agents drive the
+real AgentConsumer, either in-process through the ASGI application or over
+the network against a running server.
+
+Used by the `simulate_fleet` management command.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+
+from .ingest import percentile, telemetry_buffer
+from .presence import presence
+from . import screen
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes (0 if unknown).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        # High-water mark; kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency(values, pct):
+    value = percentile(values, pct)
+    return None if value is None else round(value, 2)
+
+
+class StatementCounter:
+    """
+    Database execute wrapper counting the statements run on one connection.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class CommunicatorTransport:
+    """
+    In-process transport: messages go straight into the ASGI application.
+    """
+    def __init__(self, application, path='/ws/agent/'):
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=60)
+        return connected
+
+    async def send_json(self, content):
+        await self.communicator.send_json_to(content)
+
+    async def send_bytes(self, data):
+        await self.communicator.send_to(bytes_data=data)
+
+    async def receive(self):
+        """
+        Next message (parsed JSON or raw bytes), or None once the socket closed.
+        """
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] == 'websocket.close':
+                return None
+            if output.get('text') is not None:
+                return json.loads(output['text'])
+            if output.get('bytes') is not None:
+                return output['bytes']
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class WebsocketTransport:
+    """
+    Network transport against a running server (needs the `websockets` package).
+    """
+    def __init__(self, url):
+        self.url = url
+        self.ws = None
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, max_size=None)
+        return True
+
+    async def send_json(self, content):
+        await self.ws.send(json.dumps(content))
+
+    async def send_bytes(self, data):
+        await self.ws.send(data)
+
+    async def receive(self):
+        import websockets
+        try:
+            message = await self.ws.recv()
+        except websockets.exceptions.ConnectionClosed:
+            return None
+        return json.loads(message) if isinstance(message, str) else message
+
+    async def close(self):
+        await self.ws.close()
+
+
+class SimulatedAgent:
+    def __init__(self, simulator, index):
+        self.sim = simulator
+        self.index = index
+        self.mac = '02:%02X:%02X:%02X:%02X:%02X' % tuple((index >> shift) & 0xFF for shift in (32, 24, 16, 8, 0))
+        self.device_id = None
+        self.transport = None
+        self.stream_task = None
+        self.keyframe = True
+        self.seq = 0
+
+    def handshake_data(self):
+        return {
+            'hostname': f'sim-{self.index:05d}',
+            'os_info': 'Simulated 1.0',
+            'mac_address': self.mac,
+            'local_ip': '10.%d.%d.%d' % ((self.index >> 16) & 0xFF, (self.index >> 8) & 0xFF, self.index & 0xFF),
+            'public_ip': '127.0.0.1',
+            'agent_version': 'sim',
+        }
+
+    async def connect(self):
+        while True:
+            self.transport = self.sim.make_transport()
+            started = time.perf_counter()
+            if not await self.transport.connect():
+                raise ConnectionError("Connection rejected")
+            await self.transport.send_json({'type': 'handshake', 'data': self.handshake_data()})
+            reply = await self.transport.receive()
+            if reply and reply.get('type') == 'handshake_ack':
+                self.sim.handshake_ms.append((time.perf_counter() - started) * 1000)
+                self.device_id = reply['device_id']
+                return
+            await self.transport.close()
+            if reply and reply.get('type') == 'handshake_defer':
+                self.sim.deferred += 1
+                retry_after = reply.get('retry_after', 1)
+                await asyncio.sleep(retry_after + random.uniform(0, retry_after))
+                continue
+            raise ConnectionError(f"Unexpected handshake reply: {reply}")
+
+    async def run(self, stop_at):
+        await self.connect()
+        self.sim.connected += 1
+        receiver = asyncio.create_task(self.receive_loop())
+        try:
+            # Spread heartbeats evenly over the interval
+            await asyncio.sleep(random.uniform(0, self.sim.interval))
+            while time.monotonic() < stop_at:
+                await self.transport.send_json({
+                    'type': 'heartbeat',
+                    'data': {
+                        'cpu_usage': round(random.uniform(0, 100), 1),
+                        'ram_usage': round(random.uniform(20, 90), 1),
+                        'disk_usage': round(random.uniform(30, 70), 1),
+                    },
+                })
+                self.sim.heartbeats += 1
+                await asyncio.sleep(self.sim.interval)
+        finally:
+            receiver.cancel()
+            if self.stream_task:
+                self.stream_task.cancel()
+            await self.transport.close()
+
+    async def receive_loop(self):
+        while True:
+            message = await self.transport.receive()
+            if message is None:
+                return
+            if isinstance(message, bytes):
+                continue
+            msg_type = message.get('type')
+            if msg_type == 'command':
+                await self.reply_to_command(message)
+            elif msg_type == 'start_stream':
+                self.keyframe = True
+                if self.stream_task is None or self.stream_task.done():
+                    self.stream_task = asyncio.create_task(self.stream(message.get('fps') or 5))
+            elif msg_type == 'stop_stream' and self.stream_task:
+                self.stream_task.cancel()
+            elif msg_type == 'request_keyframe':
+                self.keyframe = True
+            elif msg_type == 'get_screenshot':
+                await self.transport.send_json({
+                    'type': 'screenshot',
+                    'data': {'image': base64.b64encode(os.urandom(30000)).decode()},
+                })
+                self.sim.screenshots += 1
+
+    async def reply_to_command(self, message):
+        command_id = message.get('command_id')
+        sent_at = self.sim.pending_commands.pop(command_id, None)
+        if sent_at is not None:
+            self.sim.command_ms.append((time.perf_counter() - sent_at) * 1000)
+        await self.transport.send_json({
+            'type': 'command_output',
+            'data': {'command_id': command_id, 'seq': 0, 'stream': 'stdout', 'output': 'ok\n'},
+        })
+        await self.transport.send_json({
+            'type': 'command_response',
+            'data': {'command_id': command_id, 'command': message.get('command'), 'status': 'completed',
+                     'exit_code': 0, 'chunks': 1},
+        })
+
+    async def stream(self, fps):
+        width, height, tile = 1920, 1080, 64
+        while True:
+            if self.keyframe:
+                rects = [(x, y) for y in range(0, height, tile) for x in range(0, width, tile)]
+            else:
+                # A mostly static desktop: a handful of tiles change per frame
+                rects = [(random.randrange(0, width, tile), random.randrange(0, height, tile)) for _ in range(4)]
+            tiles = [(x, y, min(tile, width - x), min(tile, height - y), os.urandom(600)) for x, y in rects]
+            self.seq += 1
+            frame = screen.encode_frame(tiles, width, height, self.seq, keyframe=self.keyframe)
+            self.keyframe = False
+            await self.transport.send_bytes(frame)
+            self.sim.frames += 1
+            self.sim.frame_bytes += len(frame)
+            await asyncio.sleep(1 / fps)
+
+
+class FleetSimulator:
+    """
+    Runs `agents` simulated agents for `duration` seconds and reports:
+    heartbeat throughput, ingest latency (receive to commit), database
+    statements per heartbeat, RSS per connection, handshake and command
+    latency. Database and ingest figures are only available in-process.
+    """
+    def __init__(self, agents=100, duration=30.0, interval=5.0, ramp=5.0, url=None,
+                 commands_per_second=0.0, viewers=0, application=None):
+        self.agents = agents
+        self.duration = duration
+        self.interval = interval
+        self.ramp = ramp
+        self.url = url
+        self.commands_per_second = commands_per_second
+        self.viewers = viewers
+        self.application = application
+
+        self.connected = 0
+        self.deferred = 0
+        self.heartbeats = 0
+        self.frames = 0
+        self.screenshots = 0
+        self.frame_bytes = 0
+        self.handshake_ms = []
+        self.command_ms = []
+        self.pending_commands = {}
+        self.statements = StatementCounter()
+
+    @property
+    def in_process(self):
+        return self.url is None
+
+    def make_transport(self):
+        if self.in_process:
+            return CommunicatorTransport(self.application)
+        return WebsocketTransport(self.url)
+
+    async def install_statement_counter(self):
+        # Consumers run their queries on the shared thread-sensitive executor,
+        # and connections are per thread: install the wrapper from there.
+        await sync_to_async(lambda: connection.execute_wrappers.append(self.statements))()
+
+    async def remove_statement_counter(self):
+        await sync_to_async(lambda: connection.execute_wrappers.remove(self.statements))()
+
+    async def start_agent(self, agent, delay, stop_at):
+        await asyncio.sleep(delay)
+        await agent.run(stop_at)
+
+    async def send_commands(self, agents, stop_at):
+        channel_layer = get_channel_layer()
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(1 / self.commands_per_second)
+            targets = [agent for agent in agents if agent.device_id]
+            if not targets:
+                continue
+            command_id = uuid.uuid4().hex
+            self.pending_commands[command_id] = time.perf_counter()
+            await channel_layer.group_send(
+                f"device_{random.choice(targets).device_id}",
+                {"type": "device.command",
+                 "content": {"type": "command", "command": "echo bench", "command_id": command_id}}
+            )
+
+    async def watch(self, agent, stop_at):
+        """
+        Attach one browser viewer to an agent's screen stream.
+        """
+        while agent.device_id is None:
+            await asyncio.sleep(0.1)
+        viewer = WebsocketCommunicator(self.application, f'/ws/browser/{agent.device_id}/')
+        await viewer.connect()
+        await viewer.send_json_to({'type': 'get_screenshot'})
+        try:
+            while time.monotonic() < stop_at:
+                try:
+                    await viewer.receive_output(timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await viewer.disconnect()
+
+    async def run(self):
+        if self.in_process:
+            await self.install_statement_counter()
+        rss_before = current_rss()
+        started = time.monotonic()
+        stop_at = started + self.ramp + self.duration
+        agents = [SimulatedAgent(self, i) for i in range(self.agents)]
+        tasks = [
+            asyncio.create_task(self.start_agent(agent, self.ramp * i / max(1, self.agents), stop_at))
+            for i, agent in enumerate(agents)
+        ]
+        if self.in_process and self.commands_per_second:
+            tasks.append(asyncio.create_task(self.send_commands(agents, stop_at)))
+        if self.in_process:
+            tasks.extend(asyncio.create_task(self.watch(agent, stop_at)) for agent in agents[:self.viewers])
+
+        # Measure the steady state only: after the ramp, once everyone is connected
+        await asyncio.sleep(self.ramp)
+        while self.connected < self.agents and time.monotonic() < stop_at:
+            await asyncio.sleep(0.1)
+        rss_connected = current_rss()
+        heartbeats_before = self.heartbeats
+        statements_before = self.statements.count
+        measured_from = time.monotonic()
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        measured = max(0.001, time.monotonic() - measured_from)
+        heartbeats = self.heartbeats - heartbeats_before
+
+        if self.in_process:
+            # Stop the write-behind workers with a final flush so every
+            # heartbeat is counted and nothing is left for the exit hook
+            await telemetry_buffer.stop()
+            await presence.stop()
+            await sync_to_async(presence.run_once)(force_persist=True)
+            statements = self.statements.count - statements_before
+            await self.remove_statement_counter()
+
+        report = {
+            'mode': 'in-process' if self.in_process else self.url,
+            'agents': self.agents,
+            'connected': self.connected,
+            'errors': sum(1 for result in results if isinstance(result, Exception)),
+            'deferred_handshakes': self.deferred,
+            'handshake_p50_ms': latency(self.handshake_ms, 50),
+            'handshake_p99_ms': latency(self.handshake_ms, 99),
+            'heartbeats': heartbeats,
+            'heartbeats_per_sec': round(heartbeats / measured, 1),
+            'rss_per_connection_kb': round((rss_connected - rss_before) / max(1, self.connected) / 1024, 1),
+            'frames_sent': self.frames,
+            'frame_mb': round(self.frame_bytes / 1e6, 2),
+            'screenshots_sent': self.screenshots,
+            'command_p50_ms': latency(self.command_ms, 50),
+            'command_p99_ms': latency(self.command_ms, 99),
+        }
+        if self.in_process:
+            buffer_stats = telemetry_buffer.stats()
+            report.update({
+                'ingest_p50_ms': buffer_stats['ingest_p50_ms'],
+                'ingest_p99_ms': buffer_stats['ingest_p99_ms'],
+                'db_statements': statements,
+                'db_statements_per_heartbeat': round(statements / max(1, heartbeats), 3),
+                'max_flush_ms': buffer_stats['max_flush_ms'],
+            })
+        return report
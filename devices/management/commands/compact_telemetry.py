@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from devices.rollups import TelemetryCompactor
+
+
+class Command(BaseCommand):
+    help = "Folds new raw telemetry into the 1m/1h/1d rollup tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help="Raw rows per transaction")
+
+    def handle(self, *args, **options):
+        compacted = TelemetryCompactor(chunk_size=options['chunk_size']).run_once()
+        self.stdout.write(f"Compacted {compacted} telemetry rows")
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from devices import export, history
+
+
+class Command(BaseCommand):
+    help = "Streams raw telemetry to a file as CSV, NDJSON or Parquet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='csv', help="csv, ndjson or parquet (requires pyarrow)")
+        parser.add_argument('--device', help="Device id")
+        parser.add_argument('--client', help="Assigned client (user id or username)")
+        parser.add_argument('--from', dest='start', help="ISO 8601 time or epoch seconds")
+        parser.add_argument('--to', dest='end', help="ISO 8601 time or epoch seconds")
+        parser.add_argument('--chunk-size', type=int, default=None, help=f"Rows fetched per round trip (default: {export.CHUNK_SIZE})")
+        parser.add_argument('--output', '-o', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            rows = export.export_queryset(
+                options['device'], options['client'],
+                history.parse_time(options['start']), history.parse_time(options['end']),
+            )
+            body = export.stream(options['format'], rows, options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for data in body:
+                output.write(data)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from devices.alerts import alert_writer
+from devices.poller import AssetPoller
+
+
+class Command(BaseCommand):
+    help = "Probes every monitored asset once and records the results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Assets probed at once")
+        parser.add_argument('--timeout', type=float, help="Seconds per TCP connect or ping")
+
+    def handle(self, *args, **options):
+        poller = AssetPoller(alert_writer, concurrency=options['concurrency'], timeout=options['timeout'])
+        probed = poller.poll_all()
+        alert_writer.run_once()
+        self.stdout.write(f"Probed {probed} assets")
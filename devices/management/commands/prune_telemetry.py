@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from devices.retention import RetentionWorker, retention_policy
+
+
+class Command(BaseCommand):
+    help = "Deletes telemetry and rollups older than the retention policy, in small chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help="Rows deleted per statement")
+        parser.add_argument('--pause', type=float, help="Seconds to sleep between chunks")
+
+    def handle(self, *args, **options):
+        worker = RetentionWorker(chunk_size=options['chunk_size'], pause=options['pause'])
+        deleted = worker.run_once()
+        policy = retention_policy()
+        for table, days in policy.items():
+            if table in deleted:
+                self.stdout.write(f"{table}: kept {days} days, deleted {deleted[table]} rows")
+            else:
+                self.stdout.write(f"{table}: kept forever")
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+from devices.loadsim import FleetSimulator
+
+
+class Command(BaseCommand):
+    help = "Simulates a fleet of agents against the AgentConsumer and reports ingestion throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agents', type=int, default=100, help="Number of simulated agents")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to measure after the ramp")
+        parser.add_argument('--interval', type=float, default=5, help="Heartbeat interval per agent (seconds)")
+        parser.add_argument('--ramp', type=float, default=5, help="Seconds over which agents connect")
+        parser.add_argument('--commands-per-sec', type=float, default=0, help="Commands sent to random agents")
+        parser.add_argument('--viewers', type=int, default=0, help="Agents with a browser watching their screen")
+        parser.add_argument('--url', help="Drive a running server (e.g. ws://localhost:8000/ws/agent/) "
+                                          "instead of the in-process ASGI application")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        simulator = FleetSimulator(
+            agents=options['agents'],
+            duration=options['duration'],
+            interval=options['interval'],
+            ramp=options['ramp'],
+            url=options['url'],
+            commands_per_second=options['commands_per_sec'],
+            viewers=options['viewers'],
+        )
+        if options['url']:
+            report = asyncio.run(simulator.run())
+        else:
+            report = self.run_in_process(simulator)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for key, value in report.items():
+            self.stdout.write(f"{key:>30}: {value}")
+
+    def run_in_process(self, simulator):
+        """
+        Runs against a throwaway copy of the database so simulated devices
+        never land in the real one. SQLite uses an on-disk file rather than
+        the default in-memory test database to keep write costs realistic.
+        """
+        from omni_rmm.asgi import application
+
+        simulator.application = application
+        workdir = None
+        if connection.vendor == 'sqlite':
+            workdir = tempfile.mkdtemp(prefix='simulate_fleet_')
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'fleet.sqlite3')
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            return asyncio.run(simulator.run())
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            if workdir:
+                os.rmdir(workdir)
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="telemetrydata",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
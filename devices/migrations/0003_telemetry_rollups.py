@@ -0,0 +1,90 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0002_telemetry_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RollupWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("last_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TelemetryRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[("1m", "1 minute"), ("1h", "1 hour"), ("1d", "1 day")],
+                        max_length=2,
+                    ),
+                ),
+                ("bucket", models.DateTimeField(help_text="Start of the bucket (UTC)")),
+                ("samples", models.PositiveIntegerField(default=0)),
+                ("cpu_avg", models.FloatField()),
+                ("cpu_min", models.FloatField()),
+                ("cpu_max", models.FloatField()),
+                ("cpu_p95", models.FloatField()),
+                ("ram_avg", models.FloatField()),
+                ("ram_min", models.FloatField()),
+                ("ram_max", models.FloatField()),
+                ("ram_p95", models.FloatField()),
+                ("disk_avg", models.FloatField()),
+                ("disk_min", models.FloatField()),
+                ("disk_max", models.FloatField()),
+                ("disk_p95", models.FloatField()),
+                (
+                    "device",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to="devices.device",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("device__isnull", False)),
+                        fields=("resolution", "device", "bucket"),
+                        name="unique_device_rollup",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("device__isnull", True)),
+                        fields=("resolution", "bucket"),
+                        name="unique_fleet_rollup",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0003_telemetry_rollups"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="telemetrydata",
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name="telemetrydata",
+            index=models.Index(
+                fields=["device", "timestamp"], name="telemetry_device_time_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0005_device_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceMetricsSnapshot",
+            fields=[
+                (
+                    "device",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="metrics",
+                        serialize=False,
+                        to="devices.device",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                ("cpu_usage", models.FloatField(help_text="Percentage")),
+                ("ram_usage", models.FloatField(help_text="Percentage")),
+                ("disk_usage", models.FloatField(help_text="Percentage")),
+            ],
+        ),
+    ]
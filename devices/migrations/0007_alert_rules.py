@@ -0,0 +1,123 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0006_device_metrics_snapshot"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="monitoringalert",
+            name="dedupe_key",
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.CreateModel(
+            name="AlertRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("cpu_usage", "CPU"),
+                            ("ram_usage", "RAM"),
+                            ("disk_usage", "Disk"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "operator",
+                    models.CharField(
+                        choices=[("gt", "above"), ("lt", "below")],
+                        default="gt",
+                        max_length=2,
+                    ),
+                ),
+                ("threshold", models.FloatField(help_text="Percentage")),
+                (
+                    "clear_threshold",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Resolve once the value is back past this level (default: 5 points inside the threshold)",
+                        null=True,
+                    ),
+                ),
+                (
+                    "duration",
+                    models.PositiveIntegerField(
+                        default=300,
+                        help_text="Seconds the threshold must be crossed before alerting",
+                    ),
+                ),
+                (
+                    "severity",
+                    models.CharField(
+                        choices=[
+                            ("info", "Info"),
+                            ("warning", "Warning"),
+                            ("critical", "Critical"),
+                        ],
+                        default="warning",
+                        max_length=20,
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_rules",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "device",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_rules",
+                        to="devices.device",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="monitoringalert",
+            name="rule",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="alerts",
+                to="devices.alertrule",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="monitoringalert",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("resolved", False)),
+                fields=("dedupe_key",),
+                name="unique_open_alert",
+            ),
+        ),
+    ]
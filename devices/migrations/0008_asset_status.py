@@ -0,0 +1,58 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("devices", "0007_alert_rules"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AssetStatus",
+            fields=[
+                (
+                    "asset",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="status",
+                        serialize=False,
+                        to="devices.asset",
+                    ),
+                ),
+                ("is_up", models.BooleanField(null=True)),
+                ("latency_ms", models.FloatField(blank=True, null=True)),
+                ("last_checked", models.DateTimeField(blank=True, null=True)),
+                ("last_change", models.DateTimeField(blank=True, null=True)),
+                ("consecutive_failures", models.PositiveIntegerField(default=0)),
+                ("history", models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="asset",
+            name="poll_interval",
+            field=models.PositiveIntegerField(
+                default=60, help_text="Seconds between probes"
+            ),
+        ),
+        migrations.AddField(
+            model_name="asset",
+            name="probe_icmp",
+            field=models.BooleanField(
+                default=False, help_text="Also send an ICMP echo (ping)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="asset",
+            name="probe_ports",
+            field=models.CharField(
+                blank=True,
+                help_text="Comma-separated TCP ports to connect to; blank uses the category defaults",
+                max_length=100,
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 import uuid
 
 class Device(models.Model):
@@ -26,6 +27,12 @@ class Device(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # API pagination cursor
+            models.Index(fields=['created_at'], name='device_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.hostname} ({self.local_ip})"
 
@@ -38,13 +45,84 @@ class NetworkInterface(models.Model):
 
 class TelemetryData(models.Model):
     device = models.ForeignKey(Device, related_name='telemetry', on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the sample is received, not when the buffered row is written
+    timestamp = models.DateTimeField(default=timezone.now)
     cpu_usage = models.FloatField(help_text="Percentage")
     ram_usage = models.FloatField(help_text="Percentage")
     disk_usage = models.FloatField(help_text="Percentage")
     
     class Meta:
-        ordering = ['-timestamp']
+        indexes = [
+            # Per-device history reads and retention pruning
+            models.Index(fields=['device', 'timestamp'], name='telemetry_device_time_idx'),
+        ]
+
+class DeviceMetricsSnapshot(models.Model):
+    """
+    Latest sample of each device, kept current by the telemetry write path
+    so current-state reads never touch the TelemetryData history.
+    """
+    device = models.OneToOneField(Device, primary_key=True, related_name='metrics', on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()
+    cpu_usage = models.FloatField(help_text="Percentage")
+    ram_usage = models.FloatField(help_text="Percentage")
+    disk_usage = models.FloatField(help_text="Percentage")
+
+    def __str__(self):
+        return f"{self.device_id} @ {self.timestamp}"
+
+class TelemetryRollup(models.Model):
+    """
+    Downsampled telemetry, filled incrementally by devices.rollups.
+    A row without a device holds the fleet-wide aggregate for the bucket.
+    """
+    RESOLUTION_CHOICES = (
+        ('1m', '1 minute'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    )
+    resolution = models.CharField(max_length=2, choices=RESOLUTION_CHOICES)
+    device = models.ForeignKey(Device, related_name='rollups', on_delete=models.CASCADE, null=True, blank=True)
+    bucket = models.DateTimeField(help_text="Start of the bucket (UTC)")
+    samples = models.PositiveIntegerField(default=0)
+
+    cpu_avg = models.FloatField()
+    cpu_min = models.FloatField()
+    cpu_max = models.FloatField()
+    cpu_p95 = models.FloatField()
+    ram_avg = models.FloatField()
+    ram_min = models.FloatField()
+    ram_max = models.FloatField()
+    ram_p95 = models.FloatField()
+    disk_avg = models.FloatField()
+    disk_min = models.FloatField()
+    disk_max = models.FloatField()
+    disk_p95 = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resolution', 'device', 'bucket'],
+                condition=models.Q(device__isnull=False),
+                name='unique_device_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['resolution', 'bucket'],
+                condition=models.Q(device__isnull=True),
+                name='unique_fleet_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.resolution} {self.bucket:%Y-%m-%d %H:%M} ({self.device_id or 'fleet'})"
+
+class RollupWatermark(models.Model):
+    """
+    Highest raw row id already folded into the rollups.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
 class Asset(models.Model):
     """
@@ -69,9 +147,35 @@ class Asset(models.Model):
     
     specs = models.JSONField(default=dict, blank=True)
 
+    # Reachability probing (see devices/poller.py)
+    probe_ports = models.CharField(max_length=100, blank=True, help_text="Comma-separated TCP ports to connect to; blank uses the category defaults")
+    probe_icmp = models.BooleanField(default=False, help_text="Also send an ICMP echo (ping)")
+    poll_interval = models.PositiveIntegerField(default=60, help_text="Seconds between probes")
+
     def __str__(self):
         return f"{self.name} ({self.category})"
 
+    def get_probe_ports(self):
+        return [int(port) for port in self.probe_ports.replace(' ', '').split(',') if port.isdigit()]
+
+
+class AssetStatus(models.Model):
+    """
+    Latest probe result for a monitored asset, with a short history ring of
+    [epoch seconds, up, latency ms] samples (newest last).
+    """
+    asset = models.OneToOneField(Asset, related_name='status', on_delete=models.CASCADE, primary_key=True)
+    is_up = models.BooleanField(null=True)
+    latency_ms = models.FloatField(null=True, blank=True)
+    last_checked = models.DateTimeField(null=True, blank=True)
+    last_change = models.DateTimeField(null=True, blank=True)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    history = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        state = 'unknown' if self.is_up is None else ('up' if self.is_up else 'down')
+        return f"{self.asset.name}: {state}"
+
 class MonitoringAlert(models.Model):
     SEVERITY_CHOICES = (
         ('info', 'Info'),
@@ -87,5 +191,50 @@ class MonitoringAlert(models.Model):
     resolved = models.BooleanField(default=False)
     resolved_at = models.DateTimeField(blank=True, null=True)
 
+    # Identifies the incident; at most one unresolved alert exists per key
+    dedupe_key = models.CharField(max_length=200, blank=True, null=True)
+    rule = models.ForeignKey('AlertRule', related_name='alerts', on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(resolved=False),
+                name='unique_open_alert',
+            ),
+        ]
+
     def __str__(self):
         return f"Alert: {self.message} ({self.severity})"
+
+class AlertRule(models.Model):
+    """
+    Threshold rule evaluated against the heartbeat stream by devices.alerts.
+    Applies to one device, to every device of a client, or (neither set) to all devices.
+    """
+    METRIC_CHOICES = (
+        ('cpu_usage', 'CPU'),
+        ('ram_usage', 'RAM'),
+        ('disk_usage', 'Disk'),
+    )
+    OPERATOR_CHOICES = (
+        ('gt', 'above'),
+        ('lt', 'below'),
+    )
+    name = models.CharField(max_length=100)
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    operator = models.CharField(max_length=2, choices=OPERATOR_CHOICES, default='gt')
+    threshold = models.FloatField(help_text="Percentage")
+    clear_threshold = models.FloatField(
+        blank=True, null=True,
+        help_text="Resolve once the value is back past this level (default: 5 points inside the threshold)"
+    )
+    duration = models.PositiveIntegerField(default=300, help_text="Seconds the threshold must be crossed before alerting")
+    severity = models.CharField(max_length=20, choices=MonitoringAlert.SEVERITY_CHOICES, default='warning')
+
+    device = models.ForeignKey(Device, related_name='alert_rules', on_delete=models.CASCADE, null=True, blank=True)
+    client = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='alert_rules', on_delete=models.CASCADE, null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.get_metric_display()} {self.get_operator_display()} {self.threshold}%)"
@@ -0,0 +1,104 @@
+"""
+Offline detection for important devices.
+
+Every device flagged `is_important` has a timer in a hashed timer wheel set
+to when its next heartbeat is due plus a grace period. A heartbeat pushes the
+timer back (O(1), no database access). Only a timer that actually expires
+does any work: it opens an "offline" MonitoringAlert through the shared
+AlertWriter. The next heartbeat from the device resolves it.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from core import background
+from core.timers import TimerWheel
+from .alerts import alert_writer
+from .models import Device, MonitoringAlert
+
+logger = logging.getLogger(__name__)
+
+
+def offline_key(device_id):
+    return f"offline:device:{device_id}"
+
+
+class OfflineDetector(background.PeriodicWorker):
+    name = 'offline'
+
+    def __init__(self, writer, interval=None, grace=None, refresh=None, clock=time.monotonic):
+        super().__init__(interval if interval is not None else getattr(settings, 'OFFLINE_CHECK_INTERVAL', 1))
+        self.writer = writer
+        self.grace = grace if grace is not None else getattr(settings, 'OFFLINE_GRACE_SECONDS', 60)
+        self.refresh = refresh if refresh is not None else getattr(settings, 'OFFLINE_REFRESH_INTERVAL', 60)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick=1.0, slots=max(64, int(self.grace) * 2), now=clock())
+        self._important = set()
+        self._alerted = set()
+        self._names = {}
+        self._loaded_at = None
+
+    def heartbeat(self, device_id):
+        device_id = str(device_id)
+        if device_id not in self._important:
+            return
+        with self._lock:
+            self._wheel.schedule(device_id, self.clock() + self.grace)
+            if device_id in self._alerted:
+                self._alerted.discard(device_id)
+                self.writer.resolve(offline_key(device_id))
+
+    def load(self, devices, open_alerts=()):
+        """
+        Installs the important devices as (id, hostname) pairs. Newly important
+        devices get a full grace period; devices no longer important lose their timer.
+        """
+        now = self.clock()
+        with self._lock:
+            self._names = {str(device_id): hostname for device_id, hostname in devices}
+            important = set(self._names)
+            for device_id in important - self._important:
+                self._wheel.schedule(device_id, now + self.grace)
+            for device_id in self._important - important:
+                self._wheel.cancel(device_id)
+                self._alerted.discard(device_id)
+            self._important = important
+            if self._loaded_at is None:
+                # Offline alerts still open from before a restart
+                self._alerted.update(str(device_id) for device_id in open_alerts if str(device_id) in important)
+            self._loaded_at = now
+
+    def check(self):
+        """
+        Expires due timers. Returns the ids of devices that just went offline.
+        """
+        with self._lock:
+            expired = [device_id for device_id in self._wheel.advance(self.clock()) if device_id not in self._alerted]
+            self._alerted.update(expired)
+        for device_id in expired:
+            self.writer.open(
+                offline_key(device_id),
+                device_id=device_id,
+                severity='critical',
+                message=f"{self._names.get(device_id, device_id)} is offline: no heartbeat for {self.grace}s",
+            )
+        if expired:
+            logger.info("%d important devices went offline", len(expired))
+        return expired
+
+    def run_once(self):
+        if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh:
+            open_alerts = [] if self._loaded_at is not None else list(MonitoringAlert.objects.filter(
+                resolved=False, dedupe_key__startswith='offline:device:'
+            ).values_list('device_id', flat=True))
+            self.load(list(Device.objects.filter(is_important=True).values_list('id', 'hostname')), open_alerts)
+        return len(self.check())
+
+    def shutdown(self):
+        pass
+
+
+offline_detector = background.register(OfflineDetector(alert_writer))
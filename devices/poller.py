@@ -0,0 +1,344 @@
+"""
+Reachability probing for monitored Assets.
+
+Agentless gear (printers, switches, ...) is probed from the server with a TCP
+connect to its service ports and, optionally, an ICMP echo. Everything runs on
+the event loop: probes are coroutines bounded by one global semaphore, and all
+ICMP echoes share a single socket, so thousands of assets cost no threads.
+
+Each asset has a timer in a TimerWheel set to its next probe; every tick the
+due assets are probed together and the results are written in one
+transaction to AssetStatus. An asset that fails DOWN_AFTER probes in a row
+gets a "down" MonitoringAlert through the shared AlertWriter, and the first
+successful probe resolves it.
+"""
+import asyncio
+import ipaddress
+import itertools
+import logging
+import os
+import socket
+import struct
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import background
+from core.timers import TimerWheel
+from .alerts import alert_writer
+from .models import Asset, AssetStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {
+    'printer': [9100, 631, 80],
+    'switch': [22, 443, 80],
+    'monitor': [80],
+    'mobile': [],
+    'other': [80],
+}
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+
+def asset_key(asset_id):
+    return f"asset:{asset_id}:down"
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class Pinger:
+    """
+    ICMP echo over one shared socket. Uses an unprivileged ping socket where
+    the kernel allows it, a raw socket otherwise (root); if neither can be
+    opened, ping() returns None and ICMP is treated as unavailable.
+    """
+    def __init__(self):
+        self._sock = None
+        self._raw = False
+        self._loop = None
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = itertools.count()
+        self._waiting = {}  # (address, sequence) -> Future
+        self.available = None
+
+    def _open(self):
+        for kind, raw in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+            try:
+                sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            return sock, raw
+        return None, False
+
+    def _ensure(self):
+        loop = asyncio.get_running_loop()
+        if self._sock is not None and self._loop is loop:
+            return True
+        self.close()
+        self._sock, self._raw = self._open()
+        if self._sock is None:
+            if self.available is None:
+                logger.warning("ICMP probes unavailable: no permission to open an ICMP socket")
+            self.available = False
+            return False
+        self.available = True
+        self._loop = loop
+        loop.add_reader(self._sock.fileno(), self._on_readable)
+        return True
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._loop.remove_reader(self._sock.fileno())
+            except Exception:
+                pass
+            self._sock.close()
+            self._sock = None
+        for future in self._waiting.values():
+            future.cancel()
+        self._waiting.clear()
+
+    def _on_readable(self):
+        while True:
+            try:
+                packet, (address, _) = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self._raw:
+                packet = packet[(packet[0] & 0x0F) * 4:]
+            if len(packet) < 8:
+                continue
+            kind, _, _, ident, sequence = struct.unpack('!BBHHH', packet[:8])
+            # Ping sockets rewrite the identifier, so only raw sockets can check it
+            if kind != ICMP_ECHO_REPLY or (self._raw and ident != self._ident):
+                continue
+            future = self._waiting.pop((address, sequence), None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def ping(self, address, timeout):
+        """
+        Returns the round trip in ms, or None if ICMP is unavailable; raises
+        TimeoutError when no reply arrives.
+        """
+        if not self._ensure():
+            return None
+        sequence = next(self._seq) & 0xFFFF
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self._ident, sequence)
+        payload = b'omni-rmm'
+        packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, _checksum(header + payload), self._ident, sequence) + payload
+        future = self._loop.create_future()
+        self._waiting[(address, sequence)] = future
+        started = time.perf_counter()
+        try:
+            self._sock.sendto(packet, (address, 0))
+            await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiting.pop((address, sequence), None)
+        return (time.perf_counter() - started) * 1000
+
+
+async def tcp_probe(host, port, timeout):
+    """
+    Returns the connect time in ms, or None if the port did not accept.
+    """
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    latency = (time.perf_counter() - started) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return latency
+
+
+class AssetPoller(background.PeriodicWorker):
+    name = 'assets'
+
+    def __init__(self, writer, interval=None, concurrency=None, timeout=None, refresh=None,
+                 history=None, down_after=None, clock=time.monotonic):
+        super().__init__(interval if interval is not None else getattr(settings, 'ASSET_POLL_TICK', 1))
+        self.writer = writer
+        self.concurrency = concurrency or getattr(settings, 'ASSET_POLL_CONCURRENCY', 500)
+        self.timeout = timeout or getattr(settings, 'ASSET_PROBE_TIMEOUT', 2)
+        self.refresh = refresh if refresh is not None else getattr(settings, 'ASSET_POLL_REFRESH', 60)
+        self.history = history or getattr(settings, 'ASSET_HISTORY_LENGTH', 120)
+        self.down_after = down_after or getattr(settings, 'ASSET_DOWN_AFTER', 2)
+        self.clock = clock
+        self.pinger = Pinger()
+        self._wheel = TimerWheel(tick=1.0, slots=512, now=clock())
+        self._targets = {}  # asset id -> (name, address, ports, icmp, interval)
+        self._loaded_at = None
+
+        # Counters
+        self.probed = 0
+
+    def load(self, assets):
+        """
+        Installs the monitored assets. New ones are probed on the next tick;
+        assets no longer monitored lose their timer. Assets with nothing to
+        probe (no ports, and no ICMP or an IPv6 address) are skipped rather
+        than reported down.
+        """
+        now = self.clock()
+        targets = {}
+        for asset in assets:
+            if not asset.ip_address:
+                continue
+            ports = asset.get_probe_ports() or DEFAULT_PORTS.get(asset.category, [])
+            try:
+                icmp = asset.probe_icmp and ipaddress.ip_address(asset.ip_address).version == 4
+            except ValueError:
+                continue
+            if not ports and not icmp:
+                continue
+            targets[asset.id] = (asset.name, asset.ip_address, ports, icmp, max(asset.poll_interval, 1))
+        for asset_id in targets.keys() - self._targets.keys():
+            self._wheel.schedule(asset_id, now)
+        for asset_id in self._targets.keys() - targets.keys():
+            self._wheel.cancel(asset_id)
+        self._targets = targets
+        self._loaded_at = now
+
+    def load_from_db(self):
+        self.load(Asset.objects.filter(is_monitored=True).only(
+            'id', 'name', 'category', 'ip_address', 'probe_ports', 'probe_icmp', 'poll_interval'
+        ))
+
+    def due(self):
+        return [asset_id for asset_id in self._wheel.advance(self.clock()) if asset_id in self._targets]
+
+    async def probe(self, asset_id):
+        """
+        Returns (asset_id, up, latency ms). All ports (and the ICMP echo) are
+        tried at once; up means any of them answered, latency is the fastest.
+        """
+        _, address, ports, icmp, _ = self._targets[asset_id]
+        probes = [tcp_probe(address, port, self.timeout) for port in ports]
+        if icmp:
+            probes.append(self._ping(address))
+        answered = [latency for latency in await asyncio.gather(*probes) if latency is not None]
+        if answered:
+            return asset_id, True, min(answered)
+        return asset_id, False, None
+
+    async def _ping(self, address):
+        try:
+            return await self.pinger.ping(address, self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+    async def probe_all(self, asset_ids):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(asset_id):
+            async with semaphore:
+                return await self.probe(asset_id)
+
+        return await asyncio.gather(*(bounded(asset_id) for asset_id in asset_ids))
+
+    def record(self, results):
+        """
+        Writes probe results to AssetStatus and raises or resolves alerts on
+        up/down transitions.
+        """
+        if not results:
+            return
+        now = timezone.now()
+        stamp = int(now.timestamp())
+        with transaction.atomic():
+            existing = AssetStatus.objects.in_bulk([asset_id for asset_id, _, _ in results])
+            created, updated = [], []
+            for asset_id, up, latency in results:
+                status = existing.get(asset_id)
+                if status is None:
+                    status = AssetStatus(asset_id=asset_id)
+                    created.append(status)
+                else:
+                    updated.append(status)
+                was_up = status.is_up
+                status.consecutive_failures = 0 if up else status.consecutive_failures + 1
+                if up:
+                    status.is_up = True
+                elif was_up is None or status.consecutive_failures >= self.down_after:
+                    # A known-good asset rides out a single missed probe
+                    status.is_up = False
+                if status.is_up != was_up:
+                    status.last_change = now
+                if up and was_up is False:
+                    self.writer.resolve(asset_key(asset_id))
+                elif status.consecutive_failures == self.down_after:
+                    self._raise(asset_id)
+                status.latency_ms = round(latency, 2) if latency is not None else None
+                status.last_checked = now
+                status.history = (status.history + [[stamp, int(up), status.latency_ms]])[-self.history:]
+            AssetStatus.objects.bulk_create(created)
+            AssetStatus.objects.bulk_update(
+                updated, ['is_up', 'latency_ms', 'last_checked', 'last_change', 'consecutive_failures', 'history']
+            )
+
+    def _raise(self, asset_id):
+        name, address = self._targets.get(asset_id, (asset_id, ''))[:2]
+        self.writer.open(
+            asset_key(asset_id),
+            asset_id=asset_id,
+            severity='warning',
+            message=f"{name} ({address}) is not responding: {self.down_after} probes failed",
+        )
+
+    async def acycle(self, asset_ids=None):
+        """
+        Probes the assets that are due (or `asset_ids`) and records the results.
+        """
+        if asset_ids is None:
+            if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh:
+                await database_sync_to_async(self.load_from_db)()
+            asset_ids = self.due()
+        if not asset_ids:
+            return 0
+        results = await self.probe_all(asset_ids)
+        now = self.clock()
+        for asset_id in asset_ids:
+            self._wheel.schedule(asset_id, now + self._targets[asset_id][4])
+        await database_sync_to_async(self.record)(results)
+        self.probed += len(results)
+        return len(results)
+
+    async def arun_once(self):
+        return await self.acycle()
+
+    def run_once(self):
+        return async_to_sync(self.acycle)()
+
+    def poll_all(self):
+        """
+        Probes every monitored asset now, whatever its schedule.
+        """
+        self.load_from_db()
+        return async_to_sync(self.acycle)(list(self._targets))
+
+    def shutdown(self):
+        pass
+
+
+asset_poller = background.register(AssetPoller(alert_writer))
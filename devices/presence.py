@@ -0,0 +1,181 @@
+"""
+In-memory device presence.
+
+Liveness is tracked per device id in this process. Only online/offline
+transitions are written to Device.is_online, and last_seen is persisted in
+bulk every PRESENCE_PERSIST_INTERVAL seconds instead of on every heartbeat.
+A device that disconnects is dropped from the table once its state has been
+written. Devices this process has no entry for, e.g. those connected to
+another server process, are reported from the database.
+
+On its first flush, and once per persist interval after that, the table
+reconciles the database: a device still marked online that is not connected
+here and whose last_seen is older than the persist interval plus
+OFFLINE_GRACE_SECONDS was left over by a crashed process. Devices connected
+to another live process keep having their last_seen persisted, so they are
+never older than that and are left alone.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core import background
+from .models import Device
+
+
+class PresenceTable(background.PeriodicWorker):
+    name = 'presence'
+
+    def __init__(self, interval=None, persist_interval=None):
+        if interval is None:
+            interval = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 1.0)
+        super().__init__(interval)
+        if persist_interval is None:
+            persist_interval = getattr(settings, 'PRESENCE_PERSIST_INTERVAL', 60.0)
+        self.persist_interval = persist_interval
+
+        self._lock = threading.Lock()
+        self._last_seen = {}     # device_id -> datetime
+        self._connections = {}   # device_id -> open agent connections
+        self._transitions = {}   # device_id -> pending is_online value
+        self._dirty = set()      # device ids whose last_seen is not persisted yet
+        self._last_persist = time.monotonic()
+        self._last_reconcile = None
+        self.reconciled = False
+
+    @property
+    def authoritative(self):
+        """
+        True once this process has reconciled the table and owns agent connections.
+        """
+        return self.reconciled
+
+    def connect(self, device_id, now=None):
+        device_id = str(device_id)
+        with self._lock:
+            count = self._connections.get(device_id, 0)
+            self._connections[device_id] = count + 1
+            self._last_seen[device_id] = now or timezone.now()
+            self._dirty.add(device_id)
+            if count == 0:
+                self._transitions[device_id] = True
+
+    def disconnect(self, device_id, now=None):
+        device_id = str(device_id)
+        with self._lock:
+            count = self._connections.get(device_id, 0) - 1
+            self._last_seen[device_id] = now or timezone.now()
+            self._dirty.add(device_id)
+            if count > 0:
+                self._connections[device_id] = count
+                return
+            self._connections.pop(device_id, None)
+            self._transitions[device_id] = False
+
+    def touch(self, device_id, now=None):
+        device_id = str(device_id)
+        with self._lock:
+            self._last_seen[device_id] = now or timezone.now()
+            self._dirty.add(device_id)
+
+    def is_online(self, device_id):
+        return str(device_id) in self._connections
+
+    def last_seen(self, device_id):
+        return self._last_seen.get(str(device_id))
+
+    def online_ids(self):
+        return list(self._connections)
+
+    def online_count(self):
+        """
+        Devices connected here plus those the database has online elsewhere.
+        """
+        with self._lock:
+            connected = len(self._connections)
+            known = list(self._last_seen)
+        return connected + Device.objects.filter(is_online=True).exclude(id__in=known).count()
+
+    def apply(self, devices):
+        """
+        Overlay live presence onto Device instances loaded from the database.
+        Devices without an entry here keep their database state.
+        """
+        if not self.authoritative:
+            return devices
+        for device in devices:
+            device_id = str(device.id)
+            last_seen = self._last_seen.get(device_id)
+            if device_id in self._connections:
+                device.is_online = True
+                device.last_seen = last_seen
+            elif last_seen is not None and (device.last_seen is None or last_seen >= device.last_seen):
+                # Disconnected from here and not connected anywhere since
+                device.is_online = False
+                device.last_seen = last_seen
+        return devices
+
+    def reconcile(self, now=None):
+        """
+        Marks offline the devices left online by a crashed process. Returns how many.
+        """
+        now = now or timezone.now()
+        cutoff = now - timedelta(seconds=self.persist_interval + getattr(settings, 'OFFLINE_GRACE_SECONDS', 60))
+        stale = Device.objects.filter(is_online=True) \
+            .filter(Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True)) \
+            .exclude(id__in=self.online_ids())
+        count = stale.update(is_online=False)
+        self.reconciled = True
+        self._last_reconcile = time.monotonic()
+        return count
+
+    def run_once(self, force_persist=False):
+        if not self.reconciled or time.monotonic() - self._last_reconcile >= self.persist_interval:
+            self.reconcile()
+
+        with self._lock:
+            transitions, self._transitions = self._transitions, {}
+            persist_due = force_persist or time.monotonic() - self._last_persist >= self.persist_interval
+            if persist_due:
+                dirty, self._dirty = self._dirty, set()
+                self._last_persist = time.monotonic()
+            else:
+                dirty = set()
+
+        online = [device_id for device_id, state in transitions.items() if state]
+        offline = [device_id for device_id, state in transitions.items() if not state]
+        if online:
+            Device.objects.filter(id__in=online).update(is_online=True)
+        if offline:
+            Device.objects.filter(id__in=offline).update(is_online=False)
+        if dirty:
+            Device.objects.bulk_update(
+                [Device(id=device_id, last_seen=self._last_seen[device_id]) for device_id in dirty],
+                ['last_seen'],
+                batch_size=500,
+            )
+        # Forget devices that are gone once everything about them is written
+        with self._lock:
+            for device_id in dirty.union(offline):
+                if device_id not in self._connections and device_id not in self._dirty \
+                        and device_id not in self._transitions:
+                    self._last_seen.pop(device_id, None)
+        return len(transitions) + len(dirty)
+
+    def shutdown(self):
+        if not self.reconciled:
+            # Never ran in this process (e.g. a management command)
+            return
+        # Connections are not going to be closed cleanly; record everyone offline.
+        with self._lock:
+            for device_id in self._connections:
+                self._transitions[device_id] = False
+            self._connections.clear()
+        self.run_once(force_persist=True)
+
+
+presence = background.register(PresenceTable())
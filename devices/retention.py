@@ -0,0 +1,147 @@
+"""
+Telemetry retention.
+
+Raw samples are kept for TELEMETRY_RETENTION_DAYS and each rollup resolution
+for its own ROLLUP_RETENTION_DAYS_* (0 keeps data forever). Deletes run in
+bounded chunks: each chunk selects at most `chunk_size` primary keys through
+the (device, timestamp) / (resolution, device, bucket) indexes and deletes
+them by key in its own short transaction, so no statement holds long locks
+or scans the whole table.
+
+The background worker runs one chunk per call into the database thread and
+waits RETENTION_CHUNK_PAUSE seconds between chunks with asyncio.sleep, so
+the consumers' database calls (which share that thread) interleave with a
+long prune instead of waiting for all of it.
+
+Raw rows the compactor has not folded into the rollups yet are never pruned.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from core import background
+from .models import Device, RollupWatermark, TelemetryData, TelemetryRollup
+from .rollups import WATERMARK
+
+logger = logging.getLogger(__name__)
+
+DEVICE_BATCH = 100
+
+
+def retention_policy():
+    """
+    Returns {table: days to keep}.
+    """
+    return {
+        'raw': getattr(settings, 'TELEMETRY_RETENTION_DAYS', 7),
+        '1m': getattr(settings, 'ROLLUP_RETENTION_DAYS_1M', 14),
+        '1h': getattr(settings, 'ROLLUP_RETENTION_DAYS_1H', 180),
+        '1d': getattr(settings, 'ROLLUP_RETENTION_DAYS_1D', 730),
+    }
+
+
+def delete_chunk(queryset, chunk_size):
+    """
+    Deletes at most `chunk_size` rows of `queryset`. Returns (deleted, done).
+    """
+    ids = list(queryset.values_list('pk', flat=True)[:chunk_size])
+    if not ids:
+        return 0, True
+    count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+    return count, len(ids) < chunk_size
+
+
+def delete_in_chunks(queryset, chunk_size, pause=0.0):
+    """
+    Deletes the rows of `queryset` at most `chunk_size` at a time. Returns the number deleted.
+    """
+    deleted = 0
+    while True:
+        count, done = delete_chunk(queryset, chunk_size)
+        deleted += count
+        if done:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def device_batches():
+    device_ids = list(Device.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(device_ids), DEVICE_BATCH):
+        yield device_ids[start:start + DEVICE_BATCH]
+
+
+class RetentionWorker(background.PeriodicWorker):
+    name = 'retention'
+
+    def __init__(self, interval=None, chunk_size=None, policy=None, pause=None):
+        super().__init__(interval if interval is not None else getattr(settings, 'RETENTION_INTERVAL', 3600))
+        self.chunk_size = chunk_size or getattr(settings, 'RETENTION_CHUNK_SIZE', 5000)
+        self.pause = pause if pause is not None else getattr(settings, 'RETENTION_CHUNK_PAUSE', 0.05)
+        self.policy = policy
+
+        # Counters
+        self.runs = 0
+        self.deleted = {}
+
+    def policy_days(self):
+        return {table: days for table, days in (self.policy or retention_policy()).items() if days}
+
+    def jobs(self, now):
+        """
+        Yields (table, queryset of expired rows) in the order they are pruned.
+        Raw rows the compactor has not reached yet are left alone.
+        """
+        batches = list(device_batches())
+        for table, days in self.policy_days().items():
+            cutoff = now - timedelta(days=days)
+            if table == 'raw':
+                watermark = RollupWatermark.objects.filter(name=WATERMARK).values_list('last_id', flat=True).first() or 0
+                for batch in batches:
+                    yield table, TelemetryData.objects.filter(device_id__in=batch, timestamp__lt=cutoff, id__lte=watermark)
+            else:
+                rollups = TelemetryRollup.objects.filter(resolution=table, bucket__lt=cutoff)
+                yield table, rollups.filter(device__isnull=True)
+                for batch in batches:
+                    yield table, rollups.filter(device_id__in=batch)
+
+    def record(self, deleted):
+        self.runs += 1
+        for table, count in deleted.items():
+            self.deleted[table] = self.deleted.get(table, 0) + count
+        if any(deleted.values()):
+            logger.info("Retention pruned %s", deleted)
+        return deleted
+
+    def run_once(self, now=None):
+        now = now or timezone.now()
+        deleted = dict.fromkeys(self.policy_days(), 0)
+        for table, queryset in self.jobs(now):
+            deleted[table] += delete_in_chunks(queryset, self.chunk_size, self.pause)
+        return self.record(deleted)
+
+    async def arun_once(self, now=None):
+        now = now or timezone.now()
+        deleted = dict.fromkeys(self.policy_days(), 0)
+        jobs = await database_sync_to_async(lambda: list(self.jobs(now)))()
+        delete = database_sync_to_async(delete_chunk)
+        for table, queryset in jobs:
+            while True:
+                count, done = await delete(queryset, self.chunk_size)
+                deleted[table] += count
+                if done:
+                    break
+                # The database thread is free for other callers between chunks
+                await asyncio.sleep(self.pause)
+        return self.record(deleted)
+
+    def shutdown(self):
+        pass
+
+
+retention = background.register(RetentionWorker())
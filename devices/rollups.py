@@ -0,0 +1,277 @@
+"""
+Telemetry rollups.
+
+Raw TelemetryData grows with fleet size times the heartbeat rate, so charts
+read from TelemetryRollup instead: 1-minute, 1-hour and 1-day buckets with
+avg/min/max/p95 per metric, for each device and for the whole fleet (rows
+with no device).
+
+The compactor only reads raw rows above a persisted id watermark. Each pass
+folds a chunk of new rows into the 1-minute buckets, then rebuilds the
+affected hours from their minutes and the affected days from their hours,
+and advances the watermark in the same transaction.
+
+Ids are allocated when a row is inserted but become visible when its
+transaction commits, so a concurrent bulk_create (a replayed agent batch next
+to the live buffer) can commit a lower id after a higher one. The compactor
+therefore only reads up to a settled id: the highest id it observed at least
+ROLLUP_SETTLE_SECONDS ago, by which time every transaction that had
+allocated an id up to it has committed or rolled back. The observation is
+stored as a second watermark row, so cron runs of compact_telemetry work the
+same way. Retention prunes below the compaction watermark only, so a late
+row is never deleted before it is rolled up.
+
+Averages, minimums and maximums are exact. A percentile cannot be merged
+exactly from partial results: 1-minute p95 is exact unless late samples
+arrive for a bucket that was already written, and coarser p95 values are
+the sample-weighted 95th percentile of the child buckets' p95.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from core import background
+from .ingest import percentile
+from .models import RollupWatermark, TelemetryData, TelemetryRollup
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('cpu', 'ram', 'disk')
+AGGREGATE_FIELDS = [f'{metric}_{stat}' for metric in METRICS for stat in ('avg', 'min', 'max', 'p95')]
+
+WATERMARK = 'telemetry'
+# Highest raw id seen and when (updated_at); it is settled ROLLUP_SETTLE_SECONDS later
+OBSERVED = 'telemetry:observed'
+
+# Chart ranges and the resolution each one reads from
+RANGES = {
+    '1h': (timedelta(hours=1), '1m'),
+    '24h': (timedelta(hours=24), '1h'),
+    '7d': (timedelta(days=7), '1h'),
+    '30d': (timedelta(days=30), '1d'),
+    '1y': (timedelta(days=365), '1d'),
+}
+
+
+def floor_minute(dt):
+    return dt.replace(second=0, microsecond=0)
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def summarize(samples):
+    """
+    Aggregates raw samples: a list of (cpu, ram, disk) tuples.
+    """
+    result = {'samples': len(samples)}
+    for index, metric in enumerate(METRICS):
+        values = [sample[index] for sample in samples]
+        result[f'{metric}_avg'] = sum(values) / len(values)
+        result[f'{metric}_min'] = min(values)
+        result[f'{metric}_max'] = max(values)
+        result[f'{metric}_p95'] = percentile(values, 95)
+    return result
+
+
+def weighted_percentile(pairs, pct):
+    """
+    Percentile of (value, weight) pairs.
+    """
+    pairs = sorted(pairs)
+    threshold = sum(weight for _, weight in pairs) * pct / 100
+    running = 0
+    for value, weight in pairs:
+        running += weight
+        if running >= threshold:
+            return value
+    return pairs[-1][0]
+
+
+def combine(children):
+    """
+    Aggregates child buckets (dicts of aggregate fields) into one bucket.
+    """
+    total = sum(child['samples'] for child in children)
+    result = {'samples': total}
+    for metric in METRICS:
+        result[f'{metric}_avg'] = sum(child[f'{metric}_avg'] * child['samples'] for child in children) / total
+        result[f'{metric}_min'] = min(child[f'{metric}_min'] for child in children)
+        result[f'{metric}_max'] = max(child[f'{metric}_max'] for child in children)
+        result[f'{metric}_p95'] = weighted_percentile(
+            [(child[f'{metric}_p95'], child['samples']) for child in children], 95
+        )
+    return result
+
+
+def _scope(device_ids):
+    """
+    Filter for the given devices plus the fleet-wide rows.
+    """
+    return Q(device_id__in=[device_id for device_id in device_ids if device_id is not None]) | Q(device__isnull=True)
+
+
+def _upsert(resolution, buckets, merge=False):
+    """
+    Writes {(device_id, bucket): aggregates}. With merge=True the aggregates
+    are combined with what is already stored instead of replacing it.
+    """
+    if not buckets:
+        return 0
+    device_ids = {device_id for device_id, _ in buckets}
+    existing = {
+        (row.device_id, row.bucket): row
+        for row in TelemetryRollup.objects.filter(
+            _scope(device_ids),
+            resolution=resolution,
+            bucket__in={bucket for _, bucket in buckets},
+        )
+    }
+    created, updated = [], []
+    for key, values in buckets.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(TelemetryRollup(resolution=resolution, device_id=key[0], bucket=key[1], **values))
+            continue
+        if merge:
+            values = combine([values, {field: getattr(row, field) for field in ['samples'] + AGGREGATE_FIELDS}])
+        for field, value in values.items():
+            setattr(row, field, value)
+        updated.append(row)
+    TelemetryRollup.objects.bulk_create(created, batch_size=1000)
+    TelemetryRollup.objects.bulk_update(updated, ['samples'] + AGGREGATE_FIELDS, batch_size=1000)
+    return len(created) + len(updated)
+
+
+def _rebuild(resolution, child_resolution, keys, span):
+    """
+    Recomputes the given (device_id, bucket) rollups from their child buckets.
+    """
+    if not keys:
+        return 0
+    starts = [bucket for _, bucket in keys]
+    children = defaultdict(list)
+    rows = TelemetryRollup.objects.filter(
+        _scope({device_id for device_id, _ in keys}),
+        resolution=child_resolution,
+        bucket__gte=min(starts),
+        bucket__lt=max(starts) + span,
+    ).values('device_id', 'bucket', 'samples', *AGGREGATE_FIELDS)
+    floor = floor_hour if resolution == '1h' else floor_day
+    for row in rows:
+        key = (row['device_id'], floor(row['bucket']))
+        if key in keys:
+            children[key].append(row)
+    return _upsert(resolution, {key: combine(rows) for key, rows in children.items()})
+
+
+class TelemetryCompactor(background.PeriodicWorker):
+    name = 'rollups'
+
+    def __init__(self, interval=None, chunk_size=None, settle=None):
+        super().__init__(interval if interval is not None else getattr(settings, 'ROLLUP_INTERVAL', 60))
+        self.chunk_size = chunk_size or getattr(settings, 'ROLLUP_CHUNK_SIZE', 20000)
+        self.settle = settle if settle is not None else getattr(settings, 'ROLLUP_SETTLE_SECONDS', 30)
+
+        # Counters
+        self.passes = 0
+        self.rows_compacted = 0
+
+    def settled_id(self):
+        """
+        The highest raw id that is safe to compact: every row at or below it
+        has committed. None when no observation is old enough yet.
+        """
+        latest = TelemetryData.objects.aggregate(last=Max('id'))['last'] or 0
+        if not self.settle:
+            return latest
+        with transaction.atomic():
+            observed, created = RollupWatermark.objects.select_for_update().get_or_create(
+                name=OBSERVED, defaults={'last_id': latest},
+            )
+            if created or observed.updated_at > timezone.now() - timedelta(seconds=self.settle):
+                return None
+            settled = observed.last_id
+            observed.last_id = latest
+            observed.save(update_fields=['last_id', 'updated_at'])
+        return settled
+
+    def compact_chunk(self, settled):
+        """
+        Folds the next chunk of raw rows up to id `settled` into the rollups.
+        Returns the number of raw rows read.
+        """
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK)
+            # Serializes concurrent compactors (other processes, cron)
+            watermark = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+            rows = list(
+                TelemetryData.objects.filter(id__gt=watermark.last_id, id__lte=settled)
+                .order_by('id')
+                .values_list('id', 'device_id', 'timestamp', 'cpu_usage', 'ram_usage', 'disk_usage')[:self.chunk_size]
+            )
+            if not rows:
+                return 0
+
+            minutes = defaultdict(list)
+            for _, device_id, timestamp, cpu, ram, disk in rows:
+                minute = floor_minute(timestamp)
+                minutes[(device_id, minute)].append((cpu, ram, disk))
+                minutes[(None, minute)].append((cpu, ram, disk))
+
+            _upsert('1m', {key: summarize(samples) for key, samples in minutes.items()}, merge=True)
+            hours = {(device_id, floor_hour(minute)) for device_id, minute in minutes}
+            _rebuild('1h', '1m', hours, timedelta(hours=1))
+            days = {(device_id, floor_day(hour)) for device_id, hour in hours}
+            _rebuild('1d', '1h', days, timedelta(days=1))
+
+            watermark.last_id = rows[-1][0]
+            watermark.save(update_fields=['last_id', 'updated_at'])
+        return len(rows)
+
+    def run_once(self):
+        compacted = 0
+        settled = self.settled_id()
+        while settled is not None:
+            count = self.compact_chunk(settled)
+            compacted += count
+            if count < self.chunk_size:
+                break
+        self.passes += 1
+        self.rows_compacted += compacted
+        if compacted:
+            logger.debug("Compacted %d telemetry rows", compacted)
+        return compacted
+
+    def shutdown(self):
+        # Nothing is held in memory; the next pass resumes from the watermark
+        pass
+
+
+def series(device=None, range_name='24h', now=None):
+    """
+    Rollup rows for a chart: the fleet when `device` is None.
+    """
+    span, resolution = RANGES[range_name]
+    start = (now or timezone.now()) - span
+    # Include the bucket the range starts in
+    start = {'1m': floor_minute, '1h': floor_hour, '1d': floor_day}[resolution](start)
+    rows = TelemetryRollup.objects.filter(resolution=resolution, bucket__gte=start)
+    if device is None:
+        rows = rows.filter(device__isnull=True)
+    else:
+        rows = rows.filter(device=device)
+    return resolution, rows.order_by('bucket')
+
+
+compactor = background.register(TelemetryCompactor())
@@ -0,0 +1,125 @@
+"""
+Binary screen stream frames.
+
+Agents stream the screen as binary WebSocket frames holding only the tiles
+that changed since the previous frame. The layout (network byte order) is
+mirrored in agent/main.py:
+
+    header  magic b'SF', version u8, flags u8, seq u32,
+            screen width u16, screen height u16, tile count u16
+    tile    x u16, y u16, width u16, height u16, JPEG length u32, JPEG bytes
+
+FLAG_KEYFRAME marks a frame that carries every tile of the screen.
+
+Capture is owned by the server: the first viewer of a device starts the
+agent's stream and the last one to leave stops it (see StreamSessions).
+Frames that pile up for a slow viewer are merged tile-by-tile rather than
+queued, so the viewer always jumps straight to the current screen.
+"""
+import struct
+import threading
+
+MAGIC = b'SF'
+VERSION = 1
+FLAG_KEYFRAME = 0x01
+
+HEADER = struct.Struct('!2sBBIHHH')
+TILE = struct.Struct('!HHHHI')
+
+
+class FrameError(ValueError):
+    pass
+
+
+def parse_header(frame):
+    """
+    Returns (flags, seq, width, height, tile_count) for a frame.
+    """
+    if len(frame) < HEADER.size:
+        raise FrameError("Frame too short")
+    magic, version, flags, seq, width, height, count = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise FrameError("Not a screen frame")
+    return flags, seq, width, height, count
+
+
+def iter_tiles(frame):
+    """
+    Yields (x, y, width, height, jpeg) for every tile, without decoding images.
+    """
+    _, _, _, _, count = parse_header(frame)
+    view = memoryview(frame)
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + TILE.size > len(frame):
+            raise FrameError("Truncated tile header")
+        x, y, w, h, length = TILE.unpack_from(frame, offset)
+        offset += TILE.size
+        if offset + length > len(frame):
+            raise FrameError("Truncated tile data")
+        yield x, y, w, h, view[offset:offset + length]
+        offset += length
+
+
+def encode_frame(tiles, width, height, seq=0, keyframe=False):
+    """
+    Builds a frame from (x, y, width, height, jpeg) tuples.
+    """
+    parts = [HEADER.pack(MAGIC, VERSION, FLAG_KEYFRAME if keyframe else 0, seq & 0xFFFFFFFF, width, height, len(tiles))]
+    for x, y, w, h, jpeg in tiles:
+        parts.append(TILE.pack(x, y, w, h, len(jpeg)))
+        parts.append(bytes(jpeg))
+    return b''.join(parts)
+
+
+def merge_frames(older, newer):
+    """
+    Combines two consecutive frames into one. Tiles sit on a fixed grid, so a
+    tile in the newer frame replaces the one at the same position.
+    """
+    old_flags, _, old_width, old_height, _ = parse_header(older)
+    flags, seq, width, height, _ = parse_header(newer)
+    if flags & FLAG_KEYFRAME or (old_width, old_height) != (width, height):
+        return newer
+    tiles = {(x, y): (x, y, w, h, jpeg) for x, y, w, h, jpeg in iter_tiles(older)}
+    for x, y, w, h, jpeg in iter_tiles(newer):
+        tiles[(x, y)] = (x, y, w, h, jpeg)
+    return encode_frame(list(tiles.values()), width, height, seq, keyframe=bool(old_flags & FLAG_KEYFRAME))
+
+
+class StreamSessions:
+    """
+    Tracks which browser channels are watching each device in this process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._viewers = {}  # device_id -> set of channel names
+
+    def join(self, device_id, channel_name):
+        """
+        Returns True when this is the first viewer of the device.
+        """
+        with self._lock:
+            viewers = self._viewers.setdefault(str(device_id), set())
+            viewers.add(channel_name)
+            return len(viewers) == 1
+
+    def leave(self, device_id, channel_name):
+        """
+        Returns True when the last viewer of the device has left.
+        """
+        with self._lock:
+            viewers = self._viewers.get(str(device_id))
+            if not viewers or channel_name not in viewers:
+                return False
+            viewers.discard(channel_name)
+            if viewers:
+                return False
+            del self._viewers[str(device_id)]
+            return True
+
+    def viewer_count(self, device_id):
+        return len(self._viewers.get(str(device_id), ()))
+
+
+sessions = StreamSessions()
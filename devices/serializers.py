@@ -1,20 +1,45 @@
 from rest_framework import serializers
-from .models import Device, TelemetryData
+from .models import Device, DeviceMetricsSnapshot, TelemetryData
+
+# Samples returned per device unless ?telemetry=N asks for another amount
+TELEMETRY_LIMIT = 10
+MAX_TELEMETRY_LIMIT = 100
 
 class TelemetrySerializer(serializers.ModelSerializer):
     class Meta:
         model = TelemetryData
         fields = ['timestamp', 'cpu_usage', 'ram_usage', 'disk_usage']
 
+class DeviceMetricsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeviceMetricsSnapshot
+        fields = ['timestamp', 'cpu_usage', 'ram_usage', 'disk_usage']
+
 class DeviceSerializer(serializers.ModelSerializer):
-    # Optimized: Limit telemetry data to the latest 10 records to reduce payload size.
-    # Uses SerializerMethodField which works efficiently with prefetched data.
+    # Current state from the snapshot; no history query needed
+    metrics = DeviceMetricsSerializer(read_only=True, allow_null=True)
+    # Limited to the latest samples to reduce payload size.
     telemetry = serializers.SerializerMethodField()
     
     class Meta:
         model = Device
         fields = '__all__'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets on reads: ?fields=id,hostname,is_online
+        request = self.context.get('request')
+        if request is not None and request.method == 'GET' and request.query_params.get('fields'):
+            requested = {name.strip() for name in request.query_params['fields'].split(',')}
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
     def get_telemetry(self, obj):
-        # obj.telemetry.all() leverages prefetch_related if called in the viewset
-        return TelemetrySerializer(obj.telemetry.all()[:10], many=True).data
+        # The viewset prefetches the latest samples for the whole page in one query
+        samples = getattr(obj, 'latest_telemetry', None)
+        if samples is None:
+            limit = self.context.get('telemetry_limit', TELEMETRY_LIMIT)
+            if not limit:
+                return []
+            samples = obj.telemetry.order_by('-timestamp')[:limit]
+        return TelemetrySerializer(samples, many=True).data
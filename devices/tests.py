@@ -1,3 +1,1032 @@
-from django.test import TestCase
+import io
+import json
+import os
+import socket
+import tempfile
+import uuid
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from omni_rmm.asgi import application
+from core.models import Notification, User
+from .ingest import TelemetryBuffer, percentile, telemetry_buffer
+from .loadsim import FleetSimulator
+from .models import AlertRule, Asset, AssetStatus, Device, DeviceMetricsSnapshot, MonitoringAlert, RollupWatermark, TelemetryData, TelemetryRollup
+from .presence import PresenceTable, presence
+from .rollups import OBSERVED, WATERMARK, TelemetryCompactor
+from .downsample import lttb
+from .alerts import AlertWriter, ThresholdEngine, alert_writer, threshold_engine
+from .offline import OfflineDetector, offline_detector
+from .poller import AssetPoller, Pinger
+from . import export
+from . import retention
+from .retention import RetentionWorker, delete_in_chunks
+from .admission import TokenBucket
+from . import screen
 
-# Create your tests here.
+
+class TelemetryBufferTest(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='buffer-device', mac_address='AA:BB:CC:00:00:01')
+        self.buffer = TelemetryBuffer(interval=60, max_rows=3)
+
+    def test_append_queues_without_writing(self):
+        self.buffer.append(self.device.id, {'cpu_usage': 10, 'ram_usage': 20, 'disk_usage': 30})
+        self.assertEqual(self.buffer.depth, 1)
+        self.assertEqual(TelemetryData.objects.count(), 0)
+
+    def test_append_reports_when_full(self):
+        sample = {'cpu_usage': 1, 'ram_usage': 1, 'disk_usage': 1}
+        self.assertFalse(self.buffer.append(self.device.id, sample))
+        self.assertFalse(self.buffer.append(self.device.id, sample))
+        self.assertTrue(self.buffer.append(self.device.id, sample))
+
+    def test_flush_writes_one_batch(self):
+        for cpu in (10, 20):
+            self.buffer.append(self.device.id, {'cpu_usage': cpu, 'ram_usage': 50, 'disk_usage': 70})
+
+        with CaptureQueriesContext(connection) as queries:
+            flushed = self.buffer.run_once()
+
+        # One INSERT for the samples, one lookup and one upsert for the snapshot
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(flushed, 2)
+        self.assertEqual(self.buffer.depth, 0)
+        self.assertEqual(TelemetryData.objects.filter(device=self.device).count(), 2)
+
+        stats = self.buffer.stats()
+        self.assertEqual(stats['flushes'], 1)
+        self.assertEqual(stats['rows_flushed'], 2)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_flush_updates_snapshot(self):
+        for cpu in (10, 20):
+            self.buffer.append(self.device.id, {'cpu_usage': cpu, 'ram_usage': 50, 'disk_usage': 70})
+        self.buffer.run_once()
+        self.assertEqual(self.device.metrics.cpu_usage, 20)
+
+        # An older sample (e.g. a replayed spool) does not replace a newer snapshot
+        self.buffer.append(self.device.id, {'cpu_usage': 99, 'ram_usage': 0, 'disk_usage': 0},
+                           timestamp=timezone.now() - timezone.timedelta(hours=1))
+        self.buffer.run_once()
+        self.assertEqual(DeviceMetricsSnapshot.objects.get(device=self.device).cpu_usage, 20)
+
+    def test_flush_empty_buffer_is_noop(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.buffer.run_once(), 0)
+
+    def test_max_pending_drops_oldest(self):
+        buffer = TelemetryBuffer(interval=60, max_rows=100, max_pending=2)
+        for cpu in (1, 2, 3):
+            buffer.append(self.device.id, {'cpu_usage': cpu, 'ram_usage': 0, 'disk_usage': 0})
+        self.assertEqual(buffer.depth, 2)
+        self.assertEqual(buffer.rows_dropped, 1)
+        self.assertEqual([row.cpu_usage for row in buffer.drain()], [2, 3])
+
+    def test_flush_records_ingest_latency(self):
+        self.buffer.append(self.device.id, {'cpu_usage': 1, 'ram_usage': 1, 'disk_usage': 1})
+        self.buffer.run_once()
+
+        stats = self.buffer.stats()
+        self.assertEqual(len(self.buffer.latencies), 1)
+        self.assertGreaterEqual(stats['ingest_p99_ms'], stats['ingest_p50_ms'])
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile(range(1, 101), 50), 51)
+        self.assertEqual(percentile(range(1, 101), 99), 99)
+
+
+class PresenceTableTest(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='presence-device', mac_address='AA:BB:CC:00:00:02')
+        self.presence = PresenceTable(interval=60, persist_interval=3600)
+
+    def test_reconcile_clears_stale_online_flags(self):
+        stale = Device.objects.create(hostname='stale', mac_address='AA:BB:CC:00:00:03', is_online=True)
+        crashed = Device.objects.create(hostname='crashed', mac_address='AA:BB:CC:00:00:05', is_online=True,
+                                        last_seen=timezone.now() - timezone.timedelta(hours=2))
+        # Connected to another process, which persists last_seen every interval
+        elsewhere = Device.objects.create(hostname='elsewhere', mac_address='AA:BB:CC:00:00:06', is_online=True,
+                                          last_seen=timezone.now() - timezone.timedelta(minutes=30))
+        self.presence.run_once()
+        online = dict(Device.objects.filter(id__in=[stale.id, crashed.id, elsewhere.id]).values_list('hostname', 'is_online'))
+        self.assertEqual(online, {'stale': False, 'crashed': False, 'elsewhere': True})
+        self.assertTrue(self.presence.authoritative)
+
+    def test_transitions_written_once(self):
+        self.presence.connect(self.device.id)
+        self.presence.run_once()
+        self.device.refresh_from_db()
+        self.assertTrue(self.device.is_online)
+
+        # Heartbeats only touch memory until last_seen is due
+        self.presence.touch(self.device.id)
+        with self.assertNumQueries(0):
+            self.presence.run_once()
+
+        self.presence.disconnect(self.device.id)
+        self.presence.run_once()
+        self.device.refresh_from_db()
+        self.assertFalse(self.device.is_online)
+
+    def test_last_seen_persisted_in_bulk(self):
+        other = Device.objects.create(hostname='other', mac_address='AA:BB:CC:00:00:04')
+        seen = timezone.now()
+        self.presence.reconcile()
+        self.presence.touch(self.device.id, now=seen)
+        self.presence.touch(other.id, now=seen)
+
+        with self.assertNumQueries(1):
+            self.presence.run_once(force_persist=True)
+
+        self.device.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.device.last_seen, seen)
+        self.assertEqual(other.last_seen, seen)
+
+    def test_multiple_connections_keep_device_online(self):
+        self.presence.connect(self.device.id)
+        self.presence.connect(self.device.id)
+        self.presence.disconnect(self.device.id)
+        self.assertTrue(self.presence.is_online(self.device.id))
+        self.presence.disconnect(self.device.id)
+        self.assertFalse(self.presence.is_online(self.device.id))
+
+    def test_apply_overlays_live_state(self):
+        self.presence.reconcile()
+        self.presence.connect(self.device.id)
+        device = Device.objects.get(id=self.device.id)
+        self.assertFalse(device.is_online)
+        self.presence.apply([device])
+        self.assertTrue(device.is_online)
+        self.assertIsNotNone(device.last_seen)
+
+    def test_devices_unknown_here_keep_database_state(self):
+        self.presence.reconcile()
+        elsewhere = Device.objects.create(hostname='elsewhere', mac_address='AA:BB:CC:00:00:07', is_online=True,
+                                          last_seen=timezone.now())
+        self.presence.connect(self.device.id)
+        device = Device.objects.get(id=elsewhere.id)
+        self.presence.apply([device])
+        self.assertTrue(device.is_online)
+        self.assertEqual(self.presence.online_count(), 2)
+
+    def test_disconnected_devices_are_evicted_once_written(self):
+        self.presence.connect(self.device.id)
+        self.presence.disconnect(self.device.id)
+        self.presence.run_once()
+        # The offline transition is written, last_seen is not due yet
+        self.assertIsNotNone(self.presence.last_seen(self.device.id))
+        self.presence.run_once(force_persist=True)
+        self.assertIsNone(self.presence.last_seen(self.device.id))
+        self.device.refresh_from_db()
+        self.assertFalse(self.device.is_online)
+        self.assertIsNotNone(self.device.last_seen)
+        self.assertEqual(self.presence.online_count(), 0)
+
+
+class TelemetryRollupTest(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='rollup-device', mac_address='AA:BB:CC:00:00:30')
+        self.other = Device.objects.create(hostname='rollup-other', mac_address='AA:BB:CC:00:00:31')
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.compactor = TelemetryCompactor(interval=60, chunk_size=2, settle=0)
+
+    def add(self, device, minute, cpu):
+        TelemetryData.objects.create(
+            device=device, timestamp=self.hour + timezone.timedelta(minutes=minute, seconds=5),
+            cpu_usage=cpu, ram_usage=50, disk_usage=70,
+        )
+
+    def rollup(self, resolution, device=None):
+        return TelemetryRollup.objects.get(resolution=resolution, device=device)
+
+    def test_compaction_builds_every_resolution(self):
+        self.add(self.device, 1, 10)
+        self.add(self.device, 1, 30)
+        self.add(self.other, 1, 80)
+
+        self.assertEqual(self.compactor.run_once(), 3)
+
+        minute = TelemetryRollup.objects.get(resolution='1m', device=self.device)
+        self.assertEqual(minute.bucket, self.hour + timezone.timedelta(minutes=1))
+        self.assertEqual((minute.samples, minute.cpu_avg, minute.cpu_min, minute.cpu_max), (2, 20, 10, 30))
+        fleet = self.rollup('1m')
+        self.assertEqual((fleet.samples, fleet.cpu_max, fleet.cpu_p95), (3, 80, 80))
+        self.assertEqual(self.rollup('1h', self.device).bucket, self.hour)
+        self.assertEqual(self.rollup('1d').samples, 3)
+
+    def test_only_new_rows_are_read(self):
+        self.add(self.device, 1, 10)
+        self.compactor.run_once()
+        self.assertEqual(self.compactor.run_once(), 0)
+
+        # A late sample for a minute that was already compacted is merged into it
+        self.add(self.device, 1, 30)
+        self.add(self.device, 2, 60)
+        self.assertEqual(self.compactor.run_once(), 2)
+
+        minute = TelemetryRollup.objects.get(resolution='1m', device=self.device, bucket=self.hour + timezone.timedelta(minutes=1))
+        self.assertEqual((minute.samples, minute.cpu_avg, minute.cpu_max), (2, 20, 30))
+        hour = self.rollup('1h', self.device)
+        self.assertEqual((hour.samples, hour.cpu_avg, hour.cpu_min, hour.cpu_max), (3, 100 / 3, 10, 60))
+        self.assertEqual(self.rollup('1d').samples, 3)
+
+    def test_waits_for_ids_to_settle(self):
+        compactor = TelemetryCompactor(chunk_size=2, settle=30)
+        self.add(self.device, 1, 10)
+        # The first pass only records the highest id it has seen
+        self.assertEqual(compactor.run_once(), 0)
+        self.add(self.device, 2, 20)
+        self.assertEqual(compactor.run_once(), 0)
+
+        RollupWatermark.objects.filter(name=OBSERVED).update(updated_at=timezone.now() - timezone.timedelta(seconds=31))
+        # Only the row seen 30 seconds ago is settled; the newer one waits for the next observation
+        self.assertEqual(compactor.run_once(), 1)
+        self.assertEqual(RollupWatermark.objects.get(name=WATERMARK).last_id, TelemetryData.objects.order_by('id').first().id)
+        RollupWatermark.objects.filter(name=OBSERVED).update(updated_at=timezone.now() - timezone.timedelta(seconds=31))
+        self.assertEqual(compactor.run_once(), 1)
+        self.assertEqual(self.rollup('1h', self.device).samples, 2)
+
+    def test_charts_read_rollups(self):
+        self.add(self.device, 1, 10)
+        self.add(self.other, 1, 30)
+        self.compactor.run_once()
+
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('dashboard_chart_data')).json()
+        self.assertEqual(data['cpu'], [20])
+
+        url = reverse('device_chart_data', args=[self.device.id])
+        data = self.client.get(url, {'range': '1h'}).json()
+        self.assertEqual((data['resolution'], data['cpu']), ('1m', [10]))
+        self.assertEqual(self.client.get(url, {'range': 'forever'}).status_code, 400)
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='retention-device', mac_address='AA:BB:CC:00:00:40')
+        self.now = timezone.now()
+        self.old = TelemetryData.objects.create(
+            device=self.device, timestamp=self.now - timezone.timedelta(days=10),
+            cpu_usage=1, ram_usage=1, disk_usage=1,
+        )
+        self.recent = TelemetryData.objects.create(
+            device=self.device, timestamp=self.now - timezone.timedelta(hours=1),
+            cpu_usage=2, ram_usage=2, disk_usage=2,
+        )
+        self.worker = RetentionWorker(chunk_size=2, pause=0, policy={'raw': 7, '1m': 3, '1h': 0})
+
+    def test_prunes_only_compacted_rows(self):
+        # Nothing has been rolled up yet, so nothing may be deleted
+        self.assertEqual(self.worker.run_once(now=self.now)['raw'], 0)
+
+        TelemetryCompactor(settle=0).run_once()
+        deleted = self.worker.run_once(now=self.now)
+
+        self.assertEqual(deleted, {'raw': 1, '1m': 2})
+        self.assertEqual(list(TelemetryData.objects.values_list('pk', flat=True)), [self.recent.pk])
+        # Minute rollups of the old sample are gone, hourly ones are kept forever
+        self.assertFalse(TelemetryRollup.objects.filter(resolution='1m', bucket__lt=self.now - timezone.timedelta(days=3)).exists())
+        self.assertEqual(TelemetryRollup.objects.filter(resolution='1h').count(), 4)
+
+    def test_worker_deletes_one_chunk_per_database_call(self):
+        TelemetryCompactor(settle=0).run_once()
+        for _ in range(4):
+            TelemetryData.objects.create(device=self.device, timestamp=self.old.timestamp, cpu_usage=0, ram_usage=0, disk_usage=0)
+        TelemetryCompactor(settle=0).run_once()
+        calls = []
+        delete_chunk = retention.delete_chunk
+
+        def counting(queryset, chunk_size):
+            calls.append(chunk_size)
+            return delete_chunk(queryset, chunk_size)
+
+        with mock.patch.object(retention, 'delete_chunk', counting), \
+                mock.patch.object(retention.asyncio, 'sleep', wraps=retention.asyncio.sleep) as sleep:
+            deleted = async_to_sync(self.worker.arun_once)(now=self.now)
+        self.assertEqual(deleted['raw'], 5)
+        # Every chunk is its own trip to the database thread: raw 2+2+1, then
+        # the fleet and device minute rollups; a pause follows each full chunk
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(list(TelemetryData.objects.values_list('pk', flat=True)), [self.recent.pk])
+
+    def test_delete_in_chunks(self):
+        for _ in range(3):
+            TelemetryData.objects.create(device=self.device, cpu_usage=0, ram_usage=0, disk_usage=0)
+
+        with self.assertNumQueries(6):
+            deleted = delete_in_chunks(TelemetryData.objects.all(), chunk_size=2)
+        self.assertEqual(deleted, 5)
+
+
+class DeviceAPITest(TestCase):
+    def setUp(self):
+        for index in range(3):
+            device = Device.objects.create(hostname=f'api-{index}', mac_address=f'AA:BB:CC:00:01:{index:02X}')
+            for cpu in range(12):
+                TelemetryData.objects.create(
+                    device=device, timestamp=timezone.now() - timezone.timedelta(minutes=cpu),
+                    cpu_usage=cpu, ram_usage=0, disk_usage=0,
+                )
+
+    def test_latest_telemetry_in_one_query(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/devices/').json()
+
+        self.assertEqual(len(data['results']), 3)
+        for device in data['results']:
+            self.assertEqual([sample['cpu_usage'] for sample in device['telemetry']], list(range(10)))
+
+    def test_telemetry_limit(self):
+        data = self.client.get('/api/devices/', {'telemetry': 2}).json()
+        self.assertEqual([sample['cpu_usage'] for sample in data['results'][0]['telemetry']], [0, 1])
+
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/devices/', {'telemetry': 0}).json()
+        self.assertEqual(data['results'][0]['telemetry'], [])
+
+    def test_sparse_fieldset_skips_telemetry(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/devices/', {'fields': 'id,hostname'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'hostname'})
+
+    def test_current_metrics_from_snapshot(self):
+        device = Device.objects.get(hostname='api-0')
+        DeviceMetricsSnapshot.objects.create(device=device, timestamp=timezone.now(), cpu_usage=42, ram_usage=1, disk_usage=2)
+
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/devices/', {'fields': 'hostname,metrics'}).json()
+        metrics = {d['hostname']: d['metrics'] for d in data['results']}
+        self.assertEqual(metrics['api-0']['cpu_usage'], 42)
+        self.assertIsNone(metrics['api-1'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('device_detail', args=[device.id]))
+        self.assertContains(response, '42.0%')
+        self.assertFalse(any('devices_telemetrydata' in query['sql'] for query in queries))
+
+    def test_cursor_pagination(self):
+        first = self.client.get('/api/devices/', {'page_size': 2, 'fields': 'hostname'}).json()
+        self.assertEqual([d['hostname'] for d in first['results']], ['api-2', 'api-1'])
+
+        second = self.client.get(first['next']).json()
+        self.assertEqual([d['hostname'] for d in second['results']], ['api-0'])
+        self.assertIsNone(second['next'])
+
+
+class TelemetryHistoryTest(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(hostname='history-device', mac_address='AA:BB:CC:00:00:50')
+        self.end = timezone.now()
+        TelemetryData.objects.bulk_create([
+            TelemetryData(
+                device=self.device, timestamp=self.end - timezone.timedelta(seconds=5 * i),
+                cpu_usage=95 if i == 300 else 10, ram_usage=50, disk_usage=70,
+            )
+            for i in range(1, 1001)
+        ])
+
+    def get(self, **params):
+        response = self.client.get(f'/api/devices/{self.device.id}/telemetry/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lttb_keeps_spikes(self):
+        y = [0.0] * 1000
+        y[417] = 100.0
+        keep = lttb(range(1000), y, 50)
+        self.assertEqual(len(keep), 50)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertIn(417, keep)
+        self.assertEqual(list(lttb(range(5), [1] * 5, 10)), [0, 1, 2, 3, 4])
+
+    def test_falls_back_to_rollups_above_the_row_cap(self):
+        TelemetryCompactor(settle=0).run_once()
+        start = self.end - timezone.timedelta(hours=2)
+        params = {'points': 100, 'from': start.isoformat(), 'to': self.end.isoformat()}
+        with self.settings(HISTORY_MAX_ROWS=999):
+            data = self.get(**params)
+        self.assertEqual(data['resolution'], '1m')
+        self.assertLessEqual(data['samples'], 90)
+        with self.settings(HISTORY_MAX_ROWS=1000):
+            self.assertEqual(self.get(**params)['resolution'], 'raw')
+
+    def test_downsamples_raw_samples(self):
+        start = self.end - timezone.timedelta(hours=2)
+        data = self.get(points=100, **{'from': start.isoformat(), 'to': self.end.isoformat()})
+
+        self.assertEqual((data['resolution'], data['samples']), ('raw', 1000))
+        self.assertEqual(len(data['metrics']['cpu']), 100)
+        self.assertIn(95, [value for _, value in data['metrics']['cpu']])
+        timestamps = [ts for ts, _ in data['metrics']['ram']]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_long_ranges_read_rollups(self):
+        TelemetryCompactor(settle=0).run_once()
+        start = self.end - timezone.timedelta(days=6)
+        data = self.get(points=100, **{'from': start.isoformat(), 'to': self.end.timestamp()})
+
+        self.assertEqual(data['resolution'], '1h')
+        self.assertEqual(sum(1 for _ in data['metrics']['disk']), data['samples'])
+
+    def test_invalid_range(self):
+        response = self.client.get(f'/api/devices/{self.device.id}/telemetry/', {'from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TelemetryExportTest(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user(username='acme', password='x')
+        self.device = Device.objects.create(hostname='export-a', mac_address='AA:BB:CC:00:00:60', assigned_client=self.client_user)
+        self.other = Device.objects.create(hostname='export-b', mac_address='AA:BB:CC:00:00:61')
+        for device in (self.device, self.other):
+            for cpu in range(5):
+                TelemetryData.objects.create(device=device, cpu_usage=cpu, ram_usage=1, disk_usage=2)
+
+    def download(self, **params):
+        async def fetch():
+            response = await self.async_client.get(reverse('telemetry_export'), params)
+            self.assertEqual(response.status_code, 200)
+            return b''.join([part async for part in response.streaming_content])
+        return async_to_sync(fetch)()
+
+    def test_csv_in_chunks(self):
+        rows = export.export_queryset(device=self.device.id)
+        parts = list(export.stream('csv', rows, chunk_size=2))
+        self.assertEqual(len(parts), 3)
+        lines = b''.join(parts).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.COLUMNS))
+        self.assertEqual(len(lines), 6)
+
+    async def test_view_fetches_chunks_lazily(self):
+        fetched = []
+        fetch_chunk = export.fetch_chunk
+
+        def counting(rows, after, chunk_size):
+            chunk, last = fetch_chunk(rows, after, chunk_size)
+            fetched.append(len(chunk))
+            return chunk, last
+
+        with mock.patch.object(export, 'fetch_chunk', counting), mock.patch.object(export, 'CHUNK_SIZE', 4):
+            response = await self.async_client.get(reverse('telemetry_export'), {'format': 'csv'})
+            self.assertTrue(response.is_async)
+            parts = aiter(response.streaming_content)
+            header_and_first = await anext(parts)
+            # Only the first chunk has been read when the first bytes go out
+            self.assertEqual(fetched, [4])
+            self.assertEqual(len(header_and_first.decode().splitlines()), 5)
+            rest = [part async for part in parts]
+        self.assertEqual(fetched, [4, 4, 2])
+        self.assertEqual(len(b''.join([header_and_first, *rest]).decode().splitlines()), 11)
+
+    def test_ndjson_filtered_by_client(self):
+        lines = self.download(format='ndjson', client='acme').decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual({json.loads(line)['hostname'] for line in lines}, {'export-a'})
+        self.assertEqual(len(self.download(format='ndjson', client=self.client_user.id).splitlines()), 5)
+
+    @skipUnless(export.pa is not None, "pyarrow is not installed")
+    def test_parquet(self):
+        rows = export.export_queryset()
+        data = b''.join(export.stream('parquet', rows, chunk_size=4))
+        table = export.pq.read_table(io.BytesIO(data))
+        self.assertEqual(table.num_rows, 10)
+        self.assertEqual(table.num_columns, len(export.COLUMNS))
+        self.assertEqual(export.pq.ParquetFile(io.BytesIO(data)).num_row_groups, 3)
+
+    def test_invalid_requests(self):
+        url = reverse('telemetry_export')
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'device': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'last week'}).status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'out.csv')
+            call_command('export_telemetry', '--device', str(self.other.id), '--output', path)
+            with open(path) as f:
+                self.assertEqual(len(f.read().splitlines()), 6)
+
+
+class ThresholdEngineTest(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', password='x')
+        self.device = Device.objects.create(hostname='alert-device', mac_address='AA:BB:CC:00:00:70')
+        self.rule = AlertRule.objects.create(name='CPU pegged', metric='cpu_usage', threshold=90, duration=300, severity='critical')
+        self.now = 0
+        self.writer = AlertWriter()
+        self.engine = ThresholdEngine(self.writer, clock=lambda: self.now)
+        self.engine.run_once()
+
+    def feed(self, at, cpu, device=None, client_id=None):
+        self.now = at
+        self.engine.observe((device or self.device).id, {'cpu_usage': cpu}, client_id)
+        self.writer.run_once()
+
+    def test_one_alert_per_incident(self):
+        self.feed(0, 95)
+        self.feed(200, 97)
+        self.assertFalse(MonitoringAlert.objects.exists())
+
+        self.feed(300, 96)
+        self.feed(400, 99)
+        alert = MonitoringAlert.objects.get()
+        self.assertEqual((alert.device, alert.rule, alert.severity, alert.resolved), (self.device, self.rule, 'critical', False))
+
+        # Between the clear level and the threshold the alert stays open
+        self.feed(500, 87)
+        self.assertFalse(MonitoringAlert.objects.get().resolved)
+
+        self.feed(600, 40)
+        alert.refresh_from_db()
+        self.assertTrue(alert.resolved)
+        self.assertIsNotNone(alert.resolved_at)
+
+    def test_dip_restarts_the_duration(self):
+        self.feed(0, 95)
+        self.feed(200, 50)
+        self.feed(400, 95)
+        self.feed(600, 95)
+        self.assertFalse(MonitoringAlert.objects.exists())
+        self.feed(700, 95)
+        self.assertEqual(MonitoringAlert.objects.count(), 1)
+
+    def test_client_rules(self):
+        AlertRule.objects.create(name='Disk full', metric='disk_usage', threshold=80, duration=0, client=self.customer)
+        self.engine.run_once()
+
+        self.engine.observe(self.device.id, {'disk_usage': 99})
+        self.engine.observe(self.device.id, {'disk_usage': 99}, client_id=self.customer.id)
+        self.writer.run_once()
+        self.assertEqual(MonitoringAlert.objects.get().rule.name, 'Disk full')
+
+    def test_open_alerts_resolve_after_restart(self):
+        self.feed(0, 95)
+        self.feed(300, 95)
+
+        engine = ThresholdEngine(self.writer, clock=lambda: self.now)
+        engine.run_once()
+        engine.observe(self.device.id, {'cpu_usage': 10})
+        self.writer.run_once()
+        self.assertTrue(MonitoringAlert.objects.get().resolved)
+
+    def test_writer_batches_and_deduplicates(self):
+        self.writer.open('key-a', device=self.device, message='a')
+        self.writer.open('key-b', device=self.device, message='b')
+        self.writer.resolve('key-b')
+        with self.assertNumQueries(4):  # savepoint, open keys, insert, release
+            self.writer.run_once()
+        self.assertEqual(list(MonitoringAlert.objects.values_list('dedupe_key', flat=True)), ['key-a'])
+
+        self.writer.open('key-a', device=self.device, message='again')
+        self.writer.open('key-c', device=self.device, message='c')
+        self.writer.run_once()
+        self.assertEqual(MonitoringAlert.objects.filter(dedupe_key='key-a', resolved=False).count(), 1)
+        # The duplicate of key-a was not inserted, so it is not counted
+        self.assertEqual(self.writer.opened, 2)
+
+
+class OfflineDetectorTest(TestCase):
+    def setUp(self):
+        self.important = Device.objects.create(hostname='server', mac_address='AA:BB:CC:00:00:80', is_important=True)
+        self.ordinary = Device.objects.create(hostname='laptop', mac_address='AA:BB:CC:00:00:81')
+        self.now = 0.0
+        self.writer = AlertWriter()
+        self.detector = OfflineDetector(self.writer, grace=30, refresh=3600, clock=lambda: self.now)
+
+    def tick(self, at):
+        self.now = at
+        expired = self.detector.run_once()
+        self.writer.run_once()
+        return expired
+
+    def test_heartbeats_keep_important_devices_online(self):
+        self.tick(0)
+        for at in range(10, 100, 10):
+            self.detector.heartbeat(self.important.id)
+            self.detector.heartbeat(self.ordinary.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.tick(at), 0)
+        self.assertFalse(MonitoringAlert.objects.exists())
+
+    def test_missed_heartbeats_alert_once_and_resolve(self):
+        self.tick(0)
+        self.detector.heartbeat(self.important.id)
+        self.assertEqual(self.tick(31), 1)
+        self.assertEqual(self.tick(120), 0)
+        alert = MonitoringAlert.objects.get()
+        self.assertEqual((alert.device, alert.severity, alert.resolved), (self.important, 'critical', False))
+
+        self.detector.heartbeat(self.important.id)
+        self.tick(121)
+        alert.refresh_from_db()
+        self.assertTrue(alert.resolved)
+
+    def test_offline_alerts_are_emailed_as_a_digest(self):
+        User.objects.create_user(username='tech', password='x', role='technician', email='tech@example.com')
+        User.objects.create_user(username='client', password='x', role='client', email='client@example.com')
+        self.tick(0)
+        self.tick(31)
+        self.tick(32)
+        notification = Notification.objects.get()
+        self.assertEqual((notification.recipient, notification.digest), ('tech@example.com', 'Monitoring alerts'))
+        self.assertIn('server is offline', notification.subject)
+
+    def test_open_alert_survives_restart(self):
+        self.tick(0)
+        self.tick(31)
+
+        detector = OfflineDetector(self.writer, grace=30, refresh=3600, clock=lambda: self.now)
+        self.now = 40
+        detector.run_once()
+        self.now = 80
+        self.assertEqual(detector.run_once(), 0)
+        detector.heartbeat(self.important.id)
+        self.writer.run_once()
+        self.assertTrue(MonitoringAlert.objects.get().resolved)
+
+
+class AssetPollerTest(TransactionTestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1024)
+        self.open_port = self.listener.getsockname()[1]
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            self.closed_port = closed.getsockname()[1]
+
+        self.now = 0.0
+        self.writer = AlertWriter()
+        self.poller = AssetPoller(self.writer, timeout=1, refresh=3600, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def asset(self, name, port, **fields):
+        return Asset.objects.create(name=name, category='printer', ip_address='127.0.0.1',
+                                    is_monitored=True, probe_ports=str(port), **fields)
+
+    def poll(self):
+        probed = self.poller.poll_all()
+        self.writer.run_once()
+        return probed
+
+    def test_probes_localhost_listener(self):
+        up = self.asset('printer', self.open_port)
+        down = self.asset('switch', self.closed_port)
+        Asset.objects.create(name='unmonitored', category='printer', ip_address='127.0.0.1')
+
+        self.assertEqual(self.poll(), 2)
+        self.assertTrue(up.status.is_up)
+        self.assertIsNotNone(up.status.latency_ms)
+        status = AssetStatus.objects.get(asset=down)
+        self.assertEqual((status.is_up, status.consecutive_failures), (False, 1))
+        self.assertEqual(len(status.history), 1)
+        self.assertFalse(MonitoringAlert.objects.exists())
+
+    def test_down_alert_raised_once_and_resolved(self):
+        asset = self.asset('printer', self.closed_port)
+        for _ in range(4):
+            self.poll()
+        alert = MonitoringAlert.objects.get()
+        self.assertEqual((alert.asset, alert.resolved), (asset, False))
+        self.assertEqual(len(AssetStatus.objects.get(asset=asset).history), 4)
+
+        Asset.objects.filter(pk=asset.pk).update(probe_ports=str(self.open_port))
+        self.poll()
+        alert.refresh_from_db()
+        self.assertTrue(alert.resolved)
+        self.assertEqual(AssetStatus.objects.get(asset=asset).consecutive_failures, 0)
+
+    def test_icmp_echo(self):
+        sock, _ = Pinger()._open()
+        if sock is None:
+            self.skipTest("No permission to open an ICMP socket")
+        sock.close()
+        asset = self.asset('printer', self.closed_port, probe_icmp=True)
+        self.poll()
+        self.assertTrue(AssetStatus.objects.get(asset=asset).is_up)
+
+    def test_assets_with_nothing_to_probe_are_skipped(self):
+        Asset.objects.create(name='phone', category='mobile', ip_address='127.0.0.1', is_monitored=True)
+        Asset.objects.create(name='v6', category='mobile', ip_address='::1', is_monitored=True, probe_icmp=True)
+        for _ in range(3):
+            self.assertEqual(self.poll(), 0)
+        self.assertFalse(AssetStatus.objects.exists())
+        self.assertFalse(MonitoringAlert.objects.exists())
+
+    def test_schedule_follows_poll_interval(self):
+        self.asset('printer', self.open_port, poll_interval=30)
+        self.asset('switch', self.open_port, poll_interval=60)
+        probed = []
+        for at in (1, 2, 31, 61):
+            self.now = at
+            probed.append(self.poller.run_once())
+        self.assertEqual(probed, [2, 0, 1, 2])
+
+    def test_many_assets_in_one_cycle(self):
+        self.poller.concurrency = 50
+        Asset.objects.bulk_create([
+            Asset(name=f'asset-{i}', category='other', ip_address='127.0.0.1', is_monitored=True,
+                  probe_ports=str(self.open_port if i % 2 else self.closed_port))
+            for i in range(300)
+        ])
+        self.assertEqual(self.poll(), 300)
+        self.assertEqual(AssetStatus.objects.filter(is_up=True).count(), 150)
+        self.assertEqual(AssetStatus.objects.filter(is_up=False).count(), 150)
+
+
+class ScreenFrameTest(TestCase):
+    def test_round_trip(self):
+        frame = screen.encode_frame([(0, 0, 64, 64, b'abc'), (64, 0, 16, 64, b'de')], 80, 64, seq=3, keyframe=True)
+        self.assertEqual(screen.parse_header(frame), (screen.FLAG_KEYFRAME, 3, 80, 64, 2))
+        tiles = [(x, y, w, h, bytes(jpeg)) for x, y, w, h, jpeg in screen.iter_tiles(frame)]
+        self.assertEqual(tiles, [(0, 0, 64, 64, b'abc'), (64, 0, 16, 64, b'de')])
+
+    def test_merge_keeps_newest_tile_per_position(self):
+        older = screen.encode_frame([(0, 0, 64, 64, b'old'), (64, 0, 64, 64, b'kept')], 128, 64, seq=1)
+        newer = screen.encode_frame([(0, 0, 64, 64, b'new')], 128, 64, seq=2)
+        merged = screen.merge_frames(older, newer)
+        self.assertEqual(screen.parse_header(merged), (0, 2, 128, 64, 2))
+        tiles = {(x, y): bytes(jpeg) for x, y, _, _, jpeg in screen.iter_tiles(merged)}
+        self.assertEqual(tiles, {(0, 0): b'new', (64, 0): b'kept'})
+
+    def test_merge_onto_keyframe_stays_keyframe(self):
+        older = screen.encode_frame([(0, 0, 64, 64, b'a')], 64, 64, seq=1, keyframe=True)
+        newer = screen.encode_frame([(0, 0, 64, 64, b'b')], 64, 64, seq=2)
+        self.assertEqual(screen.parse_header(screen.merge_frames(older, newer))[0], screen.FLAG_KEYFRAME)
+
+    def test_sessions_track_first_and_last_viewer(self):
+        sessions = screen.StreamSessions()
+        self.assertTrue(sessions.join('dev', 'a'))
+        self.assertFalse(sessions.join('dev', 'b'))
+        self.assertEqual(sessions.viewer_count('dev'), 2)
+        self.assertFalse(sessions.leave('dev', 'a'))
+        self.assertTrue(sessions.leave('dev', 'b'))
+        self.assertFalse(sessions.leave('dev', 'b'))
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(screen.FrameError):
+            screen.parse_header(b'not a frame at all')
+        frame = screen.encode_frame([(0, 0, 64, 64, b'abc')], 64, 64)
+        with self.assertRaises(screen.FrameError):
+            list(screen.iter_tiles(frame[:-1]))
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.bucket = TokenBucket(rate=10, burst=2, clock=lambda: self.now)
+
+    def test_burst_admitted_immediately(self):
+        self.assertEqual(self.bucket.reserve(), (True, 0.0))
+        self.assertEqual(self.bucket.reserve(), (True, 0.0))
+
+    def test_over_rate_is_delayed_then_deferred(self):
+        self.bucket.reserve()
+        self.bucket.reserve()
+        admitted, wait = self.bucket.reserve(max_wait=0.5)
+        self.assertTrue(admitted)
+        self.assertAlmostEqual(wait, 0.1)
+        admitted, retry_after = self.bucket.reserve(max_wait=0.1)
+        self.assertFalse(admitted)
+        self.assertAlmostEqual(retry_after, 0.2)
+        self.assertEqual(self.bucket.stats()['deferred'], 1)
+
+    def test_tokens_refill_over_time(self):
+        for _ in range(2):
+            self.bucket.reserve()
+        self.now += 1.0
+        self.assertEqual(self.bucket.reserve(), (True, 0.0))
+
+
+class AgentConsumerTest(TransactionTestCase):
+    handshake = {
+        'hostname': 'agent-host',
+        'os_info': 'Linux 6.1',
+        'mac_address': 'AA:BB:CC:00:00:10',
+        'local_ip': '10.0.0.5',
+        'public_ip': '127.0.0.1',
+        'agent_version': '1.1.0',
+    }
+
+    def tearDown(self):
+        # Keep process-wide state from leaking past the test database
+        telemetry_buffer.drain()
+        presence.run_once(force_persist=True)
+        alert_writer.run_once()
+        threshold_engine.load([])
+        offline_detector.load([])
+
+    async def connect_agent(self):
+        communicator = WebsocketCommunicator(application, '/ws/agent/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({'type': 'handshake', 'data': self.handshake})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack['type'], 'handshake_ack')
+        return communicator, ack['device_id']
+
+    def test_handshake_registers_device_and_presence(self):
+        async def scenario():
+            communicator, device_id = await self.connect_agent()
+            self.assertTrue(presence.is_online(device_id))
+            await communicator.send_json_to({
+                'type': 'heartbeat',
+                'data': {'cpu_usage': 5, 'ram_usage': 6, 'disk_usage': 7},
+            })
+            await communicator.receive_nothing()
+            self.assertEqual(telemetry_buffer.depth, 1)
+            await communicator.disconnect()
+            self.assertFalse(presence.is_online(device_id))
+            return device_id
+
+        device_id = async_to_sync(scenario)()
+        device = Device.objects.get(id=device_id)
+        self.assertEqual(device.hostname, 'agent-host')
+        self.assertEqual(telemetry_buffer.run_once(), 1)
+        self.assertEqual(TelemetryData.objects.filter(device=device).count(), 1)
+
+    def test_heartbeats_feed_alert_rules(self):
+        AlertRule.objects.create(name='RAM', metric='ram_usage', threshold=90, duration=0)
+        threshold_engine.run_once()
+
+        async def scenario():
+            communicator, device_id = await self.connect_agent()
+            await communicator.send_json_to({
+                'type': 'heartbeat',
+                'data': {'cpu_usage': 5, 'ram_usage': 95, 'disk_usage': 7},
+            })
+            await communicator.receive_nothing()
+            await communicator.disconnect()
+            return device_id
+
+        device_id = async_to_sync(scenario)()
+        self.assertEqual(alert_writer.run_once(), 1)
+        self.assertEqual(MonitoringAlert.objects.get().device_id, uuid.UUID(device_id))
+
+    def test_viewers_share_one_stream(self):
+        keyframe = screen.encode_frame([(0, 0, 64, 64, b'full')], 64, 64, seq=1, keyframe=True)
+        delta = screen.encode_frame([(0, 0, 64, 64, b'delta')], 64, 64, seq=2)
+
+        async def scenario():
+            agent, device_id = await self.connect_agent()
+            first = WebsocketCommunicator(application, f'/ws/browser/{device_id}/')
+            await first.connect()
+            self.assertEqual((await agent.receive_json_from())['type'], 'start_stream')
+
+            second = WebsocketCommunicator(application, f'/ws/browser/{device_id}/')
+            await second.connect()
+            self.assertEqual((await agent.receive_json_from())['type'], 'request_keyframe')
+
+            await agent.send_to(bytes_data=keyframe)
+            received = [await viewer.receive_from() for viewer in (first, second)]
+            for viewer in (first, second):
+                await viewer.send_json_to({'type': 'frame_ack'})
+            await agent.send_to(bytes_data=delta)
+            received += [await viewer.receive_from() for viewer in (first, second)]
+
+            await first.disconnect()
+            self.assertTrue(await agent.receive_nothing())
+            await second.disconnect()
+            self.assertEqual((await agent.receive_json_from())['type'], 'stop_stream')
+            await agent.disconnect()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [keyframe, keyframe, delta, delta])
+
+    def test_slow_viewer_gets_merged_frames(self):
+        keyframe = screen.encode_frame([(0, 0, 64, 64, b'full'), (64, 0, 64, 64, b'right')], 128, 64, seq=1, keyframe=True)
+        deltas = [screen.encode_frame([(0, 0, 64, 64, f'delta{seq}'.encode())], 128, 64, seq=seq) for seq in (2, 3, 4)]
+
+        async def scenario():
+            agent, device_id = await self.connect_agent()
+            viewer = WebsocketCommunicator(application, f'/ws/browser/{device_id}/')
+            await viewer.connect()
+            await agent.receive_json_from()
+            for frame in [keyframe, *deltas]:
+                await agent.send_to(bytes_data=frame)
+            first = await viewer.receive_from()
+            # Nothing more until the first frame is acknowledged
+            idle = await viewer.receive_nothing()
+            await viewer.send_json_to({'type': 'frame_ack'})
+            merged = await viewer.receive_from()
+            await viewer.disconnect()
+            await agent.disconnect()
+            return first, idle, merged
+
+        first, idle, merged = async_to_sync(scenario)()
+        self.assertEqual(first, keyframe)
+        self.assertTrue(idle)
+        self.assertEqual(screen.parse_header(merged)[1], 4)
+        self.assertEqual({(x, y): bytes(jpeg) for x, y, _, _, jpeg in screen.iter_tiles(merged)}, {(0, 0): b'delta4'})
+
+    def test_viewer_waits_for_keyframe(self):
+        delta = screen.encode_frame([(0, 0, 64, 64, b'delta')], 64, 64, seq=5)
+
+        async def scenario():
+            agent, device_id = await self.connect_agent()
+            viewer = WebsocketCommunicator(application, f'/ws/browser/{device_id}/')
+            await viewer.connect()
+            await agent.receive_json_from()
+            await agent.send_to(bytes_data=delta)
+            nothing = await viewer.receive_nothing()
+            await viewer.disconnect()
+            await agent.disconnect()
+            return nothing
+
+        self.assertTrue(async_to_sync(scenario)())
+
+    def test_batch_replay_keeps_original_timestamps(self):
+        async def scenario():
+            agent, device_id = await self.connect_agent()
+            await agent.send_json_to({
+                'type': 'batch',
+                'data': {
+                    'batch_id': 42,
+                    'heartbeats': [[1700000000.0, 11, 21, 31], [1700000005.0, 12, 22, 32]],
+                    'messages': [],
+                },
+            })
+            ack = await agent.receive_json_from()
+            await agent.disconnect()
+            return device_id, ack
+
+        device_id, ack = async_to_sync(scenario)()
+        self.assertEqual(ack, {'type': 'batch_ack', 'batch_id': 42, 'rejected': 0})
+        samples = TelemetryData.objects.filter(device_id=device_id).order_by('timestamp')
+        self.assertEqual([s.cpu_usage for s in samples], [11, 12])
+        self.assertEqual(samples[0].timestamp.timestamp(), 1700000000.0)
+
+    def test_malformed_batches_are_acked_or_rejected(self):
+        async def scenario():
+            agent, device_id = await self.connect_agent()
+            await agent.send_json_to({
+                'type': 'batch',
+                'data': {
+                    'batch_id': 7,
+                    'heartbeats': [[1700000000.0, 11, 21, 31], ['bad'], [1e300, 1, 2, 3], [1700000010.0, 'x', 2, 3], None],
+                    'messages': ['not a message', {'type': 'command_response', 'data': {'command_id': 'c'}}],
+                },
+            })
+            ack = await agent.receive_json_from()
+            await agent.send_json_to({
+                'type': 'batch',
+                'data': {'batch_id': 8, 'heartbeats': [[1700000000.0, 1, 2, 3]] * 5001, 'messages': []},
+            })
+            reject = await agent.receive_json_from()
+            await agent.disconnect()
+            return device_id, ack, reject
+
+        device_id, ack, reject = async_to_sync(scenario)()
+        self.assertEqual(ack, {'type': 'batch_ack', 'batch_id': 7, 'rejected': 5})
+        self.assertEqual(list(TelemetryData.objects.filter(device_id=device_id).values_list('cpu_usage', flat=True)), [11])
+        self.assertEqual(reject, {'type': 'batch_reject', 'batch_id': 8})
+
+    def test_handshake_deferred_over_rate(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(application, '/ws/agent/')
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'handshake', 'data': self.handshake})
+            reply = await communicator.receive_json_from()
+            closed = await communicator.receive_output()
+            return reply, closed
+
+        exhausted = TokenBucket(rate=0.01, burst=1)
+        exhausted.reserve()
+        with mock.patch('devices.consumers.handshake_admission', exhausted):
+            reply, closed = async_to_sync(scenario)()
+
+        self.assertEqual(reply['type'], 'handshake_defer')
+        self.assertGreater(reply['retry_after'], 0)
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 1013})
+        self.assertFalse(Device.objects.exists())
+
+
+class FleetSimulatorTest(TransactionTestCase):
+    def tearDown(self):
+        telemetry_buffer.drain()
+
+    def test_small_fleet(self):
+        simulator = FleetSimulator(agents=3, duration=1, interval=0.2, ramp=0.2,
+                                   commands_per_second=5, application=application)
+        report = async_to_sync(simulator.run)()
+
+        self.assertEqual(report['connected'], 3)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['heartbeats'], 0)
+        self.assertEqual(Device.objects.filter(hostname__startswith='sim-').count(), 3)
+        self.assertEqual(TelemetryData.objects.count(), simulator.heartbeats)
+        self.assertLess(report['db_statements_per_heartbeat'], 1)
+        self.assertFalse(Device.objects.filter(is_online=True).exists())
@@ -1,28 +1,119 @@
 from rest_framework import viewsets
-from .models import Device, Asset
-from .serializers import DeviceSerializer
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from django.db.models import Prefetch
+from .models import Device, Asset, TelemetryData
+from .serializers import DeviceSerializer, TELEMETRY_LIMIT, MAX_TELEMETRY_LIMIT
+from .presence import presence
+from . import export, history, rollups
 from .forms import AssetForm
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 import json
+import uuid
+from datetime import timedelta
+
+def parse_time(value, name):
+    try:
+        return history.parse_time(value)
+    except ValueError as e:
+        raise ValidationError({name: str(e)})
+
+class DevicePagination(CursorPagination):
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
 
 class DeviceViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows devices to be viewed or edited.
+    Lists are cursor-paginated. ?fields= selects a sparse fieldset and
+    ?telemetry=N the number of latest samples per device (0 to skip).
     """
-    queryset = Device.objects.all().order_by('-created_at')
+    queryset = Device.objects.select_related('metrics').order_by('-created_at')
     serializer_class = DeviceSerializer
+    pagination_class = DevicePagination
+
+    def telemetry_limit(self):
+        fields = self.request.query_params.get('fields')
+        if fields and 'telemetry' not in {name.strip() for name in fields.split(',')}:
+            return 0
+        try:
+            limit = int(self.request.query_params.get('telemetry', TELEMETRY_LIMIT))
+        except ValueError:
+            limit = TELEMETRY_LIMIT
+        return max(0, min(limit, MAX_TELEMETRY_LIMIT))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        limit = self.telemetry_limit() if self.action != 'telemetry' else 0
+        if limit:
+            # Sliced prefetch: one windowed query for the latest samples of every device on the page
+            queryset = queryset.prefetch_related(Prefetch(
+                'telemetry',
+                queryset=TelemetryData.objects.order_by('-timestamp')[:limit],
+                to_attr='latest_telemetry',
+            ))
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def telemetry(self, request, pk=None):
+        """
+        History of one device: ?from=&to= (ISO 8601 or epoch seconds, default
+        the last 24 hours) and ?points= (maximum samples per metric).
+        """
+        device = self.get_object()
+        end = parse_time(request.query_params.get('to'), 'to') or timezone.now()
+        start = parse_time(request.query_params.get('from'), 'from') or end - timedelta(hours=24)
+        if start >= end:
+            raise ValidationError({'from': '"from" must be before "to".'})
+        try:
+            points = int(request.query_params.get('points', history.DEFAULT_POINTS))
+        except ValueError:
+            raise ValidationError({'points': 'Must be an integer.'})
+        points = max(3, min(points, history.MAX_POINTS))
+        return JsonResponse(history.series(device, start, end, points))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['telemetry_limit'] = self.telemetry_limit()
+        return context
 
 def device_list(request):
-    devices = Device.objects.all().order_by('-last_seen')
+    devices = presence.apply(list(Device.objects.select_related('metrics').order_by('-last_seen')))
     return render(request, 'devices/device_list.html', {'devices': devices})
 
 def device_detail(request, device_id):
-    device = get_object_or_404(Device, id=device_id)
+    device = get_object_or_404(Device.objects.select_related('metrics'), id=device_id)
+    presence.apply([device])
     return render(request, 'devices/device_detail.html', {'device': device})
 
+def device_chart_data(request, device_id):
+    """
+    Telemetry history for one device, read from the rollup tables.
+    ?range= is one of 1h, 24h (default), 7d, 30d, 1y.
+    """
+    device = get_object_or_404(Device, id=device_id)
+    range_name = request.GET.get('range', '24h')
+    if range_name not in rollups.RANGES:
+        return JsonResponse({'status': 'error', 'message': f'Unknown range "{range_name}"'}, status=400)
+    resolution, data = rollups.series(device, range_name)
+    label_format = '%m-%d' if resolution == '1d' else '%m-%d %H:%M' if range_name == '7d' else '%H:%M'
+
+    return JsonResponse({
+        'resolution': resolution,
+        'labels': [timezone.localtime(entry.bucket).strftime(label_format) for entry in data],
+        'cpu': [round(entry.cpu_avg, 2) for entry in data],
+        'cpu_p95': [round(entry.cpu_p95, 2) for entry in data],
+        'ram': [round(entry.ram_avg, 2) for entry in data],
+        'disk': [round(entry.disk_avg, 2) for entry in data],
+    })
+
 def remote_control(request, device_id):
     device = get_object_or_404(Device, id=device_id)
     return render(request, 'devices/remote_control.html', {'device': device})
@@ -39,6 +130,7 @@ def device_send_command(request, device_id):
             if not command:
                 return JsonResponse({'status': 'error', 'message': 'No command provided'}, status=400)
             
+            command_id = uuid.uuid4().hex
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"device_{device.id}",
@@ -46,18 +138,38 @@ def device_send_command(request, device_id):
                     "type": "device.command",
                     "content": {
                         "type": "command",
-                        "command": command
+                        "command": command,
+                        "command_id": command_id
                     }
                 }
             )
-            return JsonResponse({'status': 'success', 'message': f'Command "{command}" sent'})
+            return JsonResponse({'status': 'success', 'message': f'Command "{command}" sent', 'command_id': command_id})
         except Exception as e:
              return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
     return JsonResponse({'status': 'error', 'message': 'Invalid method'}, status=405)
 
+def telemetry_export(request):
+    """
+    Streams raw telemetry as ?format=csv|ndjson|parquet, filtered by
+    ?device=, ?client= (user id or username), ?from= and ?to=. The body is
+    an async iterator, so under ASGI each chunk is fetched as the client
+    reads instead of the whole export being buffered first.
+    """
+    fmt = request.GET.get('format', 'csv')
+    try:
+        start = history.parse_time(request.GET.get('from'))
+        end = history.parse_time(request.GET.get('to'))
+        rows = export.export_queryset(request.GET.get('device'), request.GET.get('client'), start, end)
+        body = export.astream(fmt, rows)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    response = StreamingHttpResponse(body, content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="telemetry.{fmt}"'
+    return response
+
 # Asset Views
 def asset_list(request):
-    assets = Asset.objects.all()
+    assets = Asset.objects.select_related('status', 'assigned_user')
     return render(request, 'devices/asset_list.html', {'assets': assets})
 
 def asset_create(request):
@@ -1,17 +1,25 @@
 from django.contrib import admin
+from core.search import IndexedSearchAdminMixin
 from .models import Article, Attachment
+from .search import article_index
 
 class AttachmentInline(admin.TabularInline):
     model = Attachment
     extra = 1
+    fields = ('file', 'description', 'filename', 'size')
+    readonly_fields = ('filename', 'size')
 
 @admin.register(Article)
-class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('title', 'category', 'author', 'is_public', 'updated_at')
+class ArticleAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
+    list_display = ('title', 'category', 'author', 'is_public', 'view_count', 'updated_at')
     list_filter = ('category', 'is_public')
+    list_select_related = ('author',)
+    # Searched through the full-text index; search_fields only enables the search box
     search_fields = ('title', 'content')
+    search_index = article_index
     inlines = [AttachmentInline]
 
 @admin.register(Attachment)
 class AttachmentAdmin(admin.ModelAdmin):
-    list_display = ('article', 'file', 'uploaded_at')
+    list_display = ('article', 'filename', 'size', 'sha256', 'uploaded_at')
+    readonly_fields = ('filename', 'sha256', 'size', 'content_type')
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class KnowledgeBaseConfig(AppConfig):
     name = "knowledge_base"
+
+    def ready(self):
+        import knowledge_base.signals  # noqa: F401
+        # Registers the view counter with the background workers
+        import knowledge_base.counters  # noqa: F401
@@ -0,0 +1,74 @@
+"""
+Article view counts.
+
+Views are counted in memory and written in batches: one UPDATE per viewed
+article per flush rather than one per page view. The background worker
+flushes every KB_VIEW_FLUSH_INTERVAL and then warms the render cache for the
+most viewed articles. In a process without the worker running, the request
+that finds a flush due (the interval has passed or enough views are pending)
+writes the counts itself, without warming. Pending views are written at exit.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F
+
+from core import background
+from .models import Article
+from .rendering import warm
+
+
+class ViewCounter(background.PeriodicWorker):
+    name = 'kb-views'
+
+    def __init__(self, interval=None, max_pending=None, clock=time.monotonic):
+        super().__init__(interval if interval is not None else getattr(settings, 'KB_VIEW_FLUSH_INTERVAL', 60))
+        self.max_pending = max_pending or getattr(settings, 'KB_VIEW_FLUSH_MAX', 1000)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flushed_at = clock()
+
+    def record(self, article_id):
+        with self._lock:
+            self._pending[article_id] += 1
+            due = (sum(self._pending.values()) >= self.max_pending
+                   or self.clock() - self._flushed_at >= self.interval)
+        if due and not self.running:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending view counts. Returns the number of articles updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = self.clock()
+        if not pending:
+            return 0
+        try:
+            for article_id, views in pending.items():
+                # update() leaves updated_at alone, so the render cache stays valid
+                Article.objects.filter(pk=article_id).update(view_count=F('view_count') + views)
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return len(pending)
+
+    def run_once(self):
+        flushed = self.flush()
+        if flushed:
+            warm()
+        return flushed
+
+    def shutdown(self):
+        with self._lock:
+            pending = bool(self._pending)
+        if pending:
+            self.flush()
+
+
+view_counter = background.register(ViewCounter())
@@ -0,0 +1,101 @@
+"""
+Attachment downloads.
+
+Blobs are streamed in chunks with a strong ETag (the content hash), so
+clients can revalidate with If-None-Match and resume with a single
+Range: bytes=... request (guarded by If-Range). Multi-range requests are
+answered with the whole file.
+
+The body is an async iterator that reads one chunk at a time in a worker
+thread: under ASGI a synchronous iterator would be read in full into memory
+before the first byte is sent.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Returns (first, last) byte positions, inclusive, or None for the whole
+    file. Raises RangeNotSatisfiable for a range outside the file.
+    """
+    match = RANGE.match(header.replace(' ', '')) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable
+    return first, last
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    return header.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+async def read(file, first, last):
+    # File I/O needs no database, so it stays off the shared database thread
+    read_chunk = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = await read_chunk(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve(request, file, size, etag, filename, content_type):
+    """
+    Response for `file` (an open binary file of `size` bytes).
+    """
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+    }
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        file.close()
+        return HttpResponse(status=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            file.close()
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    first, last = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(read(file, first, last), content_type=content_type,
+                                     status=206 if byte_range else 200, headers=headers)
+    response['Content-Length'] = str(last - first + 1) if size else '0'
+    if byte_range:
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
@@ -0,0 +1,33 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from knowledge_base.models import Attachment
+from knowledge_base.storage import PREFIX, blob_storage
+
+
+class Command(BaseCommand):
+    help = "Deletes attachment blobs that no attachment refers to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List what would be deleted")
+
+    def handle(self, *args, **options):
+        root = blob_storage.path(PREFIX)
+        used = set(Attachment.objects.values_list('file', flat=True))
+        # Blobs written or reused in the last hour may belong to an upload
+        # whose attachment row is not committed yet
+        cutoff = time.time() - 3600
+        deleted = 0
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, blob_storage.location).replace(os.sep, '/')
+                if name in used or os.path.getmtime(path) > cutoff:
+                    continue
+                if not options['dry_run']:
+                    blob_storage.delete(name)
+                deleted += 1
+                self.stdout.write(name)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {deleted} blobs")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from knowledge_base.rendering import warm
+
+
+class Command(BaseCommand):
+    help = "Renders the most viewed knowledge-base articles into the render cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="Number of most viewed articles to warm")
+
+    def handle(self, *args, **options):
+        rendered = warm(options['limit'])
+        self.stdout.write(f"Rendered {rendered} articles")
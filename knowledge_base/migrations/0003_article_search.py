@@ -0,0 +1,63 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:20
+
+from collections import defaultdict
+
+from django.db import migrations
+
+# The index schema as of this migration, frozen here rather than taken from
+# knowledge_base.search so that replaying the migration always builds the same table
+SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE knowledge_base_search USING fts5(title, category, content, attachments, "
+    "is_public UNINDEXED, tokenize='porter unicode61')"
+)
+SQLITE_INSERT = (
+    "INSERT INTO knowledge_base_search (rowid, title, category, content, attachments, is_public) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+PG_TABLE = "CREATE TABLE knowledge_base_search (object_id bigint PRIMARY KEY, document tsvector NOT NULL, is_public integer)"
+PG_INDEX = "CREATE INDEX knowledge_base_search_document_idx ON knowledge_base_search USING GIN (document)"
+PG_INSERT = (
+    "INSERT INTO knowledge_base_search (object_id, document, is_public) VALUES (%s, "
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B') || "
+    "setweight(to_tsvector('english', %s), 'C') || setweight(to_tsvector('english', %s), 'D'), %s)"
+)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE)
+        insert = SQLITE_INSERT
+    elif vendor == 'postgresql':
+        schema_editor.execute(PG_TABLE)
+        schema_editor.execute(PG_INDEX)
+        insert = PG_INSERT
+    else:
+        return
+    Article = apps.get_model('knowledge_base', 'Article')
+    Attachment = apps.get_model('knowledge_base', 'Attachment')
+    descriptions = defaultdict(list)
+    for article_id, description in Attachment.objects.exclude(description='').values_list('article_id', 'description'):
+        descriptions[article_id].append(description)
+    rows = [(pk, title or '', category or '', content or '', '\n'.join(descriptions[pk]), int(is_public))
+            for pk, title, category, content, is_public
+            in Article.objects.values_list('pk', 'title', 'category', 'content', 'is_public')]
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(insert, rows)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS knowledge_base_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("knowledge_base", "0002_article_list_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("knowledge_base", "0003_article_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="view_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:06
+
+import mimetypes
+import os
+
+import knowledge_base.storage
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models, transaction
+
+
+def legacy_storages():
+    """
+    Where existing uploads may be: MEDIA_ROOT, then LEGACY_MEDIA_ROOT (uploads
+    made before MEDIA_ROOT was configured went to the server's working
+    directory), then the current working directory.
+    """
+    roots = []
+    for root in (settings.MEDIA_ROOT, getattr(settings, 'LEGACY_MEDIA_ROOT', None), os.getcwd()):
+        if root and os.path.abspath(root) not in roots:
+            roots.append(os.path.abspath(root))
+    return [FileSystemStorage(location=root) for root in roots]
+
+
+def move_to_blobs(apps, schema_editor):
+    """
+    Re-stores existing uploads by content hash; duplicates collapse into one
+    blob. Fails, before changing anything, if an upload cannot be found.
+    """
+    Attachment = apps.get_model('knowledge_base', 'Attachment')
+    storage = knowledge_base.storage.blob_storage
+    storages = legacy_storages()
+
+    found, missing = [], []
+    for attachment in Attachment.objects.filter(sha256='').exclude(file=''):
+        source = next((candidate for candidate in storages if candidate.exists(attachment.file.name)), None)
+        if source is None:
+            missing.append(attachment.file.name)
+        else:
+            found.append((attachment, source))
+    if missing:
+        raise RuntimeError(
+            f"{len(missing)} attachment file(s) not found in {', '.join(s.location for s in storages)}: "
+            f"{', '.join(missing[:20])}. Set LEGACY_MEDIA_ROOT to the directory holding kb_attachments/, "
+            f"or delete the attachments whose files are gone, and migrate again."
+        )
+
+    moved = []
+    for attachment, source in found:
+        old_name = attachment.file.name
+        with source.open(old_name) as content:
+            digest = knowledge_base.storage.digest_of(content)
+            content.sha256 = digest
+            attachment.file.name = storage.save(old_name, content)
+        attachment.filename = os.path.basename(old_name)
+        attachment.sha256 = digest
+        attachment.size = storage.size(attachment.file.name)
+        attachment.content_type = mimetypes.guess_type(attachment.filename)[0] or 'application/octet-stream'
+        attachment.save(update_fields=['file', 'filename', 'sha256', 'size', 'content_type'])
+        moved.append((source, old_name))
+
+    def delete_originals():
+        for source, old_name in moved:
+            source.delete(old_name)
+
+    # Originals stay in place if the migration rolls back
+    transaction.on_commit(delete_originals, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("knowledge_base", "0004_article_view_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="content_type",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="filename",
+            field=models.CharField(
+                blank=True, help_text="Original name of the upload", max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="sha256",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="attachment",
+            name="size",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="attachment",
+            name="file",
+            field=models.FileField(
+                storage=knowledge_base.storage.ContentAddressedStorage(),
+                upload_to="kb_attachments/",
+            ),
+        ),
+        migrations.RunPython(move_to_blobs, migrations.RunPython.noop),
+    ]
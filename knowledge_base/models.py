@@ -1,5 +1,9 @@
+import mimetypes
+import os
+
 from django.db import models
 from django.conf import settings
+from .storage import blob_storage, digest_of
 
 class Article(models.Model):
     title = models.CharField(max_length=200)
@@ -9,15 +13,42 @@ class Article(models.Model):
     
     is_public = models.BooleanField(default=False, help_text="Visible to clients?")
     private_notes = models.TextField(blank=True, help_text="Internal notes for admins")
+    view_count = models.PositiveIntegerField(default=0, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Article list: recently updated first, public-only for clients
+            models.Index(fields=['updated_at'], name='article_updated_idx'),
+            models.Index(fields=['is_public', 'updated_at'], name='article_public_updated_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
 class Attachment(models.Model):
     article = models.ForeignKey(Article, related_name='attachments', on_delete=models.CASCADE)
-    file = models.FileField(upload_to='kb_attachments/')
+    # Stored by content hash, shared by identical uploads (see knowledge_base/storage.py)
+    file = models.FileField(upload_to='kb_attachments/', storage=blob_storage)
     description = models.CharField(max_length=200, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    filename = models.CharField(max_length=255, blank=True, help_text="Original name of the upload")
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    size = models.BigIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return self.filename or self.file.name
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.filename = os.path.basename(self.file.name)
+            self.size = self.file.size
+            self.content_type = mimetypes.guess_type(self.filename)[0] or 'application/octet-stream'
+            self.sha256 = digest_of(self.file)
+            # Lets the storage skip hashing the upload a second time
+            self.file.file.sha256 = self.sha256
+        super().save(*args, **kwargs)
@@ -0,0 +1,174 @@
+"""
+Article rendering and the render cache.
+
+Article.content is Markdown (rendered with the optional `markdown` package),
+HTML, or plain text. Whatever comes out is passed through an allowlist
+sanitizer before it reaches a template.
+
+Rendered HTML is kept in the KB_RENDER_CACHE cache alias (an LRU-evicting
+backend, see CACHES) under the article id together with the `updated_at` it
+was rendered from, so a stale entry is never served. Saving an article
+re-renders it; the most viewed articles are warmed by warm().
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.html import linebreaks
+
+from .models import Article
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+# Bumped when rendering changes, so old cache entries are ignored
+RENDER_VERSION = 1
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt', 'em', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'hr', 'i', 'img', 'kbd', 'li', 'ol', 'p', 'pre', 'span', 'strong', 'sub', 'sup',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'code': {'class'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+# Dropped together with everything inside them
+DROP_CONTENT = {'script', 'style', 'iframe', 'object', 'embed', 'template', 'textarea', 'select'}
+
+HTML_TAG = re.compile(r'</?[a-zA-Z][^>]*>')
+
+
+class Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        kept = []
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRIBUTES.get(tag, ()) or value is None:
+                continue
+            if name in URL_ATTRIBUTES and urlparse(value.strip()).scheme.lower() not in URL_SCHEMES:
+                continue
+            kept.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == 'a':
+            kept.append(' rel="noopener noreferrer"')
+        self.out.append(f"<{tag}{''.join(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in DROP_CONTENT:
+            self.dropping -= 1
+        elif tag in self.open and tag not in VOID_TAGS and self.open[-1] == tag:
+            self.open.pop()
+            self.out.append(f"</{tag}>")
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open:
+            return
+        # Close anything left open inside it
+        while self.open:
+            current = self.open.pop()
+            self.out.append(f"</{current}>")
+            if current == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        return ''.join(self.out) + ''.join(f"</{tag}>" for tag in reversed(self.open))
+
+
+def sanitize(html):
+    parser = Sanitizer()
+    parser.feed(html)
+    return parser.result()
+
+
+def render_content(content):
+    """
+    Sanitized HTML for article content.
+    """
+    if markdown is not None:
+        html = markdown.markdown(content, extensions=['fenced_code', 'tables'])
+    elif HTML_TAG.search(content):
+        html = content
+    else:
+        return linebreaks(content, autoescape=True)
+    return sanitize(html)
+
+
+def _cache():
+    return caches[getattr(settings, 'KB_RENDER_CACHE', 'default')]
+
+
+def cache_key(article_id):
+    return f"kb:render:{RENDER_VERSION}:{article_id}"
+
+
+def _stamp(article):
+    return article.updated_at.isoformat()
+
+
+def store(article):
+    html = render_content(article.content)
+    _cache().set(cache_key(article.pk), (_stamp(article), html), getattr(settings, 'KB_RENDER_TTL', 86400))
+    return html
+
+
+def rendered(article):
+    """
+    The article's sanitized HTML, from the cache when it is current.
+    """
+    entry = _cache().get(cache_key(article.pk))
+    if entry is not None and entry[0] == _stamp(article):
+        return entry[1]
+    return store(article)
+
+
+def invalidate(article_id):
+    _cache().delete(cache_key(article_id))
+
+
+def warm(limit=None):
+    """
+    Renders the most viewed articles that are missing from the cache.
+    Returns how many were rendered.
+    """
+    limit = limit or getattr(settings, 'KB_RENDER_WARM', 50)
+    articles = list(Article.objects.order_by('-view_count').only('id', 'content', 'updated_at')[:limit])
+    cached = _cache().get_many([cache_key(article.pk) for article in articles])
+    count = 0
+    for article in articles:
+        entry = cached.get(cache_key(article.pk))
+        if entry is None or entry[0] != _stamp(article):
+            store(article)
+            count += 1
+    return count
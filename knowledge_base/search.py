@@ -0,0 +1,39 @@
+"""
+Full-text index of knowledge-base articles: title, category, content and
+attachment descriptions. `is_public` is stored in the index, so searches for
+clients are restricted to public articles inside the index query. Kept
+current by the article and attachment signals (see knowledge_base/signals.py).
+"""
+from collections import defaultdict
+
+from core import search
+from .models import Article, Attachment
+
+
+class ArticleIndex(search.SearchIndex):
+    table = 'knowledge_base_search'
+    model = Article
+    columns = ('title', 'category', 'content', 'attachments')
+    weights = (10.0, 5.0, 1.0, 2.0)
+    attributes = ('is_public',)
+
+    def documents(self, pks=None):
+        articles = Article.objects.order_by('pk')
+        attachments = Attachment.objects.exclude(description='')
+        if pks is not None:
+            articles = articles.filter(pk__in=pks)
+            attachments = attachments.filter(article_id__in=pks)
+        descriptions = defaultdict(list)
+        for article_id, description in attachments.values_list('article_id', 'description'):
+            descriptions[article_id].append(description)
+        rows = articles.values_list('pk', 'title', 'category', 'content', 'is_public')
+        for pk, title, category, content, is_public in rows.iterator():
+            yield pk, {
+                'title': title,
+                'category': category,
+                'content': content,
+                'attachments': '\n'.join(descriptions[pk]),
+            }, {'is_public': is_public}
+
+
+article_index = search.register(ArticleIndex())
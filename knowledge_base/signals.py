@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Article, Attachment
+from . import rendering
+from .search import article_index
+from .similar import similar_articles
+
+@receiver(post_save, sender=Article)
+def index_article(sender, instance, **kwargs):
+    article_index.refresh([instance.pk])
+
+@receiver(post_save, sender=Article)
+def render_article(sender, instance, **kwargs):
+    # Replaces the cached HTML rendered from the previous version
+    rendering.store(instance)
+
+@receiver(post_save, sender=Article)
+def update_similar(sender, instance, **kwargs):
+    # The in-memory index is not transactional, so it follows committed changes only
+    transaction.on_commit(lambda: similar_articles.update(instance))
+
+@receiver(post_delete, sender=Article)
+def unindex_article(sender, instance, **kwargs):
+    article_index.delete([instance.pk])
+    rendering.invalidate(instance.pk)
+    article_id = instance.pk
+    transaction.on_commit(lambda: similar_articles.remove(article_id))
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def index_attachments(sender, instance, **kwargs):
+    article_index.refresh([instance.article_id])
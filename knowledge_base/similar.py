@@ -0,0 +1,281 @@
+"""
+Similar-article suggestions.
+
+An in-process TF-IDF index over article title, category and content, used to
+suggest knowledge-base articles for a ticket. Each article is a row of
+sublinear term frequencies (1 + log tf) in a sparse CSC matrix; idf weights
+and document norms are applied at query time from the current document
+frequencies, so scores are exact cosine similarities however the corpus has
+changed. A query only reads the matrix columns of its own terms.
+
+Updates are incremental: a saved or deleted article is re-tokenized and kept
+in a small overlay that is scored separately, with its stale matrix row
+masked out, until enough rows have changed to rebuild the matrix. The index
+loads lazily on first use and, because every process has its own copy,
+re-syncs against Article.updated_at every KB_SIMILAR_REFRESH seconds to pick
+up edits made elsewhere.
+
+Needs the optional `scipy` package; without it suggest() returns nothing.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from .models import Article
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+STOP_WORDS = frozenset("""
+    a about after all also am an and any are as at be been before being but by can could did do does doing
+    for from had has have having he her here him his how i if in into is it its just me more my no not now
+    of on or our out over please so some still than that the their them then there these they this to too
+    up us very was we were what when where which while who why will with would you your
+""".split())
+
+TOKEN = re.compile(r'\w+')
+
+# Overlay rows beyond which the matrix is rebuilt (and the fraction of rows)
+COMPACT_MIN = 64
+COMPACT_FRACTION = 0.1
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(strip_tags(text or '').lower())
+            if len(token) > 1 and token not in STOP_WORDS]
+
+
+def article_terms(title, category, content):
+    # The title counts twice, it usually names the problem
+    return tokenize(title) * 2 + tokenize(category) + tokenize(content)
+
+
+class SimilarArticles:
+    def __init__(self, refresh=None, clock=time.monotonic):
+        self.refresh = refresh if refresh is not None else getattr(settings, 'KB_SIMILAR_REFRESH', 300)
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self.synced_at = None
+            self.vocabulary = {}
+            self.df = np.zeros(1024, dtype=np.int64)
+            # article id -> (columns, weights), is_public, updated_at
+            self.docs = {}
+            self.public = {}
+            self.stamps = {}
+            # Matrix snapshot and the articles changed since it was built
+            self.matrix = None
+            self.squares = None
+            self.row_ids = np.zeros(0, dtype=np.int64)
+            self.row_public = np.zeros(0, dtype=bool)
+            self.stale = set()
+            # Snapshot row norms, valid while the document frequencies are unchanged
+            self.version = 0
+            self.norms = None
+
+    @property
+    def available(self):
+        return sparse is not None
+
+    # Vectors
+
+    def _columns(self, terms, grow):
+        counts = Counter(terms)
+        columns, weights = [], []
+        for term, count in counts.items():
+            column = self.vocabulary.get(term)
+            if column is None:
+                if not grow:
+                    continue
+                column = self.vocabulary[term] = len(self.vocabulary)
+            columns.append(column)
+            weights.append(1.0 + math.log(count))
+        order = np.argsort(columns)
+        return np.asarray(columns, dtype=np.int64)[order], np.asarray(weights, dtype=np.float64)[order]
+
+    def _idf(self):
+        n = len(self.docs)
+        df = self.df[:len(self.vocabulary)]
+        return np.log((n + 1) / (df + 1)) + 1.0
+
+    # Updates
+
+    def _remove(self, article_id):
+        doc = self.docs.pop(article_id, None)
+        if doc is not None:
+            self.df[doc[0]] -= 1
+        self.public.pop(article_id, None)
+        self.stamps.pop(article_id, None)
+        self.stale.add(article_id)
+        self.version += 1
+
+    def _add(self, article_id, title, category, content, is_public, updated_at):
+        self._remove(article_id)
+        columns, weights = self._columns(article_terms(title, category, content), grow=True)
+        if len(self.vocabulary) > len(self.df):
+            self.df = np.concatenate([self.df, np.zeros(max(len(self.df), len(self.vocabulary) - len(self.df)), dtype=np.int64)])
+        self.df[columns] += 1
+        self.version += 1
+        self.docs[article_id] = (columns, weights)
+        self.public[article_id] = bool(is_public)
+        self.stamps[article_id] = updated_at
+
+    def update(self, article):
+        """
+        Re-indexes one article; a no-op until the index has been loaded.
+        """
+        with self.lock:
+            if not self.loaded:
+                return
+            self._add(article.pk, article.title, article.category, article.content, article.is_public, article.updated_at)
+            self._maybe_compact()
+
+    def remove(self, article_id):
+        with self.lock:
+            if self.loaded:
+                self._remove(article_id)
+                self._maybe_compact()
+
+    def compact(self):
+        """
+        Rebuilds the matrix snapshot from the current documents.
+        """
+        with self.lock:
+            ids = sorted(self.docs)
+            rows, columns, weights = [], [], []
+            for row, article_id in enumerate(ids):
+                doc_columns, doc_weights = self.docs[article_id]
+                rows.append(np.full(len(doc_columns), row, dtype=np.int64))
+                columns.append(doc_columns)
+                weights.append(doc_weights)
+            shape = (len(ids), len(self.vocabulary))
+            if ids:
+                self.matrix = sparse.csc_matrix(
+                    (np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))), shape=shape)
+            else:
+                self.matrix = sparse.csc_matrix(shape)
+            self.squares = self.matrix.multiply(self.matrix).tocsr()
+            self.row_ids = np.asarray(ids, dtype=np.int64)
+            self.row_public = np.asarray([self.public[article_id] for article_id in ids], dtype=bool)
+            self.stale = set()
+            self.norms = None
+
+    def _maybe_compact(self):
+        if len(self.stale) >= max(COMPACT_MIN, COMPACT_FRACTION * len(self.row_ids)):
+            self.compact()
+
+    # Loading
+
+    def load(self):
+        with self.lock:
+            self.reset()
+            rows = Article.objects.values_list('pk', 'title', 'category', 'content', 'is_public', 'updated_at')
+            for row in rows.iterator():
+                self._add(*row)
+            self.compact()
+            self.loaded = True
+            self.synced_at = self.clock()
+
+    def sync(self):
+        """
+        Re-reads articles added, edited or deleted since they were indexed.
+        Returns the number of articles re-indexed or removed.
+        """
+        with self.lock:
+            current = dict(Article.objects.values_list('pk', 'updated_at'))
+            changed = [pk for pk, updated_at in current.items() if self.stamps.get(pk) != updated_at]
+            removed = [pk for pk in self.docs if pk not in current]
+            for pk in removed:
+                self._remove(pk)
+            rows = Article.objects.filter(pk__in=changed) \
+                .values_list('pk', 'title', 'category', 'content', 'is_public', 'updated_at')
+            for row in rows.iterator():
+                self._add(*row)
+            self._maybe_compact()
+            self.synced_at = self.clock()
+            return len(changed) + len(removed)
+
+    def ensure_current(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            elif self.clock() - self.synced_at >= self.refresh:
+                self.sync()
+
+    # Queries
+
+    def search(self, text, limit=None, public_only=False):
+        """
+        Returns [(article_id, score)] for the articles most similar to `text`,
+        best first. Scores are cosine similarities between 0 and 1.
+        """
+        if sparse is None:
+            return []
+        limit = limit or getattr(settings, 'KB_SIMILAR_LIMIT', 5)
+        min_score = getattr(settings, 'KB_SIMILAR_MIN_SCORE', 0.05)
+        with self.lock:
+            self.ensure_current()
+            columns, weights = self._columns(tokenize(text), grow=False)
+            if not len(columns) or not self.docs:
+                return []
+            idf = self._idf()
+            query = weights * idf[columns]
+            query_norm = np.sqrt(np.sum(query ** 2))
+            idf_squared = idf ** 2
+
+            candidates = []
+            if len(self.row_ids):
+                snapshot = columns[columns < self.matrix.shape[1]]
+                scores = self.matrix[:, snapshot] @ (query[:len(snapshot)] * idf[snapshot])
+                if self.norms is None or self.norms[0] != self.version:
+                    self.norms = (self.version, np.sqrt(self.squares @ idf_squared[:self.matrix.shape[1]]))
+                norms = self.norms[1]
+                scores = np.divide(scores, norms * query_norm, out=np.zeros_like(scores), where=norms > 0)
+                mask = scores >= min_score
+                if public_only:
+                    mask &= self.row_public
+                if self.stale:
+                    mask &= ~np.isin(self.row_ids, list(self.stale))
+                hits = np.flatnonzero(mask)
+                if len(hits) > limit:
+                    hits = hits[np.argpartition(-scores[hits], limit)[:limit]]
+                candidates.extend(zip(self.row_ids[hits].tolist(), scores[hits].tolist()))
+
+            # Articles changed since the snapshot are scored one by one
+            query_weights = dict(zip(columns.tolist(), query.tolist()))
+            for article_id in self.stale:
+                if article_id not in self.docs or (public_only and not self.public[article_id]):
+                    continue
+                doc_columns, doc_weights = self.docs[article_id]
+                doc = doc_weights * idf[doc_columns]
+                norm = np.sqrt(np.sum(doc ** 2))
+                dot = sum(query_weights.get(column, 0.0) * weight for column, weight in zip(doc_columns.tolist(), doc.tolist()))
+                score = dot / (norm * query_norm) if norm else 0.0
+                if score >= min_score:
+                    candidates.append((article_id, score))
+
+        candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+        return candidates[:limit]
+
+    def suggest(self, text, limit=None, public_only=False):
+        """
+        [(Article, score)] for the articles most similar to `text`, best first.
+        """
+        matches = self.search(text, limit, public_only)
+        articles = Article.objects.in_bulk([article_id for article_id, _ in matches])
+        return [(articles[article_id], score) for article_id, score in matches if article_id in articles]
+
+
+similar_articles = SimilarArticles()
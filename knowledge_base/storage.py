@@ -0,0 +1,62 @@
+"""
+Content-addressed storage for attachments.
+
+A file is stored under the SHA-256 of its content (kb_blobs/ab/cd/<digest>),
+so identical uploads share one blob whatever their names. The original
+filename and content type live on the Attachment. Blobs are never
+overwritten; prune_attachment_blobs removes the ones no attachment uses.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+PREFIX = 'kb_blobs'
+CHUNK_SIZE = 64 * 1024
+
+
+def digest_of(content):
+    sha = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(CHUNK_SIZE) if hasattr(content, 'chunks') else iter(lambda: content.read(CHUNK_SIZE), b''):
+        sha.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return sha.hexdigest()
+
+
+def blob_name(digest):
+    return f"{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def digest_from_name(name):
+    """
+    The digest a blob name was derived from, or None for other files.
+    """
+    if not name or not name.startswith(PREFIX + '/'):
+        return None
+    return os.path.basename(name)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The name is the content: an existing file is the same file
+        return name
+
+    def _save(self, name, content):
+        name = blob_name(getattr(content, 'sha256', None) or digest_of(content))
+        if self.exists(name):
+            # Marks the blob as in use for prune_attachment_blobs
+            os.utime(self.path(name))
+            return name
+        # Written aside and renamed into place, so a concurrent upload of the
+        # same content never sees a partial blob
+        temporary = super()._save(f"{PREFIX}/tmp/{uuid.uuid4().hex}", content)
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+blob_storage = ContentAddressedStorage()
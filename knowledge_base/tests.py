@@ -1 +1,319 @@
-# Create your tests here.
+import hashlib
+import importlib
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from core.models import User
+from .models import Article, Attachment
+from .storage import blob_storage
+from .counters import ViewCounter, view_counter
+from . import rendering
+from .rendering import cache_key, sanitize, warm
+from .search import article_index
+from . import similar
+from .similar import SimilarArticles, similar_articles
+
+
+class ArticleSearchTest(TestCase):
+    def setUp(self):
+        self.tech = User.objects.create_user(username='kbtech', password='x', role='technician')
+        self.client_user = User.objects.create_user(username='kbclient', password='x', role='client')
+        self.public = Article.objects.create(title='Reset your password', category='Accounts',
+                                             content='Open the portal and choose forgot password.',
+                                             author=self.tech, is_public=True)
+        self.private = Article.objects.create(title='Password vault procedure', category='Internal',
+                                              content='Admin steps for the vault.', author=self.tech)
+        self.other = Article.objects.create(title='Printer drivers', category='Hardware',
+                                            content='Install the driver package.', author=self.tech, is_public=True)
+
+    def titles(self, **params):
+        response = self.client.get(reverse('article_list'), params)
+        return [article.title for article in response.context['articles']]
+
+    def test_ranked_search_respects_visibility(self):
+        self.client.force_login(self.tech)
+        self.assertCountEqual(self.titles(q='password'), ['Reset your password', 'Password vault procedure'])
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.titles(q='password'), ['Reset your password'])
+        self.assertEqual(self.titles(), ['Printer drivers', 'Reset your password'])
+
+    def test_index_follows_edits_and_attachments(self):
+        self.assertEqual([pk for pk, _ in article_index.search('toner')], [])
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            Attachment.objects.create(article=self.other, file=ContentFile(b'x', name='toner.pdf'),
+                                      description='Toner replacement guide')
+        self.assertEqual([pk for pk, _ in article_index.search('toner')], [self.other.id])
+
+        self.private.is_public = True
+        self.private.save()
+        self.assertEqual(len(article_index.search('vault', is_public=1)), 1)
+        self.private.delete()
+        self.assertEqual(article_index.search('vault'), [])
+
+    def test_list_is_paginated_with_authors_joined(self):
+        Article.objects.bulk_create([
+            Article(title=f'Article {i}', category='Misc', content='Text', author=self.tech, is_public=True)
+            for i in range(30)
+        ])
+        self.client.force_login(self.tech)
+        # Session, user, count, page (authors joined)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('article_list'))
+        self.assertEqual(len(response.context['articles']), 25)
+        self.assertEqual(response.context['page'].paginator.num_pages, 2)
+
+
+class ArticleRenderingTest(TestCase):
+    def setUp(self):
+        caches['kb_render'].clear()
+        self.article = Article.objects.create(title='Guide', category='Accounts', is_public=True,
+                                              content='<p onclick="x()">Step <b>one</b></p><script>alert(1)</script>')
+
+    def tearDown(self):
+        view_counter.run_once()
+
+    def test_sanitize(self):
+        self.assertEqual(
+            sanitize('<h2>Title</h2><a href="javascript:alert(1)" onclick="x">link</a><img src="/a.png" onerror="x">'
+                     '<style>p {}</style><iframe src="https://evil"></iframe><p>a &lt; b<div>unclosed'),
+            '<h2>Title</h2><a rel="noopener noreferrer">link</a><img src="/a.png">'
+            '<p>a &lt; b<div>unclosed</div></p>',
+        )
+        self.assertEqual(sanitize('<a href="https://example.com">ok</a>'),
+                         '<a href="https://example.com" rel="noopener noreferrer">ok</a>')
+
+    def test_detail_is_rendered_once_until_saved(self):
+        caches['kb_render'].clear()
+        with mock.patch('knowledge_base.rendering.render_content', wraps=rendering.render_content) as render:
+            for _ in range(3):
+                response = self.client.get(reverse('article_detail', args=[self.article.id]))
+            self.assertEqual(render.call_count, 1)
+            self.assertContains(response, '<p>Step <b>one</b></p>', html=False)
+            self.assertNotContains(response, 'alert(1)')
+
+            self.article.content = 'Plain text\n\nSecond paragraph'
+            self.article.save()
+            response = self.client.get(reverse('article_detail', args=[self.article.id]))
+            self.assertEqual(render.call_count, 2)
+            self.assertContains(response, '<p>Second paragraph</p>', html=False)
+
+    def test_views_are_counted_in_batches(self):
+        counter = ViewCounter(interval=3600, max_pending=1000)
+        other = Article.objects.create(title='Other', category='Misc', content='Text')
+        for _ in range(5):
+            counter.record(self.article.id)
+        counter.record(other.id)
+        self.assertEqual(Article.objects.get(pk=self.article.pk).view_count, 0)
+
+        with mock.patch('knowledge_base.counters.warm'):
+            with self.assertNumQueries(2):
+                self.assertEqual(counter.run_once(), 2)
+        self.assertEqual(Article.objects.get(pk=self.article.pk).view_count, 5)
+
+    def test_due_flush_in_a_request_does_not_warm(self):
+        counter = ViewCounter(interval=3600, max_pending=3)
+        with mock.patch('knowledge_base.counters.warm') as warm_cache:
+            for _ in range(3):
+                counter.record(self.article.id)
+            self.assertEqual(Article.objects.get(pk=self.article.pk).view_count, 3)
+            warm_cache.assert_not_called()
+            counter.record(self.article.id)
+            counter.run_once()
+            warm_cache.assert_called_once()
+
+    def test_warm_renders_most_viewed(self):
+        popular = Article.objects.create(title='Popular', category='Misc', content='Read me')
+        Article.objects.filter(pk=popular.pk).update(view_count=100)
+        caches['kb_render'].clear()
+        self.assertEqual(warm(limit=1), 1)
+        self.assertIsNotNone(caches['kb_render'].get(cache_key(popular.pk)))
+        self.assertIsNone(caches['kb_render'].get(cache_key(self.article.pk)))
+        self.assertEqual(warm(limit=1), 0)
+
+
+class AttachmentDownloadTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = self.settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.tech = User.objects.create_user(username='dltech', password='x', role='technician')
+        self.client.force_login(self.tech)
+        self.article = Article.objects.create(title='Drivers', category='Hardware', content='x', is_public=True)
+        self.data = bytes(range(256)) * 40
+        self.attachment = Attachment.objects.create(article=self.article, file=ContentFile(self.data, name='setup.exe'))
+        self.url = reverse('attachment_download', args=[self.attachment.id])
+
+    def body(self, response):
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(response.is_async)
+        return async_to_sync(collect)()
+
+    def test_identical_uploads_share_one_blob(self):
+        other = Article.objects.create(title='Other', category='Hardware', content='y')
+        copy = Attachment.objects.create(article=other, file=ContentFile(self.data, name='installer.exe'))
+        self.assertEqual(copy.file.name, self.attachment.file.name)
+        self.assertEqual((copy.filename, copy.size), ('installer.exe', len(self.data)))
+        blobs = [name for _, _, names in os.walk(blob_storage.path('kb_blobs')) for name in names]
+        self.assertEqual(blobs, [self.attachment.sha256])
+
+    def test_full_download_and_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertEqual(response['ETag'], f'"{self.attachment.sha256}"')
+        self.assertIn('setup.exe', response['Content-Disposition'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(self.body(response), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(self.body(response), self.data[10000:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-16')
+        self.assertEqual(self.body(response), self.data[-16:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        # Stale If-Range: the whole (changed) file is sent instead
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.body(response)), len(self.data))
+
+    def test_private_attachment_hidden_from_clients(self):
+        Article.objects.filter(pk=self.article.pk).update(is_public=False)
+        page = reverse('article_detail', args=[self.article.pk])
+        self.addCleanup(view_counter.run_once)
+        self.assertContains(self.client.get(page), self.url)
+
+        client_user = User.objects.create_user(username='dlclient', password='x', role='client')
+        self.client.force_login(client_user)
+        self.assertEqual(self.client.get(page).status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(page).status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class AttachmentMigrationTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.legacy = tempfile.mkdtemp()
+        for path in (self.media, self.legacy):
+            self.addCleanup(shutil.rmtree, path)
+        settings = self.settings(MEDIA_ROOT=self.media, LEGACY_MEDIA_ROOT=self.legacy)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.migration = importlib.import_module('knowledge_base.migrations.0005_attachment_blobs')
+        self.schema_editor = mock.Mock(connection=connection)
+        self.article = Article.objects.create(title='Old', category='General', content='x')
+
+    def legacy_attachment(self, name, data=None):
+        if data is not None:
+            os.makedirs(os.path.join(self.legacy, 'kb_attachments'), exist_ok=True)
+            with open(os.path.join(self.legacy, 'kb_attachments', name), 'wb') as f:
+                f.write(data)
+        # A plain name is not re-stored by Attachment.save(), like a pre-migration row
+        return Attachment.objects.create(article=self.article, file=f'kb_attachments/{name}')
+
+    def test_moves_uploads_from_the_legacy_root(self):
+        attachment = self.legacy_attachment('manual.pdf', b'%PDF old upload')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.migration.move_to_blobs(django_apps, self.schema_editor)
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.sha256, hashlib.sha256(b'%PDF old upload').hexdigest())
+        self.assertEqual((attachment.filename, attachment.size), ('manual.pdf', 15))
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), b'%PDF old upload')
+        self.assertFalse(os.path.exists(os.path.join(self.legacy, 'kb_attachments', 'manual.pdf')))
+
+    def test_missing_uploads_fail_before_changing_anything(self):
+        present = self.legacy_attachment('present.txt', b'here')
+        self.legacy_attachment('gone.txt')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaisesMessage(RuntimeError, 'kb_attachments/gone.txt'):
+                self.migration.move_to_blobs(django_apps, self.schema_editor)
+        present.refresh_from_db()
+        self.assertEqual((present.sha256, present.file.name), ('', 'kb_attachments/present.txt'))
+        self.assertTrue(os.path.exists(os.path.join(self.legacy, 'kb_attachments', 'present.txt')))
+
+
+@skipUnless(similar.sparse is not None, "scipy is not installed")
+class SimilarArticlesTest(TestCase):
+    def setUp(self):
+        self.vpn = Article.objects.create(title='VPN client cannot connect', category='Network',
+                                          content='Reinstall the VPN client and check the certificate.', is_public=True)
+        self.printer = Article.objects.create(title='Printer offline', category='Hardware',
+                                              content='Restart the print spooler service.', is_public=True)
+        self.outlook = Article.objects.create(title='Outlook keeps asking for password', category='Email',
+                                              content='Clear cached credentials in <b>Credential Manager</b>.')
+        self.now = 0.0
+        self.index = SimilarArticles(refresh=300, clock=lambda: self.now)
+
+    def ids(self, text, **kwargs):
+        return [article_id for article_id, _ in self.index.search(text, **kwargs)]
+
+    def test_ranks_by_similarity(self):
+        results = self.index.search('my vpn will not connect from home')
+        self.assertEqual(results[0][0], self.vpn.id)
+        self.assertTrue(0 < results[0][1] <= 1)
+        self.assertEqual(self.ids('outlook password prompt'), [self.outlook.id])
+        self.assertEqual(self.ids('outlook password prompt', public_only=True), [])
+        self.assertEqual(self.ids('completely unrelated words'), [])
+
+    def test_incremental_updates_match_a_rebuild(self):
+        self.index.search('vpn')
+        self.printer.content = 'Printer shows offline: restart the spooler, then reconnect the VPN.'
+        self.printer.save()
+        self.index.update(self.printer)
+        added = Article.objects.create(title='Wifi drops', category='Network', content='Update the wifi driver.')
+        self.index.update(added)
+        self.index.remove(self.outlook.id)
+        self.assertEqual(self.index.stale, {self.printer.id, added.id, self.outlook.id})
+
+        incremental = self.index.search('vpn printer spooler wifi outlook')
+        self.index.compact()
+        rebuilt = self.index.search('vpn printer spooler wifi outlook')
+        self.assertEqual([pk for pk, _ in incremental], [pk for pk, _ in rebuilt])
+        for (_, a), (_, b) in zip(incremental, rebuilt):
+            self.assertAlmostEqual(a, b)
+        self.assertNotIn(self.outlook.id, [pk for pk, _ in rebuilt])
+        self.assertIn(added.id, [pk for pk, _ in rebuilt])
+
+    def test_resyncs_with_changes_from_other_processes(self):
+        self.assertEqual(self.ids('printer'), [self.printer.id])
+        Article.objects.filter(pk=self.printer.pk).delete()
+        Article.objects.create(title='Laser printer jams', category='Hardware', content='Remove the paper tray.')
+        self.assertEqual(self.ids('printer'), [self.printer.id])
+        self.now += 300
+        self.assertEqual(len(self.ids('printer')), 1)
+        self.assertNotEqual(self.ids('printer'), [self.printer.id])
+
+    def test_saves_update_the_shared_index_on_commit(self):
+        similar_articles.reset()
+        self.addCleanup(similar_articles.reset)
+        similar_articles.search('vpn')
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.create(title='Docking station', category='Hardware', content='Monitors stay black')
+        self.assertIn(article.id, similar_articles.docs)
+        with self.captureOnCommitCallbacks(execute=True):
+            article.delete()
+        self.assertNotIn(article.id, similar_articles.docs)
@@ -6,4 +6,5 @@ urlpatterns = [
     path('<int:article_id>/', views.article_detail, name='article_detail'),
     path('create/', views.article_create, name='article_create'),
     path('<int:article_id>/edit/', views.article_update, name='article_update'),
+    path('attachments/<int:attachment_id>/', views.attachment_download, name='attachment_download'),
 ]
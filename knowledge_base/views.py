@@ -1,14 +1,47 @@
+from django.core.paginator import Paginator
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
-from .models import Article
+from .models import Article, Attachment
+from . import downloads
 from .forms import ArticleForm
+from .counters import view_counter
+from .rendering import rendered
+from .search import article_index
+
+PAGE_SIZE = 25
+
+
+def public_only(user):
+    """
+    Clients (and anonymous visitors) only see public articles.
+    """
+    return not user.is_authenticated or getattr(user, 'role', 'client') == 'client'
+
 
 def article_list(request):
-    articles = Article.objects.all().order_by('-updated_at')
-    return render(request, 'knowledge_base/article_list.html', {'articles': articles})
+    """
+    Articles, most recently updated first, or ranked matches for ?q=
+    (title, category, content and attachment descriptions). Paginated with ?page=.
+    """
+    articles = Article.objects.select_related('author')
+    q = request.GET.get('q', '').strip()
+    restrict = public_only(request.user)
+    if q:
+        # Visibility is applied inside the index query, before ranking and limiting
+        articles = article_index.filter(articles, q, **({'is_public': 1} if restrict else {}))
+    else:
+        if restrict:
+            articles = articles.filter(is_public=True)
+        articles = articles.order_by('-updated_at', '-id')
+    page = Paginator(articles, PAGE_SIZE).get_page(request.GET.get('page'))
+    return render(request, 'knowledge_base/article_list.html', {'articles': page, 'page': page, 'q': q})
 
 def article_detail(request, article_id):
-    article = get_object_or_404(Article, id=article_id)
-    return render(request, 'knowledge_base/article_detail.html', {'article': article})
+    article = get_object_or_404(Article.objects.select_related('author'), id=article_id)
+    if public_only(request.user) and not article.is_public:
+        raise Http404
+    view_counter.record(article.id)
+    return render(request, 'knowledge_base/article_detail.html', {'article': article, 'content': rendered(article)})
 
 def article_create(request):
     if request.method == 'POST':
@@ -34,3 +67,18 @@ def article_update(request, article_id):
     else:
         form = ArticleForm(instance=article)
     return render(request, 'knowledge_base/article_form.html', {'form': form, 'title': 'Update Article'})
+
+def attachment_download(request, attachment_id):
+    """
+    Streams an attachment with ETag revalidation and Range support.
+    """
+    attachment = get_object_or_404(Attachment.objects.select_related('article'), id=attachment_id)
+    if public_only(request.user) and not attachment.article.is_public:
+        raise Http404
+    try:
+        file = attachment.file.open('rb')
+    except FileNotFoundError:
+        raise Http404
+    size = attachment.size or attachment.file.size
+    etag = f'"{attachment.sha256}"' if attachment.sha256 else f'"{attachment.pk}-{size}"'
+    return downloads.serve(request, file, size, etag, str(attachment), attachment.content_type or 'application/octet-stream')
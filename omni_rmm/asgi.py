@@ -10,12 +10,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'omni_rmm.settings')
 django_asgi_app = get_asgi_application()
 
 import devices.routing
+from core.background import WorkersMiddleware
 
-application = ProtocolTypeRouter({
+application = WorkersMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             devices.routing.websocket_urlpatterns
         )
     ),
-})
+}))
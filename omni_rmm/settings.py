@@ -140,6 +140,13 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Uploads (knowledge-base attachments, served by knowledge_base.views.attachment_download)
+MEDIA_URL = "media/"
+MEDIA_ROOT = Path(os.environ.get("MEDIA_ROOT", BASE_DIR / "media"))
+# Uploads made before MEDIA_ROOT was set landed in the server's working
+# directory; knowledge_base migration 0005 looks for them here
+LEGACY_MEDIA_ROOT = Path(os.environ.get("LEGACY_MEDIA_ROOT", BASE_DIR))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
@@ -152,8 +159,104 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Telemetry ingestion (write-behind buffer, see devices/ingest.py)
+TELEMETRY_FLUSH_INTERVAL_MS = int(os.environ.get("TELEMETRY_FLUSH_INTERVAL_MS", "1000"))
+TELEMETRY_FLUSH_MAX_ROWS = int(os.environ.get("TELEMETRY_FLUSH_MAX_ROWS", "500"))
+TELEMETRY_BUFFER_MAX_PENDING = int(os.environ.get("TELEMETRY_BUFFER_MAX_PENDING", "50000"))
+
+# Telemetry rollups (background compactor, see devices/rollups.py)
+ROLLUP_INTERVAL = float(os.environ.get("ROLLUP_INTERVAL", "60"))
+ROLLUP_CHUNK_SIZE = int(os.environ.get("ROLLUP_CHUNK_SIZE", "20000"))
+ROLLUP_SETTLE_SECONDS = float(os.environ.get("ROLLUP_SETTLE_SECONDS", "30"))
+
+# Telemetry retention in days, 0 keeps forever (chunked pruning, see devices/retention.py)
+TELEMETRY_RETENTION_DAYS = int(os.environ.get("TELEMETRY_RETENTION_DAYS", "7"))
+ROLLUP_RETENTION_DAYS_1M = int(os.environ.get("ROLLUP_RETENTION_DAYS_1M", "14"))
+ROLLUP_RETENTION_DAYS_1H = int(os.environ.get("ROLLUP_RETENTION_DAYS_1H", "180"))
+ROLLUP_RETENTION_DAYS_1D = int(os.environ.get("ROLLUP_RETENTION_DAYS_1D", "730"))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "3600"))
+RETENTION_CHUNK_SIZE = int(os.environ.get("RETENTION_CHUNK_SIZE", "5000"))
+RETENTION_CHUNK_PAUSE = float(os.environ.get("RETENTION_CHUNK_PAUSE", "0.05"))
+
+# Most rows a telemetry history request reads from one table before using a coarser rollup
+HISTORY_MAX_ROWS = int(os.environ.get("HISTORY_MAX_ROWS", "200000"))
+
+# Threshold alerting (see devices/alerts.py)
+ALERT_FLUSH_INTERVAL = float(os.environ.get("ALERT_FLUSH_INTERVAL", "5"))
+ALERT_RULE_REFRESH = float(os.environ.get("ALERT_RULE_REFRESH", "60"))
+
+# Offline detection for important devices (timer wheel, see devices/offline.py)
+OFFLINE_GRACE_SECONDS = int(os.environ.get("OFFLINE_GRACE_SECONDS", "60"))
+OFFLINE_CHECK_INTERVAL = float(os.environ.get("OFFLINE_CHECK_INTERVAL", "1"))
+OFFLINE_REFRESH_INTERVAL = float(os.environ.get("OFFLINE_REFRESH_INTERVAL", "60"))
+
+# Asset reachability probing (see devices/poller.py)
+ASSET_POLL_CONCURRENCY = int(os.environ.get("ASSET_POLL_CONCURRENCY", "500"))
+ASSET_PROBE_TIMEOUT = float(os.environ.get("ASSET_PROBE_TIMEOUT", "2"))
+ASSET_DOWN_AFTER = int(os.environ.get("ASSET_DOWN_AFTER", "2"))
+ASSET_HISTORY_LENGTH = int(os.environ.get("ASSET_HISTORY_LENGTH", "120"))
+ASSET_POLL_REFRESH = float(os.environ.get("ASSET_POLL_REFRESH", "60"))
+
+# Device presence (see devices/presence.py)
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", "1"))
+PRESENCE_PERSIST_INTERVAL = float(os.environ.get("PRESENCE_PERSIST_INTERVAL", "60"))
+
+# Agent handshake admission (token bucket, see devices/admission.py)
+AGENT_HANDSHAKE_RATE = float(os.environ.get("AGENT_HANDSHAKE_RATE", "50"))
+AGENT_HANDSHAKE_BURST = int(os.environ.get("AGENT_HANDSHAKE_BURST", "100"))
+AGENT_HANDSHAKE_MAX_WAIT = float(os.environ.get("AGENT_HANDSHAKE_MAX_WAIT", "5"))
+
+# Remote screen streaming: frames per second requested from agents while viewed
+SCREEN_STREAM_FPS = int(os.environ.get("SCREEN_STREAM_FPS", "5"))
+
 AUTH_USER_MODEL = 'core.User'
 
+# Caches. LocMemCache evicts least recently used entries past MAX_ENTRIES;
+# with REDIS_URL set, Redis is used instead (configure maxmemory-policy allkeys-lru).
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1000"))
+KB_RENDER_CACHE_MAX_ENTRIES = int(os.environ.get("KB_RENDER_CACHE_MAX_ENTRIES", "500"))
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.environ["REDIS_URL"]},
+        "kb_render": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.environ["REDIS_URL"], "KEY_PREFIX": "kb"},
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES}},
+        "kb_render": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "kb-render", "OPTIONS": {"MAX_ENTRIES": KB_RENDER_CACHE_MAX_ENTRIES}},
+    }
+
+# Rendered knowledge-base articles (see knowledge_base/rendering.py)
+KB_RENDER_CACHE = "kb_render"
+KB_RENDER_TTL = int(os.environ.get("KB_RENDER_TTL", "86400"))
+KB_RENDER_WARM = int(os.environ.get("KB_RENDER_WARM", "50"))
+KB_VIEW_FLUSH_INTERVAL = float(os.environ.get("KB_VIEW_FLUSH_INTERVAL", "60"))
+KB_VIEW_FLUSH_MAX = int(os.environ.get("KB_VIEW_FLUSH_MAX", "1000"))
+
+# Similar-article suggestions for tickets (in-process TF-IDF, see knowledge_base/similar.py)
+KB_SIMILAR_LIMIT = int(os.environ.get("KB_SIMILAR_LIMIT", "5"))
+KB_SIMILAR_MIN_SCORE = float(os.environ.get("KB_SIMILAR_MIN_SCORE", "0.05"))
+KB_SIMILAR_REFRESH = float(os.environ.get("KB_SIMILAR_REFRESH", "300"))
+
+# Full-text search (FTS5 on SQLite, tsvector on PostgreSQL, see core/search.py)
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "500"))
+
+# Per-status ticket counts are cached and adjusted on change (see tickets/counts.py);
+# the TTL bounds drift from bulk updates that bypass the signals
+TICKET_COUNTS_TTL = int(os.environ.get("TICKET_COUNTS_TTL", "3600"))
+
 # Email Backend (Console for Development)
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 DEFAULT_FROM_EMAIL = "noreply@omni-rmm.local"
+# Seconds before an SMTP connect or send gives up (the outbox retries later)
+EMAIL_TIMEOUT = int(os.environ.get("EMAIL_TIMEOUT", "30"))
+
+# Email outbox (background dispatcher, see core/notifications.py)
+NOTIFY_DISPATCH_INTERVAL = float(os.environ.get("NOTIFY_DISPATCH_INTERVAL", "5"))
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_DIGEST_WINDOW = int(os.environ.get("NOTIFY_DIGEST_WINDOW", "60"))
+NOTIFY_RETRY_BASE = int(os.environ.get("NOTIFY_RETRY_BASE", "30"))
+NOTIFY_RETRY_MAX = int(os.environ.get("NOTIFY_RETRY_MAX", "3600"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "8"))
+# Severities of monitoring alerts emailed to admins and technicians (comma-separated, empty disables)
+ALERT_EMAIL_SEVERITIES = [s for s in os.environ.get("ALERT_EMAIL_SEVERITIES", "critical").split(",") if s]
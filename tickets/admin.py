@@ -1,11 +1,15 @@
 from django.contrib import admin
+from core.search import IndexedSearchAdminMixin
 from .models import Ticket, TicketMessage, TimeEntry
+from .search import ticket_index
 
 @admin.register(Ticket)
-class TicketAdmin(admin.ModelAdmin):
+class TicketAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'status', 'priority', 'client', 'assigned_to', 'created_at')
     list_filter = ('status', 'priority', 'client')
+    # Searched through the full-text index; search_fields only enables the search box
     search_fields = ('title', 'description')
+    search_index = ticket_index
 
 @admin.register(TicketMessage)
 class TicketMessageAdmin(admin.ModelAdmin):
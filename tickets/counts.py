@@ -0,0 +1,63 @@
+"""
+Cached ticket counts per status.
+
+The counts are computed with one GROUP BY query when missing from the cache
+and then kept up to date by the ticket signals: a created ticket increments
+its status, a status transition moves one from the old status to the new,
+and a delete decrements. Adjustments are applied on commit, so a rolled-back
+change leaves the counts alone. The cache entries expire after
+TICKET_COUNTS_TTL seconds, which bounds drift from writes that bypass the
+signals (e.g. a plain QuerySet.update()).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Ticket
+
+PREFIX = 'tickets:status-count:'
+
+
+def _key(status):
+    return PREFIX + status
+
+
+def _ttl():
+    return getattr(settings, 'TICKET_COUNTS_TTL', 3600)
+
+
+def status_counts():
+    """
+    {status: count} for every status choice.
+    """
+    statuses = [status for status, _ in Ticket.STATUS_CHOICES]
+    cached = cache.get_many([_key(status) for status in statuses])
+    if len(cached) == len(statuses):
+        return {status: cached[_key(status)] for status in statuses}
+    return refresh()
+
+
+def refresh():
+    counts = {status: 0 for status, _ in Ticket.STATUS_CHOICES}
+    counts.update(Ticket.objects.order_by().values_list('status').annotate(count=Count('id')))
+    cache.set_many({_key(status): count for status, count in counts.items()}, _ttl())
+    return counts
+
+
+def open_count():
+    return sum(count for status, count in status_counts().items() if status != 'closed')
+
+
+def adjust(status, delta):
+    """
+    Adds `delta` to the cached count of `status` once the transaction commits.
+    """
+    def apply():
+        try:
+            cache.incr(_key(status), delta)
+        except ValueError:
+            # Not cached: the next read recounts everything
+            cache.delete_many([_key(s) for s, _ in Ticket.STATUS_CHOICES])
+
+    transaction.on_commit(apply)
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:00
+
+from collections import defaultdict
+
+from django.db import migrations
+
+# The index schema as of this migration, frozen here rather than taken from
+# tickets.search so that replaying the migration always builds the same table
+SQLITE_TABLE = "CREATE VIRTUAL TABLE tickets_search USING fts5(title, description, messages, tokenize='porter unicode61')"
+SQLITE_INSERT = "INSERT INTO tickets_search (rowid, title, description, messages) VALUES (%s, %s, %s, %s)"
+PG_TABLE = "CREATE TABLE tickets_search (object_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+PG_INDEX = "CREATE INDEX tickets_search_document_idx ON tickets_search USING GIN (document)"
+PG_INSERT = (
+    "INSERT INTO tickets_search (object_id, document) VALUES (%s, "
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B') || "
+    "setweight(to_tsvector('english', %s), 'C'))"
+)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE)
+        insert = SQLITE_INSERT
+    elif vendor == 'postgresql':
+        schema_editor.execute(PG_TABLE)
+        schema_editor.execute(PG_INDEX)
+        insert = PG_INSERT
+    else:
+        return
+    Ticket = apps.get_model('tickets', 'Ticket')
+    TicketMessage = apps.get_model('tickets', 'TicketMessage')
+    messages = defaultdict(list)
+    for ticket_id, content in TicketMessage.objects.order_by('pk').values_list('ticket_id', 'content'):
+        messages[ticket_id].append(content)
+    rows = [(pk, title or '', description or '', '\n'.join(messages[pk]))
+            for pk, title, description in Ticket.objects.values_list('pk', 'title', 'description')]
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(insert, rows)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS tickets_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0002_ticket_queue_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
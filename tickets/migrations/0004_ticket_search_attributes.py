@@ -0,0 +1,88 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:00
+
+from collections import defaultdict
+
+from django.db import migrations
+
+# The index schema as of this migration, frozen here rather than taken from
+# tickets.search so that replaying the migration always builds the same table.
+# The table gains the list filters as integer attributes: choices by position
+# from 1 (0 is empty), user ids (0 when unassigned).
+STATUS_CODES = {'new': 1, 'open': 2, 'in_progress': 3, 'resolved': 4, 'closed': 5}
+PRIORITY_CODES = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
+
+SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE tickets_search USING fts5(title, description, messages, status UNINDEXED, "
+    "priority UNINDEXED, assigned_to UNINDEXED, client UNINDEXED, tokenize='porter unicode61')"
+)
+SQLITE_INSERT = (
+    "INSERT INTO tickets_search (rowid, title, description, messages, status, priority, assigned_to, client) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+)
+PG_TABLE = (
+    "CREATE TABLE tickets_search (object_id bigint PRIMARY KEY, document tsvector NOT NULL, "
+    "status integer, priority integer, assigned_to integer, client integer)"
+)
+PG_INDEX = "CREATE INDEX tickets_search_document_idx ON tickets_search USING GIN (document)"
+PG_INSERT = (
+    "INSERT INTO tickets_search (object_id, document, status, priority, assigned_to, client) VALUES (%s, "
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B') || "
+    "setweight(to_tsvector('english', %s), 'C'), %s, %s, %s, %s)"
+)
+
+# The table of 0003_ticket_search, for reversing
+PREVIOUS_SQLITE_TABLE = "CREATE VIRTUAL TABLE tickets_search USING fts5(title, description, messages, tokenize='porter unicode61')"
+PREVIOUS_SQLITE_INSERT = "INSERT INTO tickets_search (rowid, title, description, messages) VALUES (%s, %s, %s, %s)"
+PREVIOUS_PG_TABLE = "CREATE TABLE tickets_search (object_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+PREVIOUS_PG_INSERT = (
+    "INSERT INTO tickets_search (object_id, document) VALUES (%s, "
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B') || "
+    "setweight(to_tsvector('english', %s), 'C'))"
+)
+
+
+def documents(apps):
+    Ticket = apps.get_model('tickets', 'Ticket')
+    TicketMessage = apps.get_model('tickets', 'TicketMessage')
+    messages = defaultdict(list)
+    for ticket_id, content in TicketMessage.objects.order_by('pk').values_list('ticket_id', 'content'):
+        messages[ticket_id].append(content)
+    rows = Ticket.objects.values_list('pk', 'title', 'description', 'status', 'priority', 'assigned_to_id', 'client_id')
+    for pk, title, description, status, priority, assigned_to_id, client_id in rows:
+        yield (pk, title or '', description or '', '\n'.join(messages[pk]),
+               STATUS_CODES.get(status, 0), PRIORITY_CODES.get(priority, 0), assigned_to_id or 0, client_id or 0)
+
+
+def rebuild(schema_editor, sqlite, postgresql, rows):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS tickets_search")
+    table, insert = sqlite if vendor == 'sqlite' else postgresql
+    schema_editor.execute(table)
+    if vendor == 'postgresql':
+        schema_editor.execute(PG_INDEX)
+    rows = list(rows)
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(insert, rows)
+
+
+def add_attributes(apps, schema_editor):
+    rebuild(schema_editor, (SQLITE_TABLE, SQLITE_INSERT), (PG_TABLE, PG_INSERT), documents(apps))
+
+
+def remove_attributes(apps, schema_editor):
+    rebuild(schema_editor, (PREVIOUS_SQLITE_TABLE, PREVIOUS_SQLITE_INSERT), (PREVIOUS_PG_TABLE, PREVIOUS_PG_INSERT),
+            (row[:4] for row in documents(apps)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0003_ticket_search"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_attributes, remove_attributes),
+    ]
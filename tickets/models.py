@@ -1,8 +1,9 @@
 from django.db import models
 from django.conf import settings
+from core.tracking import TrackedFieldsMixin
 from devices.models import Device
 
-class Ticket(models.Model):
+class Ticket(TrackedFieldsMixin, models.Model):
     STATUS_CHOICES = (
         ('new', 'New'),
         ('open', 'Open'),
@@ -31,6 +32,17 @@ class Ticket(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     closed_at = models.DateTimeField(blank=True, null=True)
 
+    # Transitions are sent as core.tracking.field_changed (see tickets/signals.py)
+    tracked_fields = ('status', 'priority', 'assigned_to', 'client', 'title', 'description')
+
+    class Meta:
+        indexes = [
+            # Ticket queue: newest first, filtered by status or assignee
+            models.Index(fields=['status', 'created_at'], name='ticket_status_created_idx'),
+            models.Index(fields=['assigned_to', 'status'], name='ticket_assignee_status_idx'),
+            models.Index(fields=['created_at'], name='ticket_created_idx'),
+        ]
+
     def __str__(self):
         return f"#{self.id} - {self.title}"
 
@@ -0,0 +1,78 @@
+"""
+Full-text index of tickets: title, description and the text of every message.
+The queue filters (status, priority, assignee, client) are stored in the index,
+so a filtered search is narrowed inside the index query rather than after the
+ranking. Kept current by the ticket signals (see tickets/signals.py).
+"""
+from collections import defaultdict
+
+from core import search
+from .models import Ticket, TicketMessage
+
+# Index attributes are integers: choices are stored by position, from 1 (0 is
+# empty). Reordering a choices list needs `manage.py rebuild_search_index`.
+STATUS_CODES = {value: code for code, (value, _) in enumerate(Ticket.STATUS_CHOICES, 1)}
+PRIORITY_CODES = {value: code for code, (value, _) in enumerate(Ticket.PRIORITY_CHOICES, 1)}
+
+FIELDS = ('pk', 'title', 'description', 'status', 'priority', 'assigned_to_id', 'client_id')
+
+
+def ticket_attributes(status, priority, assigned_to_id, client_id):
+    return {
+        'status': STATUS_CODES.get(status, 0),
+        'priority': PRIORITY_CODES.get(priority, 0),
+        'assigned_to': assigned_to_id,
+        'client': client_id,
+    }
+
+
+class TicketIndex(search.SearchIndex):
+    table = 'tickets_search'
+    model = Ticket
+    columns = ('title', 'description', 'messages')
+    weights = (10.0, 4.0, 1.0)
+    attributes = ('status', 'priority', 'assigned_to', 'client')
+
+    def documents(self, pks=None):
+        tickets = Ticket.objects.order_by('pk')
+        messages = TicketMessage.objects.order_by('pk')
+        if pks is not None:
+            tickets = tickets.filter(pk__in=pks)
+            messages = messages.filter(ticket_id__in=pks)
+            by_ticket = defaultdict(list)
+            for ticket_id, content in messages.values_list('ticket_id', 'content'):
+                by_ticket[ticket_id].append(content)
+            for pk, title, description, *attributes in tickets.values_list(*FIELDS):
+                yield pk, {'title': title, 'description': description, 'messages': '\n'.join(by_ticket[pk])}, \
+                    ticket_attributes(*attributes)
+            return
+        # Full rebuild: walk both tables in ticket order instead of holding every message
+        message_rows = messages.order_by('ticket_id', 'pk').values_list('ticket_id', 'content').iterator()
+        pending = next(message_rows, None)
+        for pk, title, description, *attributes in tickets.values_list(*FIELDS).iterator():
+            texts = []
+            while pending is not None and pending[0] <= pk:
+                if pending[0] == pk:
+                    texts.append(pending[1])
+                pending = next(message_rows, None)
+            yield pk, {'title': title, 'description': description, 'messages': '\n'.join(texts)}, \
+                ticket_attributes(*attributes)
+
+    def filters(self, status=None, priority=None, assigned_to=None, client=None):
+        """
+        search() keyword arguments for the ticket list filters; an unassigned
+        ticket is stored with assignee 0. Unknown choices match nothing.
+        """
+        filters = {}
+        if status:
+            filters['status'] = STATUS_CODES.get(status, -1)
+        if priority:
+            filters['priority'] = PRIORITY_CODES.get(priority, -1)
+        if assigned_to is not None:
+            filters['assigned_to'] = assigned_to
+        if client is not None:
+            filters['client'] = client
+        return filters
+
+
+ticket_index = search.register(TicketIndex())
@@ -1,20 +1,56 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Ticket
-
-@receiver(pre_save, sender=Ticket)
-def notify_on_close(sender, instance, **kwargs):
-    if instance.id:
-        old_ticket = Ticket.objects.get(id=instance.id)
-        if old_ticket.status != 'closed' and instance.status == 'closed':
-            # Status changed to closed
-            if instance.client and instance.client.email:
-                send_mail(
-                    f"Ticket Closed: #{instance.id} - {instance.title}",
-                    f"Your ticket has been marked as closed.\n\nDescription: {instance.description}\n\nResolution: (Check ticket details)",
-                    settings.DEFAULT_FROM_EMAIL,
-                    [instance.client.email],
-                    fail_silently=False,
-                )
+from core.notifications import notify
+from core.tracking import field_changed
+from . import counts
+from .models import Ticket, TicketMessage
+from .search import ticket_index
+
+# Ticket fields stored in the search index, as text or as filter attributes
+INDEXED_FIELDS = ('title', 'description', 'status', 'priority', 'assigned_to', 'client')
+
+@receiver(field_changed, sender=Ticket)
+def notify_on_close(sender, instance, field, old, new, **kwargs):
+    if field == 'status' and old != 'closed' and new == 'closed':
+        # Status changed to closed; goes to the outbox, sent in the background
+        if instance.client and instance.client.email:
+            notify(
+                [instance.client.email],
+                f"Ticket Closed: #{instance.id} - {instance.title}",
+                f"Your ticket has been marked as closed.\n\nDescription: {instance.description}\n\nResolution: (Check ticket details)",
+            )
+
+@receiver(field_changed, sender=Ticket)
+def count_status_change(sender, instance, field, old, new, **kwargs):
+    if field == 'status':
+        counts.adjust(old, -1)
+        counts.adjust(new, 1)
+
+@receiver(post_save, sender=Ticket)
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        counts.adjust(instance.status, 1)
+
+@receiver(post_delete, sender=Ticket)
+def count_deleted(sender, instance, **kwargs):
+    counts.adjust(instance.previous('status') or instance.status, -1)
+
+@receiver(post_save, sender=Ticket)
+def index_ticket(sender, instance, created, **kwargs):
+    if created or any(instance.has_changed(field) for field in INDEXED_FIELDS):
+        ticket_index.refresh([instance.pk])
+
+@receiver(field_changed, sender=Ticket)
+def index_bulk_change(sender, instance, field, old, new, bulk=False, **kwargs):
+    # tracked_update() sends no post_save
+    if bulk and field in INDEXED_FIELDS:
+        ticket_index.refresh([instance.pk])
+
+@receiver(post_delete, sender=Ticket)
+def unindex_ticket(sender, instance, **kwargs):
+    ticket_index.delete([instance.pk])
+
+@receiver(post_save, sender=TicketMessage)
+@receiver(post_delete, sender=TicketMessage)
+def index_ticket_messages(sender, instance, **kwargs):
+    ticket_index.refresh([instance.ticket_id])
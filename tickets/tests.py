@@ -1,8 +1,22 @@
-from django.test import TestCase
+import importlib
+from unittest import mock, skipUnless
+from django.test import TestCase, override_settings
+from django.apps import apps as django_apps
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.urls import reverse
+from core.models import Notification
+from core.notifications import NotificationDispatcher
+from core.tracking import tracked_update
 from devices.models import Device
-from .models import Ticket
+from knowledge_base import similar
+from knowledge_base.models import Article
+from knowledge_base.similar import similar_articles
+from . import counts
+from .models import Ticket, TicketMessage
+from .search import STATUS_CODES, ticket_index
 
 User = get_user_model()
 
@@ -74,7 +88,224 @@ class TicketModelTest(TestCase):
         ticket.status = 'closed'
         ticket.save()
 
+        # Queued in the outbox, delivered by the dispatcher
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Notification.objects.filter(recipient=self.client_user.email).count(), 1)
+        NotificationDispatcher().run_once()
+
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn("Ticket Closed", mail.outbox[0].subject)
         self.assertIn(ticket.title, mail.outbox[0].subject)
         self.assertEqual(mail.outbox[0].to, [self.client_user.email])
+
+    def test_change_tracking(self):
+        ticket = Ticket.objects.create(title='Tracked', description='', client=self.client_user)
+        ticket = Ticket.objects.get(id=ticket.id)
+        self.assertFalse(ticket.has_changed('status'))
+
+        ticket.status = 'in_progress'
+        ticket.assigned_to = self.technician_user
+        self.assertTrue(ticket.has_changed('status'))
+        self.assertEqual(ticket.previous('status'), 'new')
+        self.assertEqual(set(ticket.changed_fields()), {'status', 'assigned_to'})
+
+        # The UPDATE, then the search index refresh for the new status and
+        # assignee (messages, ticket row, delete, insert); the old status is not re-read
+        with self.assertNumQueries(5):
+            ticket.save()
+        self.assertFalse(ticket.has_changed('status'))
+        self.assertEqual(ticket.previous('status'), 'in_progress')
+
+    def test_bulk_close_sends_transition_events(self):
+        for i in range(3):
+            Ticket.objects.create(title=f'Bulk {i}', description='', client=self.client_user, status='resolved')
+        Ticket.objects.create(title='Already closed', description='', client=self.client_user, status='closed')
+
+        self.assertEqual(tracked_update(Ticket.objects.all(), status='closed'), 4)
+        self.assertEqual(Ticket.objects.filter(status='closed').count(), 4)
+        self.assertEqual(Notification.objects.count(), 3)
+
+
+class TicketQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_user = User.objects.create_user(username='queueclient', password='x', role='client')
+        self.tech = User.objects.create_user(username='queuetech', password='x', role='technician')
+        Ticket.objects.bulk_create([
+            Ticket(title=f'Ticket {i}', description='', client=self.client_user,
+                   status='open' if i % 3 else 'new', priority='high' if i % 2 else 'low',
+                   assigned_to=self.tech if i % 4 == 0 else None)
+            for i in range(120)
+        ])
+        cache.clear()
+
+    def pages(self, query=''):
+        ids, url = [], reverse('ticket_list') + '?' + query
+        while url:
+            response = self.client.get(url)
+            ids.extend(ticket.id for ticket in response.context['tickets'])
+            cursor = response.context['next_cursor']
+            url = f"{reverse('ticket_list')}?{response.context['query']}&after={cursor}" if cursor else None
+        return ids
+
+    def test_keyset_pages_cover_queue_once(self):
+        ids = self.pages('page_size=25')
+        self.assertEqual(ids, list(Ticket.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_filters(self):
+        ids = self.pages('status=open&priority=high&assigned_to=none')
+        expected = Ticket.objects.filter(status='open', priority='high', assigned_to__isnull=True)
+        self.assertEqual(sorted(ids), sorted(expected.values_list('id', flat=True)))
+        self.assertEqual(len(self.pages(f'assigned_to={self.tech.id}')), 30)
+
+    def test_page_queries_do_not_grow_with_rows(self):
+        counts.status_counts()
+        # Page (users joined), technicians for the filter
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('ticket_list'))
+        self.assertEqual(len(response.context['tickets']), 50)
+
+    def test_status_counts_follow_changes(self):
+        self.assertEqual(counts.status_counts()['new'], 40)
+        ticket = Ticket.objects.filter(status='new').first()
+        with self.assertNumQueries(0):
+            counts.status_counts()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.status = 'closed'
+            ticket.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='New one', description='', client=self.client_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.filter(status='open').first().delete()
+
+        with self.assertNumQueries(0):
+            by_status = counts.status_counts()
+        self.assertEqual((by_status['new'], by_status['open'], by_status['closed']), (40, 79, 1))
+        self.assertEqual(by_status, counts.refresh())
+
+
+class TicketSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='x', role='technician')
+        self.in_title = Ticket.objects.create(title='Printer offline', description='Floor 2', client=self.user)
+        self.in_description = Ticket.objects.create(title='Office issue', description='The printer shows an error', client=self.user)
+        self.unrelated = Ticket.objects.create(title='VPN drops', description='Every hour', client=self.user)
+
+    def ids(self, query):
+        return [pk for pk, _ in ticket_index.search(query)]
+
+    def test_ranked_and_prefix_matches(self):
+        self.assertEqual(self.ids('printer'), [self.in_title.id, self.in_description.id])
+        self.assertEqual(self.ids('print'), [self.in_title.id, self.in_description.id])
+        self.assertEqual(self.ids('printer error'), [self.in_description.id])
+        self.assertEqual(self.ids('"; DROP TABLE x --'), [])
+
+    def test_index_follows_changes(self):
+        message = TicketMessage.objects.create(ticket=self.unrelated, author=self.user, content='Replaced the firewall')
+        self.assertEqual(self.ids('firewall'), [self.unrelated.id])
+        message.delete()
+        self.assertEqual(self.ids('firewall'), [])
+
+        self.in_title.title = 'Scanner offline'
+        self.in_title.save()
+        self.assertEqual(self.ids('scanner'), [self.in_title.id])
+        self.assertEqual(self.ids('printer'), [self.in_description.id])
+
+        self.in_description.delete()
+        self.assertEqual(self.ids('printer'), [])
+        self.assertEqual(ticket_index.rebuild(), 2)
+        self.assertEqual(self.ids('offline'), [self.in_title.id])
+
+    def test_list_and_admin_search(self):
+        response = self.client.get(reverse('ticket_list'), {'q': 'printer'})
+        self.assertEqual([t.id for t in response.context['tickets']], [self.in_title.id, self.in_description.id])
+
+        admin = User.objects.create_superuser(username='admin', password='x', email='admin@example.com')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:tickets_ticket_changelist'), {'q': 'vpn'})
+        self.assertEqual([t.id for t in response.context['cl'].result_list], [self.unrelated.id])
+
+    @override_settings(SEARCH_MAX_RESULTS=3)
+    def test_list_filters_apply_inside_the_index(self):
+        for n in range(5):
+            Ticket.objects.create(title=f'Printer printer jam {n}', description='printer', status='closed', client=self.user)
+        tech = User.objects.create_user(username='searchtech', password='x', role='technician')
+        self.in_description.assigned_to = tech
+        self.in_description.save()
+        tracked_update(Ticket.objects.filter(pk=self.in_title.pk), status='open')
+
+        def listed(**params):
+            response = self.client.get(reverse('ticket_list'), {'q': 'printer', **params})
+            return [t.id for t in response.context['tickets']]
+
+        self.assertEqual(listed(status='open'), [self.in_title.id])
+        self.assertEqual(listed(status='new'), [self.in_description.id])
+        self.assertEqual(listed(assigned_to=tech.id), [self.in_description.id])
+        self.assertEqual(listed(assigned_to='none', priority='medium', client=self.user.id, status='open'), [self.in_title.id])
+        self.assertEqual(listed(status='bogus'), [])
+
+
+class TicketSearchMigrationTest(TestCase):
+    def columns(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM tickets_search LIMIT 0")
+            return [column[0] for column in cursor.description]
+
+    def test_migrations_build_their_own_schema(self):
+        user = User.objects.create_user(username='migrated', password='x')
+        ticket = Ticket.objects.create(title='Printer jam', description='', status='open', client=user)
+        initial = importlib.import_module('tickets.migrations.0003_ticket_search')
+        attributes = importlib.import_module('tickets.migrations.0004_ticket_search_attributes')
+        with connection.cursor() as cursor:
+            schema_editor = mock.Mock(connection=connection, execute=cursor.execute)
+            initial.drop_index(django_apps, schema_editor)
+            initial.create_index(django_apps, schema_editor)
+            self.assertEqual(self.columns(), ['title', 'description', 'messages'])
+
+            attributes.add_attributes(django_apps, schema_editor)
+            self.assertEqual(self.columns()[-4:], list(ticket_index.attributes))
+            self.assertEqual(attributes.STATUS_CODES, STATUS_CODES)
+            self.assertEqual([pk for pk, _ in ticket_index.search('printer', status=STATUS_CODES['open'], client=user.id)],
+                             [ticket.id])
+
+            attributes.remove_attributes(django_apps, schema_editor)
+            self.assertEqual(self.columns(), ['title', 'description', 'messages'])
+            attributes.add_attributes(django_apps, schema_editor)
+
+
+@skipUnless(similar.sparse is not None, "scipy is not installed")
+class TicketSuggestionTest(TestCase):
+    def setUp(self):
+        similar_articles.reset()
+        self.addCleanup(similar_articles.reset)
+        self.client_user = User.objects.create_user(username='sugclient', password='x', role='client')
+        self.public = Article.objects.create(title='Reset a forgotten password', category='Accounts',
+                                             content='Use the self-service portal to reset your password.', is_public=True)
+        self.private = Article.objects.create(title='Unlock a locked password account', category='Accounts',
+                                              content='Unlock the account in Active Directory.')
+        Article.objects.create(title='Printer offline', category='Hardware', content='Restart the spooler.', is_public=True)
+        self.ticket = Ticket.objects.create(title='Forgot my password', description='Account locked after password attempts',
+                                            client=self.client_user)
+
+    def test_detail_and_api_show_suggestions(self):
+        tech = User.objects.create_user(username='sugtech', password='x', role='technician')
+        self.client.force_login(tech)
+        response = self.client.get(reverse('ticket_detail', args=[self.ticket.id]))
+        self.assertContains(response, 'Suggested Articles')
+        self.assertContains(response, 'Reset a forgotten password')
+
+        data = self.client.get(reverse('ticket_suggestions', args=[self.ticket.id])).json()
+        self.assertEqual(data['ticket'], self.ticket.id)
+        self.assertCountEqual([a['id'] for a in data['articles']], [self.public.id, self.private.id])
+        self.assertEqual(data['articles'][0]['url'], reverse('article_detail', args=[data['articles'][0]['id']]))
+
+        data = self.client.get(reverse('ticket_suggestions', args=[self.ticket.id]), {'limit': 1}).json()
+        self.assertEqual(len(data['articles']), 1)
+        response = self.client.get(reverse('ticket_suggestions', args=[self.ticket.id]), {'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_clients_only_see_public_articles(self):
+        self.client.force_login(self.client_user)
+        data = self.client.get(reverse('ticket_suggestions', args=[self.ticket.id])).json()
+        self.assertEqual([a['id'] for a in data['articles']], [self.public.id])
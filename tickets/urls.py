@@ -4,5 +4,6 @@ from . import views
 urlpatterns = [
     path('', views.ticket_list, name='ticket_list'),
     path('<int:ticket_id>/', views.ticket_detail, name='ticket_detail'),
+    path('<int:ticket_id>/suggestions/', views.ticket_suggestions, name='ticket_suggestions'),
     path('create/', views.ticket_create, name='ticket_create'),
 ]
@@ -1,15 +1,112 @@
+import base64
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from . import counts
 from .models import Ticket
 from .forms import TicketForm, TicketMessageForm
+from .search import ticket_index
+from knowledge_base.similar import similar_articles
+from knowledge_base.views import public_only
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(ticket):
+    return base64.urlsafe_b64encode(f"{ticket.created_at.isoformat()}|{ticket.id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns (created_at, id) of the last ticket on the previous page, or None.
+    """
+    try:
+        created_at, ticket_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        return (created_at, int(ticket_id)) if created_at else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
 
 def ticket_list(request):
-    status = request.GET.get('status')
-    if status:
-        tickets = Ticket.objects.filter(status=status)
+    """
+    Ticket queue, newest first, with keyset pagination: ?after= is a cursor
+    naming the last row shown, so each page is an index range scan whatever
+    the depth. Filters: ?status=, ?priority=, ?assigned_to= (user id or
+    "none"), ?client= (user id). ?q= searches title, description and
+    messages through the full-text index, which also applies the filters;
+    results come ranked, best first, on a single page.
+    """
+    tickets = Ticket.objects.select_related('assigned_to', 'client')
+    filters = {}
+    # The same filters for a ?q= search, applied inside the index query
+    index_filters = {}
+    for name in ('status', 'priority'):
+        value = request.GET.get(name)
+        if value:
+            tickets = tickets.filter(**{name: value})
+            filters[name] = value
+            index_filters[name] = value
+    assigned_to = request.GET.get('assigned_to')
+    if assigned_to == 'none':
+        tickets = tickets.filter(assigned_to__isnull=True)
+        filters['assigned_to'] = assigned_to
+        index_filters['assigned_to'] = 0
+    elif assigned_to and assigned_to.isdigit():
+        tickets = tickets.filter(assigned_to_id=assigned_to)
+        filters['assigned_to'] = assigned_to
+        index_filters['assigned_to'] = int(assigned_to)
+    client = request.GET.get('client')
+    if client and client.isdigit():
+        tickets = tickets.filter(client_id=client)
+        filters['client'] = client
+        index_filters['client'] = int(client)
+
+    q = request.GET.get('q', '').strip()
+    if q:
+        filters['q'] = q
+    cursor = None if q else decode_cursor(request.GET.get('after', ''))
+    if cursor:
+        created_at, ticket_id = cursor
+        tickets = tickets.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=ticket_id))
+    try:
+        page_size = min(max(int(request.GET.get('page_size', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = PAGE_SIZE
+
+    if q:
+        page, next_cursor = list(ticket_index.filter(tickets, q, **ticket_index.filters(**index_filters))[:page_size]), None
     else:
-        tickets = Ticket.objects.all()
-    tickets = tickets.order_by('-created_at')
-    return render(request, 'tickets/ticket_list.html', {'tickets': tickets})
+        # One row past the page tells whether there is a next page
+        page = list(tickets.order_by('-created_at', '-id')[:page_size + 1])
+        next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        page = page[:page_size]
+
+    by_status = counts.status_counts()
+    User = get_user_model()
+    return render(request, 'tickets/ticket_list.html', {
+        'tickets': page,
+        'filters': filters,
+        'query': urlencode(filters),
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+        'status_counts': [(status, label, by_status[status]) for status, label in Ticket.STATUS_CHOICES],
+        'priorities': Ticket.PRIORITY_CHOICES,
+        'technicians': User.objects.filter(role__in=('admin', 'technician')).order_by('username'),
+    })
+
+def suggested_articles(request, ticket, limit=None):
+    """
+    [(Article, score)] from the knowledge base that look like answers to the
+    ticket, best first; clients only get public articles.
+    """
+    return similar_articles.suggest(f"{ticket.title}\n{ticket.description}", limit, public_only(request.user))
 
 def ticket_detail(request, ticket_id):
     ticket = get_object_or_404(Ticket, id=ticket_id)
@@ -31,7 +128,32 @@ def ticket_detail(request, ticket_id):
     else:
         form = TicketMessageForm()
 
-    return render(request, 'tickets/ticket_detail.html', {'ticket': ticket, 'form': form})
+    return render(request, 'tickets/ticket_detail.html', {
+        'ticket': ticket,
+        'form': form,
+        'suggestions': suggested_articles(request, ticket),
+    })
+
+def ticket_suggestions(request, ticket_id):
+    """
+    Knowledge-base articles similar to the ticket, as JSON. ?limit= caps the
+    number returned (default KB_SIMILAR_LIMIT).
+    """
+    ticket = get_object_or_404(Ticket, id=ticket_id)
+    try:
+        limit = min(max(int(request.GET.get('limit', 0)), 0), 50) or None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit must be a number'}, status=400)
+    return JsonResponse({
+        'ticket': ticket.id,
+        'articles': [{
+            'id': article.id,
+            'title': article.title,
+            'category': article.category,
+            'score': round(score, 4),
+            'url': reverse('article_detail', args=[article.id]),
+        } for article, score in suggested_articles(request, ticket, limit)],
+    })
 
 def ticket_create(request):
     if request.method == 'POST':